@@ -38,6 +38,7 @@ metadata = {
 def get_values(*names):
     import json
     _all_values = json.loads("""{
+        "pipette_type":"p300_multi_gen2",
         "pipette_mount":"right",
         "input_plate_type":"biorad_96_wellplate_200ul_pcr",
         "output_plate_type":"opentrons_96_aluminumblock_generic_pcr_strip_200ul",
@@ -76,6 +77,7 @@ def run(ctx):
         incubation_time,
         capture_time,
         drying_time] = get_values(  # noqa: F821
+        "pipette_type",
         "pipette_mount",
         "input_plate_type",
         "output_plate_type",
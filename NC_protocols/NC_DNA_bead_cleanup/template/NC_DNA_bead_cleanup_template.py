@@ -38,6 +38,7 @@ metadata = {
 def get_values(*names):
     import json
     _all_values = json.loads("""{
+        "pipette_type":"<pipette_type>",
         "pipette_mount":"<pipette_mount>",
         "input_plate_type":"<input_plate_type>",
         "output_plate_type":"<output_plate_type>",
@@ -76,6 +77,7 @@ def run(ctx):
         incubation_time,
         capture_time,
         drying_time] = get_values(  # noqa: F821
+        "pipette_type",
         "pipette_mount",
         "input_plate_type",
         "output_plate_type",
@@ -1,6 +1,7 @@
 from opentrons import protocol_api
 import math
 import csv
+import io
 
 metadata = {
         'protocolName': 'dilute_96w_plate',
@@ -23,14 +24,553 @@ def get_values(*names):
         "tube_rack":"opentrons_24_tuberack_eppendorf_1.5ml_safelock_snapcap",
         "buf_vol":"1000.0",
         "min_vol":"2.0",
+        "max_vol":"100.0",
         "max_dil":"20.0",
         "min_fin":"20.0",
         "pspeed":"24.0",
         "mix_times":"4",
+        "predispense":"true",
+        "disposal_vol":"2.0",
+        "multi_mount":"none",
+        "labware_reservoir":"nest_12_reservoir_15ml",
+        "two_step_split":"optimal",
         "uploaded_csv":"Position,Dilution\\nA1,1.0\\nA2,1.0\\nA3,1.0\\nA4,1.0\\nA5,1.0\\nA6,1.0\\nA7,1.0\\nA8,1.0\\nA9,1.0\\nA10,1.0\\nA11,1.0\\nA12,1.0\\nB1,1.0\\nB2,1.0\\nB3,1.0\\nB4,1.0\\nB5,1.0\\nB6,1.0\\nB7,1.0\\nB8,1.0\\nB9,1.0\\nB10,1.0\\nB11,1.0\\nB12,1.0\\nC1,18.0\\nC2,19.1\\nC3,13.1\\nC4,15.8\\nC5,12.8\\nC6,10.0\\nC7,3.9\\nC8,6.4\\nC9,12.0\\nC10,17.8\\nC11,8.7\\nC12,15.3\\nD1,1.1\\nD2,15.9\\nD3,15.5\\nD4,19.2\\nD5,12.7\\nD6,17.5\\nD7,3.8\\nD8,7.6\\nD9,2.0\\nD10,4.0\\nD11,18.8\\nD12,5.5\\nE1,30.0\\nE2,22.0\\nE3,20.3\\nE4,24.5\\nE5,33.2\\nE6,27.5\\nE7,38.8\\nE8,36.1\\nE9,24.3\\nE10,31.2\\nE11,29.6\\nE12,29.5\\nF1,37.1\\nF2,34.0\\nF3,24.9\\nF4,36.0\\nF5,39.4\\nF6,22.5\\nF7,39.1\\nF8,26.0\\nF9,26.1\\nF10,27.1\\nF11,23.0\\nF12,25.5\\nG1,67.5\\nG2,48.5\\nG3,73.1\\nG4,77.0\\nG5,76.0\\nG6,77.1\\nG7,59.3\\nG8,46.7\\nG9,62.8\\nG10,52.7\\nG11,46.0\\nG12,66.4\\nH1,47.4\\nH2,65.2\\nH3,77.1\\nH4,48.4\\nH5,64.9\\nH6,43.9\\nH7,44.8\\nH8,72.7\\nH9,49.8\\nH10,70.8\\nH11,64.9\\nH12,44.3"
         }""")
     return [_all_values[n] for n in names]
 
+# buffer tubes on top row of the tube rack [A1 A2 A3 A4 A5 A6]
+buffer_wells = ['A1', 'A2', 'A3', 'A4', 'A5', 'A6']
+
+# volume held by the filter tips
+tip_capacity = {"p20": 20.0, "p300": 200.0}
+
+# columns of the transfer plan (one row per pipetting step)
+plan_columns = ['step', 'aspiration', 'round', 'plate', 'position', 'dilution', 'route', 'factor', 'source',
+                'source_well', 'dest', 'dest_well', 'volume', 'pipette', 'channels', 'tip',
+                'mix_times', 'mix_vol']
+
+# buffer sources: tubes in the tube rack (single channel) and the first
+# reservoir column (multichannel)
+buffer_sources = ['buffer', 'reservoir']
+
+# deck slots: the tube rack is on #4 and the multichannel reservoir on #5
+# the plates (source, dilution, target) take the slots in plate_slot_order,
+# the tip racks take the free slots in tip_slot_order
+plate_slot_order = ['1', '2', '3', '5', '6', '9', '11', '10', '8', '7']
+tip_slot_order = ['7', '8', '10', '11', '9', '6', '5', '3', '2']
+
+# tips in one rack
+rack_tips = 96
+
+###################################################
+# transfer plan
+# the CSV is turned into the list of pipetting steps
+# used for the buffer estimate and for the run
+# the plan can be exported with:
+#   python3 dilute_96w_plate.py > dilute_plan.csv
+###################################################
+
+def read_csv_data(uploaded_csv):
+    # csv as list of dictionaries
+    return [line for line in csv.DictReader(uploaded_csv.splitlines())]
+
+def csv_plates(tfers):
+    # csv rows per plate {plate: [(position, dilution), ...]} in csv order
+    # the 'Plate' column is optional, all rows are then on plate '1'
+    plates = {}
+    for tfer in tfers:
+        if not tfer['Position'] or not tfer['Dilution']:
+            continue
+        plate = tfer.get('Plate', '1')
+        if plate is None or not plate.strip():
+            usrmsg = (
+                'the csv row for ' + tfer['Position'] + ' has no Plate name'
+                )
+            raise Exception(usrmsg)
+        plates.setdefault(plate.strip(), []).append(
+            (tfer['Position'], round(float(tfer['Dilution']), 1)))
+    return plates
+
+def deck_layout(per_round, two_step, multi_pip=None):
+    # plate positions [{'source': slot, 'dilution': slot, 'target': slot}, ...]
+    # and the free slots left for the tip racks; the positions are loaded
+    # once and reused by each round of plates, the dilution plate is only
+    # needed for two-step dilutions
+    free = [slot for slot in plate_slot_order if not (multi_pip and slot == '5')]
+    kinds = ['source', 'dilution', 'target'] if two_step else ['source', 'target']
+    positions = [dict(zip(kinds, free[i*len(kinds):(i+1)*len(kinds)]))
+                 for i in range(per_round)]
+    used = [slot for position in positions for slot in position.values()]
+    tip_slots = [slot for slot in tip_slot_order if slot in free and slot not in used]
+    return positions, tip_slots
+
+def count_tips(steps):
+    # tips taken from the racks by each pipette (8 for a multichannel
+    # pick-up), following get_tips() and the tip policy of the steps
+    tips = {"p20": 0, "p300": 0}
+    mounted = {}
+    for step in steps:
+        pip = step['pipette']
+        if mounted.get(pip) != step['channels']:
+            tips[pip] += step['channels']
+            mounted[pip] = step['channels']
+        if step['tip'] == 'drop':
+            mounted.pop(pip)
+    return tips
+
+def tip_racks(tips, tip_slots):
+    # tip rack slots of each pipette: one rack per rack_tips tips needed,
+    # shared in proportion of the needs when the free slots are short
+    # (the racks are then refilled during the run)
+    need = dict((pip, int(math.ceil(tips[pip] / float(rack_tips)))) for pip in ["p20", "p300"])
+    racks = dict((pip, min(1, need[pip])) for pip in need)
+    left = len(tip_slots) - sum(racks.values())
+    while left > 0 and any(racks[pip] < need[pip] for pip in racks):
+        pip = max(["p20", "p300"], key=lambda p: need[p] / float(max(racks[p], 0.1)))
+        racks[pip] += 1
+        left -= 1
+    return {"p20": tip_slots[:racks["p20"]],
+            "p300": tip_slots[racks["p20"]:racks["p20"] + racks["p300"]]}
+
+def tip_refills(tips, rack_slots):
+    # tip rack refills expected for each pipette
+    return dict((pip, max(0, int(math.ceil(tips[pip] / float(rack_tips * max(len(slots), 1)))) - 1))
+                for pip, slots in rack_slots.items())
+
+def plates_per_round(nplates, two_step, multi_pip, tips, sizes=None):
+    # number of plates on the deck at once, with the fewest operator
+    # pauses (plate rounds + tip refills), the most plates on a tie;
+    # only the sizes given when some rounds would run out of buffer tubes
+    best = None
+    for per_round in range(1, max(nplates, 1) + 1):
+        if sizes and per_round not in sizes:
+            continue
+        positions, tip_slots = deck_layout(per_round, two_step, multi_pip)
+        if len(tip_slots) < 2:
+            break
+        rounds = int(math.ceil(nplates / float(per_round)))
+        pauses = rounds - 1 + sum(tip_refills(tips, tip_racks(tips, tip_slots)).values())
+        if best is None or pauses <= best[0]:
+            best = (pauses, per_round)
+    return best[1]
+
+def choose_pipette(vol):
+    # p20 up to 20 microL, p300 above
+    return "p20" if vol <= 20.0 else "p300"
+
+def two_step_volumes(one_dil, f1, min_vol, max_dil, min_fin, max_vol, s1=None):
+    # volumes (s1, b1, s2, b2) of a two-step dilution with an intermediate
+    # factor f1 in the dilution plate and one_dil/f1 in the target plate,
+    # None when a limit is not met
+    f2 = one_dil / f1
+    if f1 > max_dil or f2 > max_dil:
+        return None
+    # at least min_fin in the target well and at least min_vol pipetted
+    s2 = round(max(min_vol, min_fin / f2), 1)
+    b2 = round(s2 * (f2 - 1), 1)
+    # at least min_fin in the dilution well, enough for s2 and min_vol left for a redo
+    need = max(min_vol, math.ceil(round(max(s2 + min_vol, min_fin) / f1 * 10, 6)) / 10)
+    s1 = need if s1 is None else s1
+    if s1 < need:
+        return None
+    b1 = round(s1 * (f1 - 1), 1)
+    if b1 < min_vol or b2 < min_vol or s1 + b1 > max_vol or s2 + b2 > max_vol:
+        return None
+    return (s1, b1, s2, b2)
+
+def split_cost(vols, predispense=False, disposal_vol=0.0):
+    # estimate for one well: buffer aspirations (the share of a tip each
+    # buffer volume takes when the buffer is pre-dispensed and packed), then
+    # buffer volume; the sample steps and their tips do not depend on the split
+    load = 0.0
+    for vol in [vols[1], vols[3]]:
+        if predispense:
+            load += min(1.0, (vol + disposal_vol) / tip_capacity[choose_pipette(vol)])
+        else:
+            load += 1.0
+    return (round(load, 3), round(vols[1] + vols[3], 1))
+
+def sqrt_split(one_dil):
+    # intermediate factor of two equal steps
+    return round(math.sqrt(one_dil), 1)
+
+def split_factors(max_dil):
+    # candidate intermediate factors (0.1 steps)
+    return [round(1.1 + 0.1 * i, 1) for i in range(int(round((max_dil - 1.1) * 10)) + 1)]
+
+def best_split(one_dil, min_vol, max_dil, min_fin, max_vol, predispense=False,
+               disposal_vol=0.0):
+    # intermediate factor with the lowest cost, closest to sqrt(one_dil)
+    # on a tie; None when no factor meets the limits
+    best = None
+    for f1 in split_factors(max_dil):
+        vols = two_step_volumes(one_dil, f1, min_vol, max_dil, min_fin, max_vol)
+        if vols is None:
+            continue
+        key = split_cost(vols, predispense, disposal_vol) + (abs(f1 - one_dil / f1),)
+        if best is None or key < best[0]:
+            best = (key, f1)
+    return best[1] if best else None
+
+def shared_split(dils, min_vol, max_dil, min_fin, max_vol, multi_pip, predispense=False,
+                 disposal_vol=0.0):
+    # one intermediate factor (and sample volume) for the wells of a column,
+    # so that the dilution plate steps can run with 8 channels; None when
+    # no shared factor fits all wells and runs on the multichannel
+    best = None
+    for f1 in split_factors(max_dil):
+        each = [two_step_volumes(d, f1, min_vol, max_dil, min_fin, max_vol) for d in dils]
+        if None in each:
+            continue
+        s1 = max(v[0] for v in each)
+        each = [two_step_volumes(d, f1, min_vol, max_dil, min_fin, max_vol, s1) for d in dils]
+        if None in each:
+            continue
+        if multi_pip not in [choose_pipette(each[0][0]), choose_pipette(each[0][1])]:
+            continue
+        cost = tuple(map(sum, zip(*[split_cost(v, predispense, disposal_vol) for v in each])))
+        if best is None or cost < best[0]:
+            best = (cost, f1, s1)
+    return best[1:] if best else None
+
+def plan_cost(aspirations):
+    # cost of a plan grouped in aspirations: aspirations, tips taken from
+    # the racks, then buffer volume
+    steps = [step for aspiration in aspirations for step in aspiration]
+    buffer = sum(step['volume'] * step['channels'] for step in steps
+                 if step['source'] in buffer_sources)
+    return (len(aspirations), sum(count_tips(steps).values()), round(buffer, 1))
+
+def plan_dilutions(tfers, buf_vol, min_vol, max_dil, min_fin, mix_times,
+                   predispense=False, disposal_vol=0.0, multi_pip=None,
+                   max_vol=200.0, split='optimal'):
+    # list of steps from the csv rows:
+    #  {'position', 'dilution', 'route', 'factor', 'source', 'source_well', 'dest',
+    #   'dest_well', 'volume', 'pipette', 'channels', 'tip', 'mix_times', 'mix_vol',
+    #   'aspiration', 'round', 'plate', 'deckpos', 'disposal', 'bufferidx'}
+    # factor is the dilution done in the destination well of the step
+    # the plates run in rounds, deckpos is the deck position of the plate
+    # in its round (see deck_layout)
+    # the steps of one aspiration (multi-dispense) share its number
+    # 8 channel steps are given for the A well of a column
+    # tip 'keep': the tip has only seen buffer and stays on the pipette
+    # tip 'drop': the tip has seen sample and is dropped after the step
+    plate_rows = csv_plates(tfers)
+
+    # fail if a plate has more than 96 wells
+    for plate, rows in plate_rows.items():
+        if len(rows) > 96:
+            usrmsg = (
+                'this protocol can handle only up to 96 wells per plate and you gave in ' +
+                str(len(rows)) + ' data rows for plate ' + plate
+                )
+            raise Exception(usrmsg)
+
+    # check if all dilution factors are in accepted range [1:400]
+    dils = [one_dil for rows in plate_rows.values() for one_pos, one_dil in rows]
+    if dils and (min(dils) < 1 or max(dils) > 400):
+        usrmsg = (
+            'some dilution factor(s) in the csv are not in range of 1.0 - 400.0'
+            )
+        raise Exception(usrmsg)
+
+    def new_step(one_pos, one_dil, route, factor, source, source_well, dest, volume, tip,
+                 mix_vol=0.0):
+        return {
+            'step': 0,
+            'position': one_pos,
+            'dilution': one_dil,
+            'route': route,
+            'factor': round(factor, 2),
+            'source': source,
+            'source_well': source_well,
+            'dest': dest,
+            'dest_well': one_pos,
+            'volume': volume,
+            'pipette': choose_pipette(volume),
+            'channels': 1,
+            'tip': tip,
+            'mix_times': mix_times if mix_vol > 0 else 0,
+            'mix_vol': mix_vol if mix_vol > 0 else 0.0,
+            'aspiration': 0,
+            'round': 1,
+            'plate': '',
+            'deckpos': 0,
+            'disposal': 0.0,
+            'bufferidx': 0}
+
+    def mix_volume(buffer_vol, sample_vol):
+        # mix with the smallest of [20, buffer_vol+sample_vol] -2 for safety
+        return round(min(20.0, buffer_vol + sample_vol) - 2.0, 1)
+
+    def well_steps(one_pos, one_dil, split, shared=None):
+        # the steps of one well
+        steps = []
+        if one_dil == 1.0:
+            # a min_fin volume of sample is directly transferred to the target plate
+            steps.append(new_step(one_pos, one_dil, 'undiluted', 1.0, 'source', one_pos,
+                                  'target', min_fin, 'drop'))
+
+        elif one_dil > max_dil:
+            # for larger than max_dil dilutions
+            # dilute s1 of sample f1 times in the dilution plate
+            # then dilute s2 of the dilution one_dil/f1 times in the target plate to get min_fin
+            f1 = None
+            vols = None
+            if shared:
+                f1 = shared[0]
+                vols = two_step_volumes(one_dil, f1, min_vol, max_dil, min_fin, max_vol, shared[1])
+            else:
+                # both splits meet the same limits (see two_step_volumes)
+                f1 = sqrt_split(one_dil)
+                if split != 'sqrt':
+                    f1 = best_split(one_dil, min_vol, max_dil, min_fin, max_vol,
+                                    predispense, disposal_vol)
+                if f1 is not None:
+                    vols = two_step_volumes(one_dil, f1, min_vol, max_dil, min_fin, max_vol)
+            if vols is None:
+                # no split meets the limits: two equal sqrt(one_dil) steps
+                # with min_vol of sample
+                f1 = sqrt_split(one_dil)
+                two_vol = round(max(min_vol, min_fin / f1), 1)
+                vols = (min_vol, round((f1 - 1) * min_vol, 1),
+                        two_vol, round(two_vol * (f1 - 1), 1))
+                f2 = f1
+            else:
+                f2 = one_dil / f1
+            s1, b1, s2, b2 = vols
+            steps.append(new_step(one_pos, one_dil, 'two_step', f1, 'buffer', '', 'dilution',
+                                  b1, 'keep'))
+            steps.append(new_step(one_pos, one_dil, 'two_step', f1, 'source', one_pos, 'dilution',
+                                  s1, 'drop', mix_volume(b1, s1)))
+            steps.append(new_step(one_pos, one_dil, 'two_step', f2, 'buffer', '', 'target',
+                                  b2, 'keep'))
+            steps.append(new_step(one_pos, one_dil, 'two_step', f2, 'dilution', one_pos, 'target',
+                                  s2, 'drop', mix_volume(b2, s2)))
+
+        else:
+            # enough sample is diluted in-place in the target plate to get min_fin
+            # sample volume needed to get >= min_fin AND be more than min_vol
+            req_vol = round(max(min_vol, min_fin / one_dil), 1)
+            buffer_vol = round((one_dil - 1) * req_vol, 1)
+            steps.append(new_step(one_pos, one_dil, 'one_step', one_dil, 'buffer', '', 'target',
+                                  buffer_vol, 'keep'))
+            steps.append(new_step(one_pos, one_dil, 'one_step', one_dil, 'source', one_pos,
+                                  'target', req_vol, 'drop', mix_volume(buffer_vol, req_vol)))
+
+        # nothing to add (eg. 1.01x)
+        return [step for step in steps if step['source'] != 'buffer' or step['volume'] > 0]
+
+    def column_steps(wells):
+        # steps of the 8 wells of a column (A..H), stage by stage; a stage
+        # shared by the 8 wells (same route, volume and mix) in the range of
+        # the multichannel runs once with 8 channels on the A well and the
+        # buffer of the reservoir, the other stages well by well
+        shapes = set(tuple((s['route'], s['source'], s['dest']) for s in w) for w in wells)
+        if len(shapes) != 1:
+            return [step for w in wells for step in w]
+        stages = list(zip(*wells))
+        merge = [len(set((s['volume'], s['mix_vol']) for s in stage)) == 1 and
+                 stage[0]['pipette'] == multi_pip for stage in stages]
+        if not any(merge):
+            return [step for w in wells for step in w]
+        steps = []
+        for stage, merged in zip(stages, merge):
+            if not merged:
+                steps += stage
+                continue
+            step = stage[0]
+            step['channels'] = 8
+            if step['source'] == 'buffer':
+                step['source'] = 'reservoir'
+                step['source_well'] = 'A1'
+            steps.append(step)
+        return steps
+
+    def plate_steps(rows, split):
+        # the steps of one plate
+        # full columns, a multichannel can run their shared stages
+        columns = {}
+        for one_pos, one_dil in rows:
+            columns.setdefault(one_pos[1:], []).append((one_pos, one_dil))
+        full = []
+        if multi_pip:
+            full = [col for col, wells in columns.items()
+                    if sorted(w[0][0] for w in wells) == list('ABCDEFGH')]
+
+        # columns of two-step dilutions share their intermediate dilution
+        shared = {}
+        if split != 'sqrt':
+            for col in full:
+                dils = [one_dil for one_pos, one_dil in columns[col]]
+                if min(dils) > max_dil:
+                    shared[col] = shared_split(dils, min_vol, max_dil, min_fin, max_vol,
+                                               multi_pip, predispense, disposal_vol)
+
+        steps = []
+        done = []
+        for one_pos, one_dil in rows:
+            column = one_pos[1:]
+            if column in done:
+                continue
+            if column not in full:
+                steps += well_steps(one_pos, one_dil, split)
+                continue
+            done.append(column)
+            steps += column_steps([well_steps(p, d, split, shared.get(column))
+                                   for p, d in sorted(columns[column], key=lambda w: w[0][0])])
+        return steps
+
+    def round_aspirations(round_steps):
+        # the steps of a round grouped in aspirations
+        if predispense:
+            return predispense_buffer(round_steps, disposal_vol)
+        return [[step] for step in round_steps]
+
+    def buffers_fit(per_round):
+        # every round of per_round plates fits in the buffer tubes
+        return all(count_buffers(round_aspirations(
+            [step for plate in names[i:i+per_round] for step in plate_plans[plate]]),
+            buf_vol, disposal_vol) <= len(buffer_wells)
+            for i in range(0, len(names), per_round))
+
+    # the plates run in rounds of as many plates as the deck and the
+    # buffer tubes hold (the tubes are refilled for each round)
+    def best_plan(rows):
+        # optimal keeps the sqrt plan of a plate unless its own plan costs
+        # less once grouped in aspirations (see plan_cost)
+        plans = [plate_steps(rows, 'sqrt')]
+        if split != 'sqrt':
+            plans.append(plate_steps(rows, split))
+        return min(plans, key=lambda plan: plan_cost(round_aspirations(plan)))
+
+    names = list(plate_rows)
+    plate_plans = dict((plate, best_plan(plate_rows[plate])) for plate in names)
+    sizes = [n for n in range(1, len(names) + 1) if buffers_fit(n)] or [1]
+    per_round = plates_per_round(
+        len(names), max(dils + [1.0]) > max_dil, multi_pip,
+        count_tips([step for plate in names for step in plate_plans[plate]]),
+        sizes)
+    rounds = [names[i:i+per_round] for i in range(0, len(names), per_round)]
+
+    steps = []
+    for round_idx, round_names in enumerate(rounds):
+        round_steps = []
+        for deckpos, plate in enumerate(round_names):
+            for step in plate_plans[plate]:
+                step['round'] = round_idx + 1
+                step['plate'] = plate
+                step['deckpos'] = deckpos
+                round_steps.append(step)
+
+        # group the steps in aspirations
+        aspirations = round_aspirations(round_steps)
+
+        first = len(set(step['aspiration'] for step in steps)) + 1
+        for i, aspiration in enumerate(aspirations):
+            disposal = disposal_vol if len(aspiration) > 1 else 0.0
+            for step in aspiration:
+                step['aspiration'] = first + i
+                step['disposal'] = disposal
+
+        # the buffer tubes are refilled for each round
+        assign_buffers(aspirations, buf_vol)
+        steps += [step for aspiration in aspirations for step in aspiration]
+
+    for i, step in enumerate(steps):
+        step['step'] = i + 1
+    return steps
+
+def well_rank(well):
+    # column-wise order A1, B1 .. H1, A2 ..
+    return (int(well[1:]) - 1) * 8 + 'ABCDEFGH'.index(well[0])
+
+def pack_dispenses(items, capacity, disposal):
+    # first-fit decreasing: pack steps in as few aspirations as possible,
+    # each holding its volumes + disposal
+    bins = []
+    for item in sorted(items, key=lambda it: -it['volume']):
+        for b in bins:
+            if b['total'] + item['volume'] + disposal <= capacity + 1e-6:
+                b['items'].append(item)
+                b['total'] += item['volume']
+                break
+        else:
+            bins.append({'items': [item], 'total': item['volume']})
+    return [b['items'] for b in bins]
+
+def predispense_buffer(steps, disposal_vol):
+    # all buffer first, packed per pipette and channels in multi-dispense
+    # aspirations (dilution plates then target plates, plate by plate and
+    # column-wise), then the samples in plan order; the buffer tips are
+    # kept for the whole phase
+    dest_order = {'dilution': 0, 'target': 1}
+
+    def rank(step):
+        return (dest_order[step['dest']], step['deckpos'], well_rank(step['dest_well']))
+
+    aspirations = []
+    for pip in ["p20", "p300"]:
+        for channels in [8, 1]:
+            items = [s for s in steps if s['source'] in buffer_sources and
+                     s['pipette'] == pip and s['channels'] == channels]
+            fits = [s for s in items if s['volume'] + disposal_vol <= tip_capacity[pip]]
+            groups = pack_dispenses(fits, tip_capacity[pip], disposal_vol)
+            groups += [[s] for s in items if s not in fits]
+            groups = [sorted(g, key=rank) for g in groups]
+            aspirations += sorted(groups, key=lambda g: rank(g[0]))
+    aspirations += [[s] for s in steps if s['source'] not in buffer_sources]
+    return aspirations
+
+def count_buffers(aspirations, buf_vol, disposal_vol):
+    # buffer tubes used by the tube aspirations of a round (same rule as
+    # assign_buffers, before the disposal volumes are set)
+    bufferidx = 0
+    buffer_counter = 0.0
+    for aspiration in aspirations:
+        if aspiration[0]['source'] != 'buffer':
+            continue
+        dispensed = sum(step['volume'] for step in aspiration)
+        disposal = disposal_vol if len(aspiration) > 1 else 0.0
+        if bufferidx == 0 or buffer_counter + dispensed + disposal > buf_vol:
+            bufferidx += 1
+            buffer_counter = 0.0
+        buffer_counter += dispensed
+    return bufferidx
+
+def assign_buffers(aspirations, buf_vol):
+    # buffer tube of each tube aspiration, the next tube is used when the
+    # current one cannot deliver the aspiration (the disposal volume is
+    # blown back into the tube it came from)
+    bufferidx = 1
+    buffer_counter = 0.0
+    for aspiration in aspirations:
+        if aspiration[0]['source'] != 'buffer':
+            continue
+        dispensed = sum(step['volume'] for step in aspiration)
+        if buffer_counter + dispensed + aspiration[0]['disposal'] > buf_vol:
+            bufferidx += 1
+            buffer_counter = 0.0
+        if bufferidx > len(buffer_wells):
+            usrmsg = (
+                'the dilutions need more than ' + str(len(buffer_wells)) +
+                ' buffer tubes of ' + str(buf_vol) + ' microL'
+                )
+            raise Exception(usrmsg)
+        buffer_counter += dispensed
+        for step in aspiration:
+            step['source_well'] = buffer_wells[bufferidx-1]
+            step['bufferidx'] = bufferidx
+
+def plan_csv(steps):
+    # the plan as csv text for review
+    out = io.StringIO()
+    writer = csv.writer(out, lineterminator='\n')
+    writer.writerow(plan_columns)
+    for step in steps:
+        writer.writerow([step[c] for c in plan_columns])
+    return out.getvalue()
+
 def run(ctx: protocol_api.ProtocolContext):
     [sp_type,
         tp_type,
@@ -38,10 +578,16 @@ def run(ctx: protocol_api.ProtocolContext):
         tube_rack,
         buf_vol,
         min_vol,
+        max_vol,
         max_dil,
         min_fin,
         pspeed,
         mix_times,
+        predispense,
+        disposal_vol,
+        multi_mount,
+        labware_reservoir,
+        two_step_split,
         uploaded_csv
         ] = get_values(    # noqa: F821
         'sp_type',
@@ -50,19 +596,34 @@ def run(ctx: protocol_api.ProtocolContext):
         'tube_rack',
         'buf_vol',
         'min_vol',
+        'max_vol',
         'max_dil',
         'min_fin',
         'pspeed',
         'mix_times',
+        'predispense',
+        'disposal_vol',
+        'multi_mount',
+        'labware_reservoir',
+        'two_step_split',
         'uploaded_csv')
 
     # set variable types
     buf_vol = float(buf_vol)         # max usable per eppendorf tube
     min_vol = float(min_vol)         # min pipettable volume
+    max_vol = float(max_vol)         # max volume in a dilution or target well
     max_dil = float(max_dil)         # max direct dilution (one step)
     min_fin = float(min_fin)         # min volume in dest well
     pspeed = float(pspeed)           # pipette speed (standard 7.56)
     mix_times = int(mix_times)       # mix sample and buffer after dispensing
+    predispense = str(predispense).lower() in ['true', 'yes', '1']   # all buffer first
+    disposal_vol = float(disposal_vol)   # extra volume per buffer multi-dispense
+    multi_mount = str(multi_mount).lower()   # multichannel for uniform columns
+    if multi_mount not in ['none', 'left', 'right']:
+        raise Exception("multi_mount should be one of none, left or right")
+    two_step_split = str(two_step_split).lower()   # intermediate dilution factor
+    if two_step_split not in ['optimal', 'sqrt']:
+        raise Exception("two_step_split should be one of optimal or sqrt")
 
     ###########
     # OT-2 deck
@@ -72,59 +633,76 @@ def run(ctx: protocol_api.ProtocolContext):
     ctx.set_rail_lights(True)
     # ctx.delay(seconds=10)
 
-    # source 96w plate on pos #1
-    source_plate = ctx.load_labware(
-        sp_type,
-        '1',
-        'source_plate')
-
-    # empty dilution 96w plate on pos #2
-    dilution_plate = ctx.load_labware(
-        dp_type,
-        '2',
-        'dilution_plate')
+    # a multichannel can replace the single channel of one mount to run
+    # the columns with 8 identical dilutions in one go
+    multi_pip = {"left": "p20", "right": "p300"}.get(multi_mount)
 
-    # empty 96w plate on pos #3
-    target_plate = ctx.load_labware(
-        tp_type,
-        '3',
-        'target_plate')
+    # csv as list of dictionaries
+    tfers = read_csv_data(uploaded_csv)
+
+    # plan all transfers (checks the csv data)
+    steps = plan_dilutions(tfers, buf_vol, min_vol, max_dil, min_fin, mix_times,
+                           predispense, disposal_vol, multi_pip, max_vol, two_step_split)
+
+    # plates and rounds of the plan
+    plate_names = []
+    for step in steps:
+        if step['plate'] not in plate_names:
+            plate_names.append(step['plate'])
+    rounds = max([step['round'] for step in steps] + [1])
+    positions, tip_slots = deck_layout(
+        max([step['deckpos'] for step in steps] + [0]) + 1,
+        any(step['route'] == 'two_step' for step in steps), multi_pip)
+
+    # source, dilution (two-step dilutions only) and target 96w plates,
+    # one set per deck position, reused by each round of plates
+    plate_types = {'source': sp_type, 'dilution': dp_type, 'target': tp_type}
+    decks = []
+    for i, position in enumerate(positions):
+        decks.append(dict((kind, ctx.load_labware(
+            plate_types[kind],
+            slot,
+            kind + '_plate' + ('_' + str(i + 1) if len(positions) > 1 else '')))
+                for kind, slot in position.items()))
 
     # tube rack on pos #4
     tuberack = ctx.load_labware(tube_rack, '4')
 
-    # buffer tubes on top row [A1 A2 A3 A4 A5 A6]
-    buffer_wells = ['A1', 'A2', 'A3', 'A4', 'A5', 'A6']
-    bufferidx = 1
-    buffer = tuberack.wells_by_name()[buffer_wells[bufferidx-1]]
+    # tube rack and reservoir
+    plates = {'buffer': tuberack}
 
-    # provision enough p20 tips for 2 plates
-    slots20 = ['7', '8']
+    # buffer reservoir on pos #5 for the multichannel (first column)
+    if multi_pip:
+        plates['reservoir'] = ctx.load_labware(labware_reservoir, '5')
+
+    # provision the tips of the plan on the free slots, refilled when empty
+    tips = count_tips(steps)
+    rack_slots = tip_racks(tips, tip_slots)
     tips20 = [ctx.load_labware(
         'opentrons_96_filtertiprack_20ul',
         slot,
         label='tip_20')
-            for slot in slots20]
+            for slot in rack_slots["p20"]]
 
-    # provision enough p200 tips for 2 plates
-    slots200 = ['10', '11']
     tips300 = [ctx.load_labware(
         'opentrons_96_filtertiprack_200ul',
         slot,
         label='tip_300')
-            for slot in slots200]
+            for slot in rack_slots["p300"]]
 
     # define pipettes
     pipette20s = ctx.load_instrument(
-        'p20_single_gen2',
+        'p20_multi_gen2' if multi_pip == "p20" else 'p20_single_gen2',
         'left',
         tip_racks=tips20)
 
     pipette300s = ctx.load_instrument(
-        'p300_single_gen2',
+        'p300_multi_gen2' if multi_pip == "p300" else 'p300_single_gen2',
         'right',
         tip_racks=tips300)
 
+    pipettes = {"p20": pipette20s, "p300": pipette300s}
+
     ###########
     # routines
     ###########
@@ -132,9 +710,6 @@ def run(ctx: protocol_api.ProtocolContext):
     # dilution occurs in the same dilution plate well address as the sample came from
     # this allows keeping the dilution plate in case more is needed for redo
 
-    # volume of used buffer
-    buffer_counter = float(0.0)
-
     def set_speeds(pip, aspeed, dspeed=None, bspeed=None):
         pip.flow_rate.aspirate = aspeed
         pip.flow_rate.dispense = dspeed if dspeed is not None else aspeed
@@ -148,257 +723,121 @@ def run(ctx: protocol_api.ProtocolContext):
     def reset_speeds(pip):
         pip.flow_rate.set_defaults(ctx.api_version)
 
-    ##################################
-    # get min two_vol volume to dilute
-    # and get at least min_fin uL final
-    ###################################
-    # max(min_vol, x)
-    def get_two_vol(min_vol, x):
-        if x >= min_vol:
-            return x
-        else:
-            return get_two_vol(x+0.1)
-
-    #########################################################################
-    #  a min_fin volume of sample is directly transferred to the target plate
-    #########################################################################
-    def direct_transfer_no_dilution(one_pos, one_vol):
-
-        # debug
-        # print("undiluted", one_pos, "vol:", str(one_vol), "dil:", "undiluted", "buffer:", "none")
-
-        # choose pipet
-        if min_fin <= 20.0:
-            usedpip = "p20"
-            s_pipette = pipette20s
-        else:
-            usedpip = "p300"
-            s_pipette = pipette300s
-
-        # is tip present?
-        if not s_pipette.has_tip:
-            s_pipette.pick_up_tip()
-
-        s_pipette.transfer(
-            volume=one_vol,
-            source=source_plate.wells_by_name()[one_pos],
-            dest=target_plate.wells_by_name()[one_pos],
-            new_tip='never'
-            )
-
-        # the tip has seen sample
-        s_pipette.drop_tip()
-
-    ######################################################################
-    # enough sample is diluted in-place in the target plate to get min_fin
-    ######################################################################
-    def direct_transfer_one_dilution(one_pos, one_dil, min_vol, min_fin, mix_times):
-
-        nonlocal buffer_counter
-        nonlocal buffer
-        nonlocal bufferidx
-
-        # calculate sample volume needed to get >= min_fin AND be more than min_vol
-        req_vol = round(max(min_vol, min_fin / one_dil), 1)
-
-        # calculate buffer volume needed
-        buffer_vol = round((one_dil - 1) * req_vol, 1)
-
-        # debug
-        # print("one-step-dil", one_pos, "vol:", str(req_vol), "dil:", str(one_dil), "buffer:", str(buffer_vol))
-
-        # test if enough buffer in current tube_rack else take next
-        buffer_counter += buffer_vol
-        if buffer_counter > buf_vol:
-            # use next buffer tube
-            bufferidx += 1
-            buffer = tuberack.wells_by_name()[buffer_wells[bufferidx-1]]
-            # deduct from new tube
-            buffer_counter = buffer_vol
-
-        # choose pipet
-        if buffer_vol <= 20.0:
-            usedpip = "p20"
-            s_pipette = pipette20s
-        else:
-            usedpip = "p300"
-            s_pipette = pipette300s
-
-        # is tip present?
-        if not s_pipette.has_tip:
-            s_pipette.pick_up_tip()
-
-        s_pipette.transfer(
-            volume=buffer_vol,
-            source=buffer,
-            dest=target_plate.wells_by_name()[one_pos],
-            new_tip='never'
-            )
-
-        # transfer sample to same well and mix_after
-        # choose pipet
-        if float(req_vol) <= 20.0:
-            usedpip = "p20"
-            s_pipette = pipette20s
-        else:
-            usedpip = "p300"
-            s_pipette = pipette300s
-
-        # is tip present?
-        if not s_pipette.has_tip:
-            s_pipette.pick_up_tip()
-
-        # transfer sample in buffer and mix using the same tip
-        # mix with the smallest of [20, buffer_vol+one_vol] -2 for safety
-        mix_vol = round(min(20.0, buffer_vol + req_vol) - 2.0, 1)
-
-        s_pipette.transfer(
-            volume=req_vol,
-            source=source_plate.wells_by_name()[one_pos],
-            dest=target_plate.wells_by_name()[one_pos],
-            mix_after=(mix_times,mix_vol),
-            new_tip='never'
-            )
-
-        # the tip has seen sample
-        s_pipette.drop_tip()
-
-    #######################################################
-    # for larger than 20x dilutions
-    # dilute a volume of sample sqrt(one_dil) times
-    #   at same plate location in the dilution plate
-    # then dilute the dilution sqrt(one_dil) times 
-    #   at same location in the target plate to get min_fin
-    #######################################################
-    def step_transfer_two_dilutions(one_pos, one_dil, min_vol, max_dil, min_fin, mix_times):
-
-        nonlocal buffer_counter
-        nonlocal buffer
-        nonlocal bufferidx
-
-        # pre-dilute math.sqrt(one_dil) times (20x -> 4.47x)
-        #   will be repeated a second time to come to one_dil final dilution
-        ser_dil = round(math.sqrt(one_dil), 1)
-        one_vol = min_vol
-        buffer_vol = round((ser_dil - 1) * one_vol, 1)
-
-        # debug
-        # print("two-step-dil.1", one_pos, "vol:", str(one_vol), "dil:", str(ser_dil), "buffer:", str(buffer_vol))
-
-        # test if enough buffer in current tube_rack else take next tube
-        buffer_counter += buffer_vol
-        if buffer_counter > buf_vol:
-            # use next buffer tube
-            bufferidx += 1
-            buffer = tuberack.wells_by_name()[buffer_wells[bufferidx-1]]
-            # deduct from new tube
-            buffer_counter = buffer_vol
-
-        # first add buffer to dilution well
-        # choose pipet
-        if buffer_vol <= 20.0:
-            usedpip = "p20"
-            s_pipette = pipette20s
-        else:
-            usedpip = "p300"
-            s_pipette = pipette300s
-
-        # is tip present?
-        if not s_pipette.has_tip:
-            s_pipette.pick_up_tip()
-
-        s_pipette.transfer(
-            volume=buffer_vol,
-            source=buffer,
-            dest=dilution_plate.wells_by_name()[one_pos],
-            new_tip='never'
-            )
-
-        # then add sample to it and mix
-        # choose pipet
-        if float(min_vol) <= 20.0:
-            usedpip = "p20"
-            s_pipette = pipette20s
+    def refill_tips(pip, channels):
+        # pause for full tip racks when none has tips left for this pick-up
+        if any(rack.next_tip(channels) for rack in pip.tip_racks):
+            return
+        pip_name = {"left": "p20", "right": "p300"}[pip.mount]
+        ctx.pause("## Replace the tip racks of the " + pip.name + " (slots " +
+            ", ".join(rack_slots[pip_name]) + ") with full racks")
+        pip.reset_tipracks()
+
+    def pick_up_single(pip):
+        # one tip on a multichannel: the tips are taken from the back of the
+        # racks (H12 backwards) so that the other channels are off the rack
+        refill_tips(pip, 1)
+        for rack in pip.tip_racks:
+            for tip in reversed(rack.wells()):
+                if tip.has_tip:
+                    pip.pick_up_tip(tip)
+                    return
+
+    # number of tips (channels) on each mount
+    tip_channels = {}
+
+    def get_tips(pip, channels):
+        # tips for a step, a multichannel changes between 8 tips and 1 tip
+        if pip.has_tip and tip_channels.get(pip.mount) == channels:
+            return
+        if pip.has_tip:
+            pip.drop_tip()
+        if pip.channels > channels:
+            pick_up_single(pip)
         else:
-            usedpip = "p300"
-            s_pipette = pipette300s   
-
-        # is tip present?
-        if not s_pipette.has_tip:
-            s_pipette.pick_up_tip()
-
-        # transfer sample in buffer and mix using the same tip
-        # mix with the smallest of [20, buffer_vol+one_vol] -2 for safety
-        mix_vol = round(min(20, buffer_vol + min_vol) - 2, 1)
-
-        s_pipette.transfer(
-            volume=min_vol,
-            source=source_plate.wells_by_name()[one_pos],
-            dest=dilution_plate.wells_by_name()[one_pos],
-            mix_after=(mix_times,mix_vol),
-            new_tip='never'
-            )
-
-        # the tip has seen sample
-        s_pipette.drop_tip()
-
-        # then add buffer to target plate for a second time math.sqrt(one_dil)
-        # with a minimal final volume of min_fin uL
-        # and a minimal volume of min_vol
-        two_vol = round(max(min_vol, min_fin / ser_dil), 1)
-        
-        # compute the required buffer volume to achieve this
-        buffer_vol = round(two_vol * (ser_dil - 1), 1)
-
-        # debug
-        # print("two-step-dil.2", one_pos, "vol:", str(two_vol), "dil:", str(ser_dil), "buffer:", str(buffer_vol))
-
-        # test if enough buffer in current tube_rack else take next
-        buffer_counter += buffer_vol
-        if buffer_counter > buf_vol:
-            # use next buffer tube
-            bufferidx += 1
-            buffer = tuberack.wells_by_name()[buffer_wells[bufferidx-1]]
-            # deduct from new tube
-            buffer_counter = buffer_vol
-
-        # choose pipet
-        if two_vol <= 20.0:
-            usedpip = "p20"
-            s_pipette = pipette20s
-        else:
-            usedpip = "p300"
-            s_pipette = pipette300s   
-
-        # is tip present?
-        if not s_pipette.has_tip:
-            s_pipette.pick_up_tip()
-
-        s_pipette.transfer(
-            volume=buffer_vol,
-            source=buffer,
-            dest=target_plate.wells_by_name()[one_pos],
-            new_tip='never'
-            )
-
-        # add two_vol of diluted sample to reach min_vol in the target well
-        # mix with the smallest of [20, buffer_vol+one_vol] -2 for safety
-        mix_vol = min(20, buffer_vol + two_vol) - 2
-        s_pipette = pipette20s
-
-        # is tip present?
-        if not s_pipette.has_tip:
-            s_pipette.pick_up_tip()
-
-        s_pipette.transfer(
-            volume=two_vol,
-            source=dilution_plate.wells_by_name()[one_pos],
-            dest=target_plate.wells_by_name()[one_pos],
-            mix_after=(mix_times,mix_vol),
-            new_tip='never'
-            )
-
-        s_pipette.drop_tip()
+            refill_tips(pip, channels)
+            pip.pick_up_tip()
+        tip_channels[pip.mount] = channels
+
+    def well_of(name, step, well):
+        # a well of the tube rack or reservoir, or of a plate at the deck
+        # position of the step
+        if name in buffer_sources:
+            return plates[name].wells_by_name()[well]
+        return decks[step['deckpos']][name].wells_by_name()[well]
+
+    def process_plan(steps):
+        # run the planned aspirations in order
+        aspirations = []
+        for step in steps:
+            if aspirations and aspirations[-1][0]['aspiration'] == step['aspiration']:
+                aspirations[-1].append(step)
+            else:
+                aspirations.append([step])
+
+        phase = None
+        for aspiration in aspirations:
+            step = aspiration[0]
+
+            # debug
+            # print(aspiration)
+
+            # announce the buffer and sample phases
+            if predispense and phase != (step['source'] in buffer_sources):
+                phase = step['source'] in buffer_sources
+                if phase:
+                    ctx.comment("## buffer pre-dispense: " +
+                        str(sum(1 for a in aspirations if a[0]['source'] in buffer_sources)) +
+                        " aspirations for " +
+                        str(sum(s['channels'] for s in steps if s['source'] in buffer_sources)) +
+                        " wells")
+                else:
+                    ctx.comment("## add samples and mix")
+
+            s_pipette = pipettes[step['pipette']]
+
+            # are the tips for this step present?
+            get_tips(s_pipette, step['channels'])
+
+            if len(aspiration) > 1:
+                # multi-dispense, the disposal volume goes back to the buffer
+                buffer = well_of(step['source'], step, step['source_well'])
+                s_pipette.aspirate(
+                    round(sum(s['volume'] for s in aspiration) + step['disposal'], 2),
+                    buffer)
+                for s in aspiration:
+                    s_pipette.dispense(s['volume'], well_of(s['dest'], s, s['dest_well']))
+                if step['disposal'] > 0:
+                    s_pipette.blow_out(buffer.top())
+                continue
+
+            source = well_of(step['source'], step, step['source_well'])
+            dest = well_of(step['dest'], step, step['dest_well'])
+
+            if s_pipette.channels != step['channels']:
+                # a single tip on a multichannel
+                s_pipette.aspirate(step['volume'], source)
+                s_pipette.dispense(step['volume'], dest)
+                if step['mix_times'] > 0:
+                    s_pipette.mix(step['mix_times'], step['mix_vol'], dest)
+                if step['tip'] == 'drop':
+                    s_pipette.drop_tip()
+                continue
+
+            options = {}
+            if step['mix_times'] > 0:
+                options['mix_after'] = (step['mix_times'], step['mix_vol'])
+
+            s_pipette.transfer(
+                volume=step['volume'],
+                source=source,
+                dest=dest,
+                new_tip='never',
+                **options
+                )
+
+            # the tip has seen sample
+            if step['tip'] == 'drop':
+                s_pipette.drop_tip()
 
     ############################
     # PROTOCOL STARTS HERE
@@ -412,83 +851,105 @@ def run(ctx: protocol_api.ProtocolContext):
     set_clearance(pipette20s, 3, 1)
     set_clearance(pipette300s, 3, 1)
 
-    # csv as list of dictionaries
-    tfers = [line for line in csv.DictReader(uploaded_csv.splitlines())]
-
     # warn about the current expected volume taken from the sample plate
-    ctx.comment("## make sure samples that will NOT be diluted have more than " + 
-        str(min_fin) + 
+    ctx.comment("## make sure samples that will NOT be diluted have more than " +
+        str(min_fin) +
         " microL in the sample plate or abort here and adapt 'min_fin' in the yaml config")
 
-    pos_list = [tfer['Position'] for tfer in tfers if tfer['Position']]
-    dil_list = [round(float(tfer['Dilution']),1) for tfer in tfers if tfer['Dilution']]
-
-    # fail if tfers is longer than max 96 wells
-    if len(pos_list) > 96:
-        usrmsg = (
-            'this protocol can handle only up to 96 wells and you gave in ' + str(len(pos_list)) + ' data rows'
-            )
-        raise Exception(usrmsg)
-
-    # check if all dilution factors are in accepted range [1:400]
-    if min(dil_list) < 1 or max(dil_list) > 400:
-        usrmsg = (
-            'some dilution factor(s) in the csv are not in range of 1.0 - 400.0'
-            )
-        raise Exception(usrmsg)
-
-    # calculate buffer needs for direct dilution
-    req_list = [max(min_vol, min_fin / b) for b in dil_list]
-    direct_buffer_vol = round(sum([a*(b-1) for a,b in zip(req_list, dil_list) if (b > 1 and b < max_dil)]), 1)
-
-    # debug
-    # print("direct dilution volumes:", [a*(b-1) for a,b in zip(req_list, dil_list) if (b > 1 and b < max_dil)])
-    
-    # calculate buffer needs for 2-step dilution (same conditions in both steps)
-    first_buffer_vol = round(sum([min_vol*(math.sqrt(b) - 1) for b in dil_list if (b >= max_dil)]), 1)
-    second_dil_vol = [max(min_vol, min_fin / round(math.sqrt(b),1)) for b in dil_list if (b >= max_dil)]
-    second_dil_list = [b for b in dil_list if (b >= max_dil)]
-    second_buffer_vol = round(sum([a*(math.sqrt(b) - 1) for a,b in zip(second_dil_vol, second_dil_list)]), 1)
-
-    # debug
-    # print("first 2-dilution volumes:", [min_vol*(math.sqrt(b) - 1) for b in dil_list if (b >= max_dil)])
-    # print("first 2-dilution sample volumes:", [max(min_vol, min_fin / round(math.sqrt(b),1)) for b in dil_list if (b >= max_dil)])
-    # print("second 2-dilution volumes:", [a*(math.sqrt(b) - 1) for a,b in zip(second_dil_vol, second_dil_list)])
-
-    # estimate total buffer volume (mL) based on sum of all imported volumes
-    buffer_needed = direct_buffer_vol + first_buffer_vol + second_buffer_vol
-
-    # how many buffer slots are needed?
-    bufferslots = math.ceil(float(buffer_needed)/float(buf_vol))
+    # buffer volume used by the plan
+    buffer_needed = sum(step['volume'] * step['channels'] for step in steps
+                        if step['source'] in buffer_sources)
 
     # inform about the volume of buffer needed
     ctx.comment("## the run will use " + str(round(buffer_needed/1000,3)) + "mL dilution buffer")
 
-    ctx.pause("## Insert '" + str(bufferslots) + "' 1.5ml tubes with " + str(float(buf_vol)*1.2) + 
-        "ml buffer in the tube rack (" + str(buffer_wells[0:bufferslots]) + ")")
-
-    # loop in the CSV data and process 
-    for tfer in tfers:
-        one_pos, one_dil = tfer.values()
-
-        # make one_dil float for good
-        one_dil = float(one_dil)
-
-        # pick the right routine depending on dilution
-        if one_dil == 1.0:
-            direct_transfer_no_dilution(one_pos, min_fin)
-        elif one_dil > max_dil:
-            # scale down input to min_vol
-            step_transfer_two_dilutions(one_pos, one_dil, min_vol, max_dil, min_fin, mix_times)
-        else:
-            direct_transfer_one_dilution(one_pos, one_dil, min_vol, min_fin, mix_times)
+    # plates, rounds and tips
+    if len(plate_names) > 1:
+        ctx.comment("## " + str(len(plate_names)) + " plates " + str(plate_names) + " in " +
+            str(rounds) + " round(s) of up to " + str(len(positions)) + " plate(s)")
+    refills = tip_refills(tips, rack_slots)
+    for pip_name, pipette in pipettes.items():
+        if tips[pip_name] > 0:
+            ctx.comment("## the " + pipette.name + " will use " + str(tips[pip_name]) +
+                " tip(s) (" + str(len(rack_slots[pip_name])) + " rack(s) in slots " +
+                ", ".join(rack_slots[pip_name]) +
+                ((", about " + str(refills[pip_name]) + " refill(s)")
+                    if refills[pip_name] > 0 else "") + ")")
+
+    # columns done with the multichannel
+    if multi_pip:
+        fast_columns = sorted(set(
+            (step['plate'] + ':' if len(plate_names) > 1 else '') + step['position'][1:]
+            for step in steps if step['channels'] == 8),
+                key=lambda col: (col.split(':')[0], int(col.split(':')[-1])))
+        ctx.comment(
+            "## " + str(len(fast_columns)) + " uniform column(s) will use the " +
+            pipettes[multi_pip].name + " " + str(fast_columns) + ", " +
+            str(sum(1 for step in steps if step['channels'] == 8)) + " steps with 8 channels")
+
+    for round_nr in range(1, rounds + 1):
+        round_steps = [step for step in steps if step['round'] == round_nr]
+        reservoir_needed = sum(step['volume'] * step['channels'] for step in round_steps
+                               if step['source'] == 'reservoir')
+        bufferslots = max([step['bufferidx'] for step in round_steps] + [0])
+
+        # one pause per round: plates, reservoir and buffer tubes
+        setup = []
+        if len(plate_names) > 1:
+            placed = []
+            for step in round_steps:
+                if step['plate'] not in [p[0] for p in placed]:
+                    placed.append((step['plate'], step['deckpos']))
+            setup.append("## round " + str(round_nr) + "/" + str(rounds) + ": " +
+                ("remove the plates of round " + str(round_nr - 1) + ", " if round_nr > 1 else "") +
+                "; ".join(
+                    "plate " + plate + ": source in slot " + positions[deckpos]['source'] +
+                    (", dilution in slot " + positions[deckpos]['dilution']
+                        if 'dilution' in positions[deckpos] else "") +
+                    ", target in slot " + positions[deckpos]['target']
+                    for plate, deckpos in placed))
+
+        if reservoir_needed > 0:
+            setup.append("## Fill the first column of the reservoir (slot 5) with " +
+                str(round(reservoir_needed*1.2/1000, 3)) + "ml buffer")
+
+        if bufferslots > 0:
+            setup.append("## Insert '" + str(bufferslots) + "' 1.5ml tubes with " +
+                str(round(buf_vol*1.2/1000, 3)) + "ml buffer in the tube rack (" +
+                str(buffer_wells[0:bufferslots]) + ")")
+
+        if setup:
+            ctx.pause("\n".join(setup))
+
+        # run the plan
+        process_plan(round_steps)
 
     # eject tips where present
     for pipette in [pipette20s, pipette300s]:
         if pipette.has_tip:
-            pipette.drop_tip()  
+            pipette.drop_tip()
 
     ctx.comment(
       "\n    #############################################" +
       "\n    ## All done!" +
       "\n    #############################################")
+
+if __name__ == '__main__':
+    # export the transfer plan as csv for review before the run
+    import sys
+    [buf_vol, min_vol, max_vol, max_dil, min_fin, mix_times, predispense, disposal_vol,
+        multi_mount, two_step_split, uploaded_csv] = get_values(
+        'buf_vol', 'min_vol', 'max_vol', 'max_dil', 'min_fin', 'mix_times', 'predispense',
+        'disposal_vol', 'multi_mount', 'two_step_split', 'uploaded_csv')
+    sys.stdout.write(plan_csv(plan_dilutions(
+        read_csv_data(uploaded_csv),
+        float(buf_vol),
+        float(min_vol),
+        float(max_dil),
+        float(min_fin),
+        int(mix_times),
+        str(predispense).lower() in ['true', 'yes', '1'],
+        float(disposal_vol),
+        {"left": "p20", "right": "p300"}.get(str(multi_mount).lower()),
+        float(max_vol),
+        str(two_step_split).lower())))
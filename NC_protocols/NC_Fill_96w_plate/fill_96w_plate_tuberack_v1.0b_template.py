@@ -22,6 +22,8 @@ metadata = {
 ##  min_vol: 2.0
 ##  max_vol: 100.0
 ##  pspeed: 7.56
+##  multi_dispense: true
+##  disposal_vol: 2.0
 ##csv:
 ##  uploaded_csv: "data.csv"
 
@@ -36,6 +38,8 @@ def get_values(*names):
         "min_vol":"<min_vol>",
         "max_vol":"<max_vol>",
         "pspeed":"<pspeed>",
+        "multi_dispense":"<multi_dispense>",
+        "disposal_vol":"<disposal_vol>",
         "uploaded_csv":"<uploaded_csv>"        
         }""")
     return [_all_values[n] for n in names]
@@ -43,8 +47,12 @@ def get_values(*names):
 def run(ctx: protocol_api.ProtocolContext):
 
     # load variables via get_values
-    [plate_type, tube_rack, res_vol, min_vol, max_vol, pspeed, uploaded_csv] = get_values(  # noqa: F821
-            "plate_type", "tube_rack", "res_vol", "min_vol", "max_vol", "pspeed", "uploaded_csv")
+    [plate_type, tube_rack, res_vol, min_vol, max_vol, pspeed, multi_dispense, disposal_vol, uploaded_csv] = get_values(  # noqa: F821
+            "plate_type", "tube_rack", "res_vol", "min_vol", "max_vol", "pspeed", "multi_dispense", "disposal_vol", "uploaded_csv")
+
+    # change types
+    multi_dispense = str(multi_dispense).lower() in ['true', 'yes', '1']
+    disposal_vol = float(disposal_vol)
 
     # light be
     ctx.set_rail_lights(True)
@@ -61,14 +69,10 @@ def run(ctx: protocol_api.ProtocolContext):
     
     # current buffer slots position 4 tubes on the top [A1 A2 A3 A4]
     buffer_wells = ['A1', 'A2', 'A3', 'A4']
-    bufferidx = 1
-    buffer = tuberack.wells_by_name()[buffer_wells[bufferidx-1]]
-
-    # volume of used buffer
-    buffer_counter = float(0.0)
+    max_bufferslots = len(buffer_wells)
 
-    # number of buffer slots required for this experiment
-    bufferslots = 1
+    def buffer_well(bufferidx):
+        return tuberack.wells_by_name()[buffer_wells[bufferidx-1]]
     
     # provision enough tips for 2 plates
     slots = ['7']
@@ -109,56 +113,131 @@ def run(ctx: protocol_api.ProtocolContext):
     def reset_speeds(pip):
         pip.flow_rate.set_defaults(ctx.api_version)
 
-    # do the pipetting
-    def process_data(tfers, buffer, buffer_counter, bufferidx):
-
-        # process well by well from uploaded_csv
-        for line in tfers:
-            s_well = line['Position']
-            s_vol = line['Value']
-            # change types
-            s_well = str(s_well)
-            s_vol = float(s_vol)
-            
-            # choose right pipet
-            if s_vol <= 20.0:
-                usedpip = "p20"
-                s_pipette = pipette20s
+    # pipette capacity with the filter tips in use
+    tip_capacity = {"p20": 20.0, "p300": 200.0}
+
+    def choose_pipette(s_vol):
+        # p20 up to 20ul, p300 above
+        return "p20" if s_vol <= 20.0 else "p300"
+
+    def pack_dispenses(items, capacity, disposal):
+        # first-fit decreasing: pack (index, well, vol) items in as few
+        # aspirations as possible, each holding its volumes + disposal
+        bins = []
+        for item in sorted(items, key=lambda it: -it[2]):
+            for b in bins:
+                if b['total'] + item[2] + disposal <= capacity + 1e-6:
+                    b['items'].append(item)
+                    b['total'] += item[2]
+                    break
             else:
-                usedpip = "p300"
-                s_pipette = pipette300s
+                bins.append({'items': [item], 'total': item[2]})
+        return [b['items'] for b in bins]
+
+    def plan_transfers(tfers):
+        # list of aspiration steps from the csv rows:
+        #  {'pip', 'dispenses': [(well, vol), ...], 'volume', 'disposal', 'bufferidx'}
+        items = [(i, str(line['Position']), float(line['Value']))
+                 for i, line in enumerate(tfers) if line['Position'] and line['Value']]
+        groups = []
+        for pip in ["p20", "p300"]:
+            pip_items = [it for it in items if choose_pipette(it[2]) == pip]
+            if multi_dispense:
+                fits = [it for it in pip_items
+                        if it[2] + disposal_vol <= tip_capacity[pip]]
+                groups += [(pip, b) for b in pack_dispenses(fits, tip_capacity[pip], disposal_vol)]
+                pip_items = [it for it in pip_items if it not in fits]
+            groups += [(pip, [it]) for it in pip_items]
+        steps = []
+        for pip, group in groups:
+            disposal = disposal_vol if len(group) > 1 else 0.0
+            dispenses = [(well, vol) for idx, well, vol in group]
+            steps.append({
+                'pip': pip,
+                'dispenses': dispenses,
+                'volume': round(sum(vol for well, vol in dispenses) + disposal, 2),
+                'disposal': disposal})
+        order_steps(steps)
+        assign_buffers(steps)
+        return steps
+
+    def serpentine_rank(well):
+        # position of a well in a column-wise serpentine walk of the plate
+        # (A1 to H1, H2 to A2, A3 to H3, ...)
+        row = ord(well[0]) - ord('A')
+        col = int(well[1:]) - 1
+        return col * 8 + (row if col % 2 == 0 else 7 - row)
+
+    def order_steps(steps):
+        # group the aspirations by pipette (p20 first, then p300) and walk
+        # each group in serpentine plate order, also within a multi-dispense
+        for step in steps:
+            step['dispenses'].sort(key=lambda d: serpentine_rank(d[0]))
+        steps.sort(key=lambda step: (
+            step['pip'] != "p20",
+            serpentine_rank(step['dispenses'][0][0])))
+        return steps
+
+    def assign_buffers(steps):
+        # buffer slot of each aspiration, the next slot is used when the
+        # current one cannot deliver the aspiration (the disposal volume is
+        # blown back into the slot it came from)
+        bufferidx = 1
+        buffer_counter = float(0.0)
+        for step in steps:
+            dispensed = step['volume'] - step['disposal']
+            if buffer_counter + step['volume'] > float(res_vol):
+                bufferidx += 1
+                buffer_counter = float(0.0)
+            buffer_counter += dispensed
+            step['bufferidx'] = bufferidx
 
-            buffer_counter += s_vol
-            if float(buffer_counter) > float(res_vol):
+    # do the pipetting
+    def process_data(steps):
 
-                bufferidx += 1
-                buffer_counter = float(s_vol)
-                buffer = tuberack.wells_by_name()[buffer_wells[bufferidx-1]]
+        # process the planned aspirations
+        for step in steps:
+            s_pipette = pipette20s if step['pip'] == "p20" else pipette300s
+
+            # the other pipette is done with its group
+            for pipette in [pipette20s, pipette300s]:
+                if pipette is not s_pipette and pipette.has_tip:
+                    pipette.drop_tip()
+            buffer = buffer_well(step['bufferidx'])
 
             # is tip present?
             if not s_pipette.has_tip:
                 s_pipette.pick_up_tip()
-                
+
             # increase clearance to avoid touching the tube/plate bottom
             s_pipette.well_bottom_clearance.aspirate = 3
             s_pipette.well_bottom_clearance.dispense = 1
 
-            # transfer
-            s_pipette.transfer(
-                s_vol,
-                buffer,
-                dilution_plate.wells_by_name()[s_well],
-                blow_out=False,
-                new_tip='never'
-                )
+            if len(step['dispenses']) == 1:
+                # transfer
+                s_well, s_vol = step['dispenses'][0]
+                s_pipette.transfer(
+                    s_vol,
+                    buffer,
+                    dilution_plate.wells_by_name()[s_well],
+                    blow_out=False,
+                    new_tip='never'
+                    )
+                continue
+
+            # multi-dispense, the disposal volume goes back to the buffer
+            s_pipette.aspirate(step['volume'], buffer)
+            for s_well, s_vol in step['dispenses']:
+                s_pipette.dispense(s_vol, dilution_plate.wells_by_name()[s_well])
+            s_pipette.blow_out(buffer.top())
     
     ############################
     # PROTOCOL STARTS HERE
     ############################
 
     # set/reset pipettes speeds
-    set_speeds(pipette20s, pspeed)
-    set_speeds(pipette300s, pspeed)
+    set_speeds(pipette20s, float(pspeed))
+    set_speeds(pipette300s, float(pspeed))
 
     # initialize variables
     
@@ -187,12 +266,30 @@ def run(ctx: protocol_api.ProtocolContext):
     # estimate total buffer volume (mL) based on sum of all imported volumes
     buffer_needed = round(sum([float(tfer['Value']) for tfer in tfers if tfer['Value']])/1000.0,2)
 
-    # how many buffer slots are needed?
-    bufferslots = math.ceil(float(buffer_needed)*1000/float(res_vol))
+    # plan the aspirations and their buffer slots
+    steps = plan_transfers(tfers)
+    bufferslots = max(step['bufferidx'] for step in steps)
+    if bufferslots > max_bufferslots:
+        usrmsg = (
+            'this run needs ' + str(bufferslots) + ' buffer slots of ' +
+            str(res_vol) + 'ul and only ' + str(max_bufferslots) + ' are available'
+            )
+        raise Exception(usrmsg)
+
+    # pipette switches after grouping the steps by pipette
+    switches = sum(1 for prev, step in zip(steps, steps[1:]) if prev['pip'] != step['pip'])
+    ctx.comment("## " + str(switches) + " pipette switch(es) in the run")
 
     # inform about the volume of buffer needed
     ctx.comment("## the run will use " + str(buffer_needed) + "mL dilution buffer")
 
+    # report the round trips to the buffer
+    round_trips = len(vol_list)
+    ctx.comment(
+        "## " + str(round_trips) + " wells filled with " + str(len(steps)) +
+        " aspirations (" + str(round_trips - len(steps)) +
+        " round trips to the buffer saved by multi-dispensing)")
+
     ctx.pause("## Insert '" + str(bufferslots) + "' 1.5ml tubes with " + 
         str(float(res_vol)*1.2) + "ml buffer in the tube rack (" + str(buffer_wells[0:bufferslots]) + ")")
         
@@ -203,7 +300,7 @@ def run(ctx: protocol_api.ProtocolContext):
         '#'*75
         )
 
-    process_data(tfers, buffer, buffer_counter, bufferidx)
+    process_data(steps)
 
     # eject tips where present
     for pipette in [pipette20s, pipette300s]:
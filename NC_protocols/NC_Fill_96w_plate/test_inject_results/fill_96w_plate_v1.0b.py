@@ -21,7 +21,10 @@ metadata = {
 ##  res_vol: 1000.0
 ##  min_vol: 2.0
 ##  max_vol: 100.0
-##  pspeed: 7.56
+##  pspeed: 7.56 (24)
+##  multi_dispense: true
+##  disposal_vol: 2.0
+##  multi_mount: "none" (left: p20_multi_gen2, right: p300_multi_gen2)
 ##csv:
 ##  uploaded_csv: "data.csv"
 
@@ -35,7 +38,10 @@ def get_values(*names):
         "res_vol":"1000.0",
         "min_vol":"2.0",
         "max_vol":"100.0",
-        "pspeed":"7.56",
+        "pspeed":"24.0",
+        "multi_dispense":"true",
+        "disposal_vol":"2.0",
+        "multi_mount":"none",
         "uploaded_csv":"Position,Value\\nA1,15.7\\nA2,2.5\\nA3,13.5\\nA4,7.1\\nA5,8.0\\nA6,13.4\\nA7,5.6\\nA8,2.8\\nA9,2.7\\nA10,17.7\\nA11,15.1\\nA12,8.2\\nB1,18.1\\nB2,9.4\\nB3,5.5\\nB4,13.8\\nB5,7.2\\nB6,10.0\\nB7,14.8\\nB8,7.3\\nB9,10.3\\nB10,2.4\\nB11,3.3\\nB12,13.8\\nC1,14.0\\nC2,6.5\\nC3,4.4\\nC4,3.2\\nC5,8.1\\nC6,6.7\\nC7,15.6\\nC8,15.5\\nC9,6.7\\nC10,7.6\\nC11,2.1\\nC12,11.7\\nD1,3.4\\nD2,50.0\\nD3,17.5\\nD4,10.5\\nD5,11.6\\nD6,80.0\\nD7,17.5\\nD8,3.5\\nD9,2.9\\nD10,99.0\\nD11,18.9\\nD12,9.1\\nE1,19.5\\nE2,7.8\\nE3,11.2\\nE4,17.3\\nE5,18.3\\nE6,7.9\\nE7,9.9\\nE8,15.3\\nE9,8.2\\nE10,12.2\\nE11,6.6\\nE12,5.6\\nF1,13.8\\nF2,2.9\\nF3,11.7\\nF4,70.0\\nF5,10.1\\nF6,9.7\\nF7,19.2\\nF8,90.0\\nF9,10.8\\nF10,16.9\\nF11,5.5\\nF12,13.1\\nG1,19.6\\nG2,14.9\\nG3,11.1\\nG4,14.6\\nG5,12.8\\nG6,6.9\\nG7,17.5\\nG8,3.7\\nG9,3.0\\nG10,8.0\\nG11,6.3\\nG12,7.1\\nH1,2.9\\nH2,16.1\\nH3,4.0\\nH4,17.6\\nH5,9.3\\nH6,16.2\\nH7,6.6\\nH8,17.5\\nH9,9.7\\nH10,20.0\\nH11,11.2\\nH12,3.5"
         }""")
     return [_all_values[n] for n in names]
@@ -43,8 +49,15 @@ def get_values(*names):
 def run(ctx: protocol_api.ProtocolContext):
 
     # load variables via get_values
-    [plate_type, labware_reservoir, res_vol, min_vol, max_vol, pspeed, uploaded_csv] = get_values(  # noqa: F821
-            "plate_type", "labware_reservoir", "res_vol", "min_vol", "max_vol", "pspeed", "uploaded_csv")
+    [plate_type, labware_reservoir, res_vol, min_vol, max_vol, pspeed, multi_dispense, disposal_vol, multi_mount, uploaded_csv] = get_values(  # noqa: F821
+            "plate_type", "labware_reservoir", "res_vol", "min_vol", "max_vol", "pspeed", "multi_dispense", "disposal_vol", "multi_mount", "uploaded_csv")
+
+    # change types
+    multi_dispense = str(multi_dispense).lower() in ['true', 'yes', '1']
+    disposal_vol = float(disposal_vol)
+    multi_mount = str(multi_mount).lower()
+    if multi_mount not in ['none', 'left', 'right']:
+        raise Exception("multi_mount should be one of none, left or right")
 
     # light be
     ctx.set_rail_lights(True)
@@ -59,15 +72,11 @@ def run(ctx: protocol_api.ProtocolContext):
     # container on pos 4 with buffer slots [1:8] and waste in last (12)
     reagent_container = ctx.load_labware(labware_reservoir, '4')
 
-    # current buffer slots position
-    bufferidx = 1
-    buffer = reagent_container.columns_by_name()[str(bufferidx)]
-
-    # volume of used buffer
-    buffer_counter = float(0.0)
+    # buffer slots (reservoir columns)
+    max_bufferslots = 8
 
-    # number of buffer slots required for this experiment
-    bufferslots = 1
+    def buffer_well(bufferidx):
+        return reagent_container.columns_by_name()[str(bufferidx)][0]
     
     # provision enough tips for 2 plates
     slots = ['7']
@@ -86,13 +95,17 @@ def run(ctx: protocol_api.ProtocolContext):
             for slot in slots]
 
     # define pipettes
+    # a multichannel can replace the single channel of one mount to fill
+    # the columns with 8 identical volumes in one go (fast path)
+    multi_pip = {"left": "p20", "right": "p300"}.get(multi_mount)
+
     pipette20s = ctx.load_instrument(
-        'p20_single_gen2',
+        'p20_multi_gen2' if multi_pip == "p20" else 'p20_single_gen2',
         'left',
         tip_racks=tips20)
 
     pipette300s = ctx.load_instrument(
-        'p300_single_gen2',
+        'p300_multi_gen2' if multi_pip == "p300" else 'p300_single_gen2',
         'right',
         tip_racks=tips300)
 
@@ -108,56 +121,187 @@ def run(ctx: protocol_api.ProtocolContext):
     def reset_speeds(pip):
         pip.flow_rate.set_defaults(ctx.api_version)
 
-    # do the pipetting
-    def process_data(tfers, buffer, buffer_counter, bufferidx):
-
-        # process well by well from uploaded_csv
-        for line in tfers:
-            s_well = line['Position']
-            s_vol = line['Value']
-            # change types
-            s_well = str(s_well)
-            s_vol = float(s_vol)
-            
-            # choose right pipet
-            if s_vol <= 20.0:
-                usedpip = "p20"
-                s_pipette = pipette20s
+    # pipette capacity with the filter tips in use
+    tip_capacity = {"p20": 20.0, "p300": 200.0}
+
+    def choose_pipette(s_vol):
+        # p20 up to 20ul, p300 above
+        return "p20" if s_vol <= 20.0 else "p300"
+
+    def pack_dispenses(items, capacity, disposal):
+        # first-fit decreasing: pack (index, well, vol) items in as few
+        # aspirations as possible, each holding its volumes + disposal
+        bins = []
+        for item in sorted(items, key=lambda it: -it[2]):
+            for b in bins:
+                if b['total'] + item[2] + disposal <= capacity + 1e-6:
+                    b['items'].append(item)
+                    b['total'] += item[2]
+                    break
             else:
-                usedpip = "p300"
-                s_pipette = pipette300s
-
-            buffer_counter += s_vol
-            #print(float(s_vol), buffer_counter)
-            if float(buffer_counter) > float(res_vol):
+                bins.append({'items': [item], 'total': item[2]})
+        return [b['items'] for b in bins]
+
+    def group_items(pip, items):
+        # aspirations of one pipette: packed (multi_dispense) or one per item
+        groups = []
+        if multi_dispense:
+            fits = [it for it in items if it[2] + disposal_vol <= tip_capacity[pip]]
+            groups += pack_dispenses(fits, tip_capacity[pip], disposal_vol)
+            items = [it for it in items if it not in fits]
+        return groups + [[it] for it in items]
+
+    def uniform_columns(items, pip):
+        # items of the plate columns with 8 identical volumes for pip
+        columns = {}
+        for it in items:
+            columns.setdefault(it[1][1:], []).append(it)
+        uniform = []
+        for col_items in columns.values():
+            rows = sorted(it[1][0] for it in col_items)
+            vols = set(it[2] for it in col_items)
+            if (rows == list('ABCDEFGH') and len(vols) == 1 and
+                    choose_pipette(col_items[0][2]) == pip):
+                uniform.append(col_items)
+        return uniform
+
+    def plan_transfers(tfers):
+        # list of aspiration steps from the csv rows:
+        #  {'pip', 'channels', 'dispenses': [(well, vol), ...], 'volume',
+        #   'disposal', 'bufferidx'}
+        # with 8 channels, the dispenses are given for the top well of a column
+        items = [(i, str(line['Position']), float(line['Value']))
+                 for i, line in enumerate(tfers) if line['Position'] and line['Value']]
+        groups = []
+        if multi_pip:
+            col_items = []
+            for column in uniform_columns(items, multi_pip):
+                col_items.append((min(it[0] for it in column), 'A' + column[0][1][1:], column[0][2]))
+                items = [it for it in items if it not in column]
+            groups += [(multi_pip, 8, g) for g in group_items(multi_pip, col_items)]
+        for pip in ["p20", "p300"]:
+            pip_items = [it for it in items if choose_pipette(it[2]) == pip]
+            groups += [(pip, 1, g) for g in group_items(pip, pip_items)]
+        steps = []
+        for pip, channels, group in groups:
+            disposal = disposal_vol if len(group) > 1 else 0.0
+            dispenses = [(well, vol) for idx, well, vol in group]
+            steps.append({
+                'pip': pip,
+                'channels': channels,
+                'dispenses': dispenses,
+                'volume': round(sum(vol for well, vol in dispenses) + disposal, 2),
+                'disposal': disposal})
+        order_steps(steps)
+        assign_buffers(steps)
+        return steps
+
+    def serpentine_rank(well):
+        # position of a well in a column-wise serpentine walk of the plate
+        # (A1 to H1, H2 to A2, A3 to H3, ...)
+        row = ord(well[0]) - ord('A')
+        col = int(well[1:]) - 1
+        return col * 8 + (row if col % 2 == 0 else 7 - row)
+
+    def order_steps(steps):
+        # group the aspirations by pipette (p20 first, the fast path columns
+        # before the single channel steps of a multichannel) and walk each
+        # group in serpentine plate order, also within a multi-dispense
+        for step in steps:
+            step['dispenses'].sort(key=lambda d: serpentine_rank(d[0]))
+        steps.sort(key=lambda step: (
+            step['pip'] != "p20",
+            step['channels'] == 1,
+            serpentine_rank(step['dispenses'][0][0])))
+        return steps
+
+    def assign_buffers(steps):
+        # buffer slot of each aspiration, the next slot is used when the
+        # current one cannot deliver the aspiration (the disposal volume is
+        # blown back into the slot it came from)
+        bufferidx = 1
+        buffer_counter = float(0.0)
+        for step in steps:
+            aspirated = step['volume'] * step['channels']
+            dispensed = (step['volume'] - step['disposal']) * step['channels']
+            if buffer_counter + aspirated > float(res_vol):
                 bufferidx += 1
-                buffer_counter = float(s_vol)
-                buffer = reagent_container.columns_by_name()[str(bufferidx)]
+                buffer_counter = float(0.0)
+            buffer_counter += dispensed
+            step['bufferidx'] = bufferidx
+
+    def pick_up_single(pip):
+        # one tip on a multichannel: the tips are taken from the back of the
+        # racks (H12 backwards) so that the other channels are off the rack
+        for rack in pip.tip_racks:
+            for tip in reversed(rack.wells()):
+                if tip.has_tip:
+                    pip.pick_up_tip(tip)
+                    return
+        raise Exception("no single tip left for the " + pip.name)
+
+    # number of tips (channels) on each mount
+    tip_channels = {}
+
+    def get_tips(pip, channels):
+        # tips for a step, a multichannel changes between 8 tips and 1 tip
+        if pip.has_tip and tip_channels.get(pip.mount) == channels:
+            return
+        if pip.has_tip:
+            pip.drop_tip()
+        if pip.channels > channels:
+            pick_up_single(pip)
+        else:
+            pip.pick_up_tip()
+        tip_channels[pip.mount] = channels
+
+    # do the pipetting
+    def process_data(steps):
+
+        # process the planned aspirations
+        for step in steps:
+            s_pipette = pipette20s if step['pip'] == "p20" else pipette300s
+
+            # the other pipette is done with its group
+            for pipette in [pipette20s, pipette300s]:
+                if pipette is not s_pipette and pipette.has_tip:
+                    pipette.drop_tip()
+            buffer = buffer_well(step['bufferidx'])
+
+            # are the tips for this step present?
+            get_tips(s_pipette, step['channels'])
 
-            # is tip present?
-            if not s_pipette.has_tip:
-                s_pipette.pick_up_tip()
-                
             # increase clearance to avoid touching the tube/plate bottom
             s_pipette.well_bottom_clearance.aspirate = 3
             s_pipette.well_bottom_clearance.dispense = 1
 
-            # transfer
-            s_pipette.transfer(
-                s_vol,
-                buffer,
-                dilution_plate.wells_by_name()[s_well],
-                blow_out=False,
-                new_tip='never'
-                )
+            if len(step['dispenses']) == 1 and s_pipette.channels == step['channels']:
+                # transfer
+                s_well, s_vol = step['dispenses'][0]
+                s_pipette.transfer(
+                    s_vol,
+                    buffer,
+                    dilution_plate.wells_by_name()[s_well],
+                    blow_out=False,
+                    new_tip='never'
+                    )
+                continue
+
+            # multi-dispense (or a single tip on a multichannel), the
+            # disposal volume goes back to the buffer
+            s_pipette.aspirate(step['volume'], buffer)
+            for s_well, s_vol in step['dispenses']:
+                s_pipette.dispense(s_vol, dilution_plate.wells_by_name()[s_well])
+            if step['disposal'] > 0:
+                s_pipette.blow_out(buffer.top())
     
     ############################
     # PROTOCOL STARTS HERE
     ############################
 
     # set/reset pipettes speeds
-    set_speeds(pipette20s, pspeed)
-    set_speeds(pipette300s, pspeed)
+    set_speeds(pipette20s, float(pspeed))
+    set_speeds(pipette300s, float(pspeed))
 
     # initialize variables
     
@@ -186,12 +330,38 @@ def run(ctx: protocol_api.ProtocolContext):
     # estimate total buffer volume (mL) based on sum of all imported volumes
     buffer_needed = round(sum([float(tfer['Value']) for tfer in tfers if tfer['Value']])/1000.0,2)
 
-    # how many buffer slots are needed?
-    bufferslots = math.ceil(float(buffer_needed)*1000/float(res_vol))
+    # plan the aspirations and their buffer slots
+    steps = plan_transfers(tfers)
+    bufferslots = max(step['bufferidx'] for step in steps)
+    if bufferslots > max_bufferslots:
+        usrmsg = (
+            'this run needs ' + str(bufferslots) + ' buffer slots of ' +
+            str(res_vol) + 'ul and only ' + str(max_bufferslots) + ' are available'
+            )
+        raise Exception(usrmsg)
+
+    # pipette switches after grouping the steps by pipette
+    switches = sum(1 for prev, step in zip(steps, steps[1:]) if prev['pip'] != step['pip'])
+    ctx.comment("## " + str(switches) + " pipette switch(es) in the run")
 
     # inform about the volume of buffer needed
     ctx.comment("## the run will use " + str(buffer_needed) + "mL dilution buffer")
 
+    # report the round trips to the buffer
+    round_trips = len(vol_list)
+    ctx.comment(
+        "## " + str(round_trips) + " wells filled with " + str(len(steps)) +
+        " aspirations (" + str(round_trips - len(steps)) +
+        " round trips to the buffer saved by multi-dispensing and multichannel)")
+
+    # columns filled with the multichannel (fast path)
+    fast_columns = sum(len(step['dispenses']) for step in steps if step['channels'] == 8)
+    if multi_pip:
+        ctx.comment(
+            "## " + str(fast_columns) + " uniform column(s) will be filled with the " +
+            ("p20_multi_gen2" if multi_pip == "p20" else "p300_multi_gen2") +
+            ", " + str(round_trips - 8 * fast_columns) + " well(s) with a single channel")
+
     ctx.pause("## Fill '" + str(bufferslots) + "' reagent container slot(s) with " + str(float(res_vol)*1.2/1000) + "mL buffer (each)")
 
     ctx.pause(
@@ -201,9 +371,15 @@ def run(ctx: protocol_api.ProtocolContext):
         '#'*75
         )
 
-    process_data(tfers, buffer, buffer_counter, bufferidx)
+    process_data(steps)
+
+    # eject tips where present
+    for pipette in [pipette20s, pipette300s]:
+        if pipette.has_tip:
+            pipette.drop_tip()
 
     ctx.comment(
       "\n    #############################################" +
+      "\n    ## fast path: " + str(fast_columns) + " column(s) filled with a multichannel" +
       "\n    ## All done!" +
       "\n    #############################################")
@@ -147,9 +147,14 @@ def run(ctx):
 
     spl_nbr = int(spl_nbr)
     num_col = int(spl_nbr/8)
-    if num_col - tip_park_s_col < 0:
+    if tip_park_s_col - 1 + num_col + 6 > 12:
         raise Exception("Not enough tips on slot 11. Refill tip rack on 11.")
 
+    # shift indices to 0-based
+    tip300_s_col = int(tip300_s_col) - 1
+    idx_s_col = int(idx_s_col) - 1
+    tip_park_s_col = int(tip_park_s_col) - 1
+
     ####################
     # CUSTOM FUNCTIONS
     ####################
@@ -26,6 +26,11 @@ def get_values(*names):
     return [_all_values[n] for n in names]
 
 
+# tip rack slots and tips per rack
+tip_slots = ['7', '8', '9', '10', '11']
+rack_tips = 96
+
+
 def run(ctx: protocol_api.ProtocolContext):
     [sp_vol,
         sp_num,
@@ -74,9 +79,12 @@ def run(ctx: protocol_api.ProtocolContext):
 
     # provision enough tips
     # total_tips = sp_num*96+8
+    # (the pre-fill tips are returned and used again for plate 1)
+    # the racks are refilled during the run when the tip slots are short
     total_tips = sp_num*96
-    tiprack_num = math.ceil(total_tips/96)
-    t_slots = ['7', '8', '9', '10', '11'][:tiprack_num]
+    tiprack_num = min(math.ceil(total_tips/rack_tips), len(tip_slots))
+    refills = math.ceil(total_tips/(rack_tips*tiprack_num)) - 1
+    t_slots = tip_slots[:tiprack_num]
     tips = [ctx.load_labware(
         'opentrons_96_filtertiprack_20ul',
         t_slot,
@@ -89,6 +97,11 @@ def run(ctx: protocol_api.ProtocolContext):
         m20_mount,
         tip_racks=tips)
 
+    ctx.comment(
+        '## ' + str(total_tips) + ' tips in ' + str(tiprack_num) +
+        ' rack(s) (slots ' + ', '.join(t_slots) + '), ' +
+        str(refills) + ' rack refill(s) during the run')
+
     ctx.pause(
         '\n\n' + '#'*75 +
         '\nPut Sample plates in deck positions : [' +
@@ -106,6 +119,14 @@ def run(ctx: protocol_api.ProtocolContext):
         pip.flow_rate.dispense = dspeed if dspeed is not None else aspeed
         pip.flow_rate.blow_out = bspeed if bspeed is not None else aspeed
 
+    def refill_tips(pip, channels):
+        # pause for full tip racks when none has tips left for this pick-up
+        if any(rack.next_tip(channels) for rack in pip.tip_racks):
+            return
+        ctx.pause('## Replace the tip racks of the ' + pip.name + ' (slots ' +
+                  ', '.join(t_slots) + ') with full racks')
+        pip.reset_tipracks()
+
     ############################
     # PROTOCOL STARTS HERE
     ############################
@@ -151,6 +172,7 @@ def run(ctx: protocol_api.ProtocolContext):
             "\n    #############################################\n")
         # mix 5x5uL in samples before aspirating sp_vo
         for col in sample_plate.columns():
+            refill_tips(pipette, 8)
             pipette.transfer(
                 sp_vol,
                 col,
@@ -21,20 +21,235 @@ def get_values(*names):
         "uploaded_csv":"source_plate,source_well,source_volume,dil_factor\\n1,A1,2.5,1\\n1,A8,5,1\\n2,B4,2.5,10\\n3,F6,2.5,80\\n4,H8,20,50",
         "min_vol":"2.0",
         "sp_type":"biorad_96_wellplate_200ul_pcr",
-        "dp_type":"biorad_96_wellplate_200ul_pcr"
+        "dp_type":"biorad_96_wellplate_200ul_pcr",
+        "well_order":"serpentine",
+        "tris_prefill":"true",
+        "multi_mount":"none",
+        "tris_vol":"5000"
         }""")
     return [_all_values[n] for n in names]
 
 
+# tris tubes in the 15ml tube rack, used in this order
+tris_slots = ['A1', 'A2', 'A3', 'A4', 'A5']
+
+# 15ml falcon tube: conical bottom, then a cylinder (mm)
+falcon_radius = 7.25
+falcon_cone = 22.0
+
+# tip rack slots and tips per rack
+tip_slots = ['7', '8', '9', '10', '11']
+rack_tips = 96
+
+# source plate slots (plates 1..4) and the order in which they are visited
+plate_slots = ['5', '6', '2', '3']
+slot_path = ['5', '6', '3', '2']
+
+
+def serpentine_rank(s_pl, s_well):
+    # rank of a source well along the slot path, walking the plate columns
+    # down (A->H) and up (H->A) in turn
+    row = 'ABCDEFGH'.index(s_well[0].upper())
+    col = int(s_well[1:]) - 1
+    return (slot_path.index(plate_slots[s_pl - 1]), col, row if col % 2 == 0 else 7 - row)
+
+
+def order_rows(data):
+    # csv rows sorted by slot, then serpentine within each plate
+    return sorted(data, key=lambda row: serpentine_rank(int(row[0]), row[1]))
+
+
+def full_columns(data, max_vol=20.0):
+    # undiluted csv rows that fill a whole source column (A..H) with one
+    # volume, {(plate, column): vol}; these are pooled with a multichannel
+    groups = {}
+    for row in data:
+        groups.setdefault((int(row[0]), row[1][1:]), []).append(row)
+    columns = {}
+    for key, rows in groups.items():
+        if (sorted(row[1][0].upper() for row in rows) == list('ABCDEFGH') and
+                all(float(row[3]) == 1 for row in rows) and
+                len(set(float(row[2]) for row in rows)) == 1 and
+                float(rows[0][2]) <= max_vol):
+            columns[key] = float(rows[0][2])
+    return columns
+
+
+def pool_columns(columns, first_free, max_well_vol):
+    # dilution plate column (index) that collects each full source column
+    # {(plate, column): index}, filled from column 12 backwards with at most
+    # max_well_vol per well; the columns that would reach the dilution
+    # wells are left out (pooled by the single channel)
+    order = sorted(columns, key=lambda key: serpentine_rank(key[0], 'A' + key[1])[0:2])
+    assigned = {}
+    index = 11
+    well_vol = 0.0
+    for key in order:
+        if well_vol + columns[key] > max_well_vol:
+            index -= 1
+            well_vol = 0.0
+        if index < first_free:
+            break
+        assigned[key] = index
+        well_vol += columns[key]
+    return assigned
+
+
+def split_pool(volumes, max_tube_vol, ini_vol, max_tubes):
+    # tube index of each pool transfer [vol, ...], balanced by volume over
+    # the fewest tubes that hold the pool: largest transfers first, each to
+    # the tube with the least volume (every tube starts with ini_vol)
+    ntubes = max(1, int(math.ceil(sum(volumes) / (max_tube_vol - ini_vol))))
+    while ntubes <= max_tubes:
+        loads = [ini_vol] * ntubes
+        tubes = [0] * len(volumes)
+        for i in sorted(range(len(volumes)), key=lambda i: -volumes[i]):
+            tubes[i] = loads.index(min(loads))
+            loads[tubes[i]] += volumes[i]
+        if max(loads) <= max_tube_vol:
+            return tubes
+        ntubes += 1
+    usrmsg = (
+        '## Pool estimated at ' + str(round(sum(volumes) + ini_vol, 1)) + 'uL' +
+        '\n## the pool would need more than ' + str(max_tubes) + ' tubes, stopping!')
+    raise Exception(usrmsg)
+
+
+def pack_tris(volumes, capacity, disposal, min_part):
+    # aspirations [[(dil_well, vol), ...], ...] for the tris volumes of the
+    # dilution wells {dil_well: vol}: full tips of capacity are dispensed
+    # alone (leaving at least min_part), the rest of each well is packed
+    # first-fit decreasing in multi-dispense aspirations that also hold
+    # the disposal volume
+    single = []
+    parts = []
+    for dil_well, vol in sorted(volumes.items()):
+        while vol > capacity:
+            chunk = round(min(capacity, vol - min_part), 2)
+            single.append([(dil_well, chunk)])
+            vol = round(vol - chunk, 2)
+        if vol > 0:
+            parts.append((dil_well, vol))
+    bins = []
+    for part in sorted(parts, key=lambda p: -p[1]):
+        for b in bins:
+            if sum(v for w, v in b) + part[1] + disposal <= capacity + 1e-6:
+                b.append(part)
+                break
+        else:
+            bins.append([part])
+    return sorted(single + [sorted(b) for b in bins])
+
+
+def dilution_steps(d_fact, s_vol, max_dil_fact):
+    # (sample, tris) volumes of the dilution wells of one sample: one well
+    # up to max_dil_fact, above that a serial dilution through two wells of
+    # sqrt(d_fact) each, the second well takes s_vol from the first
+    if d_fact <= max_dil_fact:
+        return [(s_vol, (d_fact - 1) * s_vol)]
+    step = math.sqrt(d_fact)
+    return [(s_vol, (step - 1) * s_vol)] * 2
+
+
+def tris_volumes(rows, min_vol, max_dil_fact):
+    # tris volume of each dilution well {dil_well: vol} for the rows in
+    # processing order (same limits as the main loop)
+    volumes = {}
+    for row in rows:
+        if float(row[3]) > 1:
+            for s_vol, tris in dilution_steps(
+                    float(row[3]), min(float(row[2]), min_vol), max_dil_fact):
+                volumes[len(volumes)] = tris
+    return volumes
+
+
+def assign_tris(aspirations, tube_vol, min_left, max_tubes):
+    # tris tube (index) of each aspiration [(vol, disposal), ...], the next
+    # tube is used when the current one would drop below min_left (the
+    # disposal volume is blown back into the tube it came from)
+    trisidx = 0
+    tris_counter = tube_vol
+    tubes = []
+    for vol, disposal in aspirations:
+        if tris_counter - vol - disposal < min_left:
+            trisidx += 1
+            tris_counter = tube_vol
+        if trisidx >= max_tubes or vol + disposal > tube_vol - min_left:
+            usrmsg = (
+                'the run needs more than ' + str(max_tubes) +
+                ' Tris tubes of ' + str(tube_vol) + 'uL')
+            raise Exception(usrmsg)
+        tubes.append(trisidx)
+        tris_counter -= vol
+    return tubes
+
+
+def tube_height(vol):
+    # liquid height (mm above the bottom) of vol uL in a 15ml falcon tube
+    cone_vol = math.pi * falcon_radius**2 * falcon_cone / 3
+    if vol <= cone_vol:
+        return falcon_cone * (max(vol, 0.0) / cone_vol) ** (1.0/3)
+    return falcon_cone + (vol - cone_vol) / (math.pi * falcon_radius**2)
+
+
+def tip_racks(tips, slots):
+    # tip rack slots of each pipette {'single': [..], 'multi': [..]} for the
+    # tips {'single': n, 'multi': n} they need: one rack per rack_tips tips,
+    # shared in proportion of the needs when the slots are short (the racks
+    # are then refilled during the run)
+    need = dict((pip, int(math.ceil(tips[pip] / float(rack_tips)))) for pip in ['single', 'multi'])
+    racks = dict((pip, min(1, need[pip])) for pip in need)
+    left = len(slots) - sum(racks.values())
+    while left > 0 and any(racks[pip] < need[pip] for pip in racks):
+        pip = max(['single', 'multi'], key=lambda p: need[p] / float(max(racks[p], 0.1)))
+        racks[pip] += 1
+        left -= 1
+    return {'single': slots[:racks['single']],
+            'multi': slots[racks['single']:racks['single'] + racks['multi']]}
+
+
+def tip_refills(tips, rack_slots):
+    # tip rack refills expected for each pipette
+    return dict((pip, max(0, int(math.ceil(tips[pip] / float(rack_tips * max(len(slots), 1)))) - 1))
+                for pip, slots in rack_slots.items())
+
+
+def path_length(points):
+    # xy distance along a list of (x, y) points (mm)
+    return sum(math.hypot(b[0] - a[0], b[1] - a[1])
+               for a, b in zip(points, points[1:]))
+
+
 def run(ctx: protocol_api.ProtocolContext):
     [uploaded_csv,
         min_vol,
         sp_type,
-        dp_type] = get_values(    # noqa: F821
+        dp_type,
+        well_order,
+        tris_prefill,
+        multi_mount,
+        tris_vol] = get_values(    # noqa: F821
         'uploaded_csv',
         'min_vol',
         'sp_type',
-        'dp_type')
+        'dp_type',
+        'well_order',
+        'tris_prefill',
+        'multi_mount',
+        'tris_vol')
+
+    # process the csv rows in file order or along a serpentine path
+    well_order = str(well_order).lower()
+    if well_order not in ['csv', 'serpentine']:
+        raise Exception("well_order should be one of csv or serpentine")
+
+    # distribute the tris of all dilution wells first, with one tip
+    tris_prefill = str(tris_prefill).lower() in ['true', 'yes', '1']
+
+    # p20 multichannel on the free mount for full columns of identical samples
+    multi_mount = str(multi_mount).lower()
+    if multi_mount not in ['none', 'right']:
+        raise Exception("multi_mount should be one of none or right")
 
     # reference for custom functions
     jakadi = ctx
@@ -43,22 +258,26 @@ def run(ctx: protocol_api.ProtocolContext):
         'opentrons_15_tuberack_falcon_15ml_conical',
         '1')
 
-    # tris in top-left 15ml tube
-    tris_tube = tube_rack.wells_by_name()['A1']
-    global tris_counter
-    tris_counter = 5000.0
+    # tris in the top row 15ml tubes (A1, then A2.. when it runs low)
+    tris_vol = float(tris_vol)    # loaded in each tube
+    min_tris = 500.0    # left in a tube before the next one is used
+    tris_depth = 5.0    # aspirate this far below the tris surface (mm)
     # initial volume in pool tube
     ini_tris = 50.0
+    # extra tris aspirated for a multi-dispense, blown back in the tube
+    disposal_vol = 2.0
 
-    # pool in bottom-right 15ml tube
-    pool_tube = tube_rack.wells_by_name()["C5"]
+    # pool in bottom-right 15ml tube, split over the next tubes when larger
+    pool_slots = ['C5', 'C4', 'C3', 'C2', 'C1', 'B5', 'B4', 'B3', 'B2', 'B1']
     max_pool_vol = 8000.0    # to fit in one tube
+    max_pool_well = 180.0    # per well of a pooling column (multichannel)
 
     # reset type
     min_vol = float(min_vol)
 
-    # must dilute in a 200uL well
+    # must dilute in a 200uL well, two wells in series above
     max_dil_fact = 200.0/min_vol   # eg 200.0/2.5 = 80x
+    max_two_step = max_dil_fact**2    # eg 6400x
 
     dilution_plate = ctx.load_labware(
         dp_type,
@@ -76,15 +295,70 @@ def run(ctx: protocol_api.ProtocolContext):
     # do some testing on the user data
     ###################################
 
-    # provision enough tips
-    total_tips = len(data) + 1
-    tiprack_num = math.ceil(total_tips/96)
-    slots = ['7', '8', '9', '10', '11'][:tiprack_num]
+    # fail if dilution factors larger than max_two_step in csv
+    dils = [float(row[3]) for row in data]
+    if max(dils) > max_two_step:
+        usrmsg = (
+            'dilution factor(s) in csv are larger' +
+            ' than the max possible in two steps !' +
+            ' (' + str(max_two_step) + ')')
+        raise Exception(usrmsg)
+
+    # dilution wells of each diluted sample (two above max_dil_fact)
+    dil_steps = [dilution_steps(float(row[3]), min(float(row[2]), min_vol), max_dil_fact)
+                 for row in data if float(row[3]) > 1]
+    two_step = len([steps for steps in dil_steps if len(steps) > 1])
+
+    # fail if too many dilution wells for the csv
+    dilcnt = sum(len(steps) for steps in dil_steps)
+    ctx.comment(
+        '## ' + str(len(dil_steps)) +
+        ' of the ' + str(len(data)) +
+        ' samples will be diluted (' + str(two_step) +
+        ' in two steps), in ' + str(dilcnt) + ' dilution wells')
+
+    if dilcnt > 96:
+        usrmsg = (
+            'max 96 dilution wells can be used!' +
+            '(csv needs ' + str(dilcnt) + ')')
+        raise Exception(usrmsg)
+
+    # full source columns of identical undiluted samples (multichannel),
+    # collected in pooling columns of the dilution plate (from column 12
+    # backwards) then consolidated in the pool tube; the columns that do
+    # not fit next to the dilution wells stay with the single channel
+    fast = full_columns(data) if multi_mount == 'right' else {}
+    pooled = pool_columns(fast, int(math.ceil(dilcnt/8.0)), max_pool_well)
+    if len(pooled) < len(fast):
+        ctx.comment(
+            '## ' + str(len(fast) - len(pooled)) + ' full column(s) do not fit next to' +
+            ' the dilution wells and are pooled with the single channel')
+    fast = dict((key, fast[key]) for key in pooled)
+    single_data = [row for row in data if (int(row[0]), row[1][1:]) not in fast]
+
+    # provision the tips: one per csv row, +1 for the tris pre-fill, +1 to
+    # consolidate the pooling columns, 8 per full column; the racks are
+    # refilled during the run when the tip slots are short
+    tip_count = {'single': len(single_data) + 1 + (1 if fast else 0),
+                 'multi': 8*len(fast)}
+    rack_slots = tip_racks(tip_count, tip_slots)
+    refills = tip_refills(tip_count, rack_slots)
     tips = [ctx.load_labware(
         'opentrons_96_filtertiprack_20ul',
         slot,
         label='tip_20')
-            for slot in slots]
+            for slot in rack_slots['single']]
+    tips_multi = [ctx.load_labware(
+        'opentrons_96_filtertiprack_20ul',
+        slot,
+        label='tip_20_multi')
+            for slot in rack_slots['multi']]
+    for pip in ['single', 'multi']:
+        if tip_count[pip]:
+            ctx.comment(
+                '## ' + str(tip_count[pip]) + ' tips for the ' + pip + ' channel p20 in ' +
+                str(len(rack_slots[pip])) + ' rack(s) (slots ' + ', '.join(rack_slots[pip]) +
+                '), ' + str(refills[pip]) + ' rack refill(s) during the run')
 
     # define pipette
     pipette = ctx.load_instrument(
@@ -92,42 +366,78 @@ def run(ctx: protocol_api.ProtocolContext):
         'left',
         tip_racks=tips)
 
+    if multi_mount == 'right':
+        multi = ctx.load_instrument(
+            'p20_multi_gen2',
+            'right',
+            tip_racks=tips_multi)
+
     # set speed for all pipette operations
     pspeed = 7.56
-
-    # fail if too many samples to be diluted in csv
-    dilcnt = len([row[3] for row in data if (row[3] != '1')])
-    ctx.comment(
-        '## ' + str(dilcnt) +
-        ' of the ' + str(len(data)) +
-        ' samples will be diluted')
-
-    if dilcnt > 96:
-        usrmsg = (
-            'max 96 samples can be diluted!' +
-            '(csv has ' + str(dilcnt) + ')')
-        raise Exception(usrmsg)
+    # tris is aspirated just below its surface, at a higher speed
+    tris_aspeed = 2 * pspeed
+
+    pool_index = sorted(set(pooled.values()), reverse=True)
+
+    # volume reaching the pool for each csv row (min_vol of the diluted
+    # samples) and each pooling column (8 wells), balanced over the tubes
+    pool_vols = [
+        min(float(row[2]), min_vol) if float(row[3]) > 1 else float(row[2])
+        for row in single_data] + [
+        8 * sum(fast[key] for key in pooled if pooled[key] == index)
+        for index in pool_index]
+    pool_split = split_pool(pool_vols, max_pool_vol, ini_tris, len(pool_slots))
+    single_data = [row[0:4] + [tube] for row, tube in zip(single_data, pool_split)]
+    column_tube = dict(zip(pool_index, pool_split[len(single_data):]))
+    pool_tubes = [tube_rack.wells_by_name()[name]
+                  for name in pool_slots[:max(pool_split, default=0) + 1]]
+    tube_vols = [ini_tris + sum(vol for vol, tube in zip(pool_vols, pool_split) if tube == i)
+                 for i in range(len(pool_tubes))]
+
+    # process the csv rows in file order or along a serpentine path
+    ordered = order_rows(single_data) if well_order == 'serpentine' else single_data
+
+    # tris aspirations of the run in order [(vol, disposal), ...]: the pool
+    # tubes, then the dilution wells (pre-fill or well by well)
+    volumes = tris_volumes(ordered, min_vol, max_dil_fact)
+    tris_aspirations = [(ini_tris, 0.0)] * len(pool_tubes)
+    if tris_prefill:
+        tris_aspirations += [
+            (sum(v for w, v in aspiration), disposal_vol if len(aspiration) > 1 else 0.0)
+            for aspiration in pack_tris(volumes, 20.0, disposal_vol, min_vol)]
+    else:
+        tris_aspirations += [(vol, 0.0) for vol in volumes.values()]
+    tris_plan = assign_tris(tris_aspirations, tris_vol, min_tris, len(tris_slots))
+    tris_tubes = [tube_rack.wells_by_name()[name]
+                  for name in tris_slots[:max(tris_plan) + 1]]
+    tris_left = [tris_vol] * len(tris_tubes)
+    tris_used = [sum(asp[0] for asp, idx in zip(tris_aspirations, tris_plan) if idx == i)
+                 for i in range(len(tris_tubes))]
 
     # estimate volumes based on CSV data
-    trisdil = ini_tris + sum([
-        float(min_vol)*float(row[3]) for row in data if (row[3] != '1')
-        ])
-    dilsmplvol = sum([float(min_vol) for row in data if (row[3] != '1')])
-    nondilsmplvol = sum([float(row[2]) for row in data if (row[3] == '1')])
+    trisdil = round(sum(tris_used), 1)
 
     # inform about the volume of Tris needed
-    ctx.comment("## the run will use " + str(trisdil) + "uL Tris buffer")
-    ctx.pause("## check there is enough Tris in the tube on position #1:A1")
-
-    # fail if pool is too large
-    pool_vol = round(trisdil+dilsmplvol+nondilsmplvol, 1)
-    if pool_vol > max_pool_vol:
-        usrmsg = (
-            '## Pool estimated at ' + str(pool_vol) + 'uL)' +
-            '\n## the pool would be too large for the tube, stopping!')
-        raise Exception(usrmsg)
-
-    ctx.comment("## the pool will contain " + str(pool_vol) + "uL")
+    ctx.comment(
+        "## the run will use " + str(trisdil) + "uL Tris buffer from " +
+        str(len(tris_tubes)) + " tube(s): " +
+        ", ".join(tris_slots[i] + " " + str(round(vol, 1)) + "uL"
+                  for i, vol in enumerate(tris_used)))
+    ctx.pause(
+        "## load " + str(len(tris_tubes)) + " Tris tube(s) with " + str(tris_vol) +
+        "uL in #1:" + ",".join(tris_slots[:len(tris_tubes)]) +
+        " each (the aspiration height follows that volume)" +
+        " and place " + str(len(pool_tubes)) + " empty pool tube(s) in #1:" +
+        ",".join(pool_slots[:len(pool_tubes)]))
+
+    # the dilution tris stays in the dilution plate, only the sample
+    # volumes and the initial tris of each tube reach the pool
+    pool_vol = round(sum(tube_vols), 1)
+    ctx.comment(
+        "## the pool will contain " + str(pool_vol) + "uL in " +
+        str(len(pool_tubes)) + " tube(s): " +
+        ", ".join(pool_slots[i] + " " + str(round(vol, 1)) + "uL"
+                  for i, vol in enumerate(tube_vols)))
 
     # fail if too many samples plates (sp_number)
     plates = [int(row[0]) for row in data]
@@ -147,17 +457,8 @@ def run(ctx: protocol_api.ProtocolContext):
             '(' + str(min_vol) + ')')
         raise Exception(usrmsg)
 
-    # warn if dilution factors larger than max_dil_fact in csv
-    dils = [float(row[3]) for row in data]
-    if max(dils) > max_dil_fact:
-        usrmsg = (
-            'dilution factor(s) in csv are larger' +
-            ' than the max possible !' +
-            ' (' + str(max_dil_fact) + ')')
-        raise Exception(usrmsg)
-
     # up top 4 customer plates to pick CSV-selected samples from
-    slots = ['5', '6', '2', '3'][:sp_number]    # slots[0:sp_number]
+    slots = plate_slots[:sp_number]    # slots[0:sp_number]
     source_list = [
         ctx.load_labware(sp_type, slot, 'Source plates')
         for slot in slots]
@@ -170,6 +471,14 @@ def run(ctx: protocol_api.ProtocolContext):
         '#'*75
         )
 
+    if fast:
+        ctx.comment(
+            '## ' + multi.name + ': ' + str(len(fast)) + ' full column(s) of identical' +
+            ' undiluted samples pooled in ' + str(len(set(pooled.values()))) +
+            ' column(s) of the dilution plate, ' + str(len(fast) + 1) +
+            ' tip pick-ups instead of ' + str(8*len(fast)) +
+            ' (' + str(7*len(fast) - 1) + ' saved)')
+
     ###########
     # routines
     ###########
@@ -183,51 +492,161 @@ def run(ctx: protocol_api.ProtocolContext):
         # req: jakadi reference created on top of the code
         pip.flow_rate.set_defaults(jakadi.api_version)
 
-    def dilute_and_pool(s_pl, s_well, s_vol, d_fact, dil_well):
+    def xy(well):
+        # deck coordinates of a well (mm)
+        point = well.top().point
+        return (point.x, point.y)
+
+    def refill_tips(pip, channels):
+        # pause for full tip racks when none has tips left for this pick-up
+        if any(rack.next_tip(channels) for rack in pip.tip_racks):
+            return
+        pip_name = 'multi' if pip.channels > 1 else 'single'
+        ctx.pause('## Replace the tip racks of the ' + pip.name + ' (slots ' +
+                  ', '.join(rack_slots[pip_name]) + ') with full racks')
+        pip.reset_tipracks()
+
+    def nearest_tip(last, target, racks):
+        # next tip of the rack that gives the shortest way from the last
+        # position (the trash) to the tip and on to the target well
+        tips = [rack.next_tip() for rack in racks]
+        tips = [tip for tip in tips if tip is not None]
+        if not tips:
+            return None
+        return min(tips, key=lambda tip: path_length([last, xy(tip), target]))
+
+    def pick_up_for(s_pl, s_well):
+        # pick up the tip for a source well (nearest rack when ordering)
+        refill_tips(pipette, 1)
+        if well_order == 'serpentine':
+            tip = nearest_tip(xy(ctx.fixed_trash.wells()[0]),
+                              xy(source_list[s_pl-1][s_well]), pipette.tip_racks)
+            if tip is not None:
+                pipette.pick_up_tip(tip)
+                return
+        pipette.pick_up_tip()
 
-        # pipet s_vol from dilution plate next_dil_well to pool
+    def travel(rows, nearest):
+        # estimated xy travel (mm) of the gantry for the rows: tip, (tris,
+        # dilution well, sample, dilution well), pool and trash for each row
+        trash = xy(ctx.fixed_trash.wells()[0])
+        racks = [[xy(tip) for tip in rack.wells() if tip.has_tip] for rack in tips]
+        points = []
+        if tris_prefill:
+            for aspiration in pack_tris(tris_volumes(rows, min_vol, max_dil_fact), 20.0,
+                                        disposal_vol, min_vol):
+                points.append(xy(tris_tubes[0]))
+                points += [xy(dilution_plate.wells()[w]) for w, v in aspiration]
+        dil_well = 0
+        for row in rows:
+            source = xy(source_list[int(row[0])-1][row[1]])
+            full = [rack for rack in racks if rack]
+            if not full:
+                # refilled racks
+                racks = [[xy(tip) for tip in rack.wells()] for rack in tips]
+                full = racks
+            if nearest:
+                rack = min(full, key=lambda r: path_length([trash, r[0], source]))
+            else:
+                rack = full[0]
+            points.append(rack.pop(0))
+            if float(row[3]) > 1:
+                steps = dilution_steps(float(row[3]), min(float(row[2]), min_vol), max_dil_fact)
+                wells = [xy(dilution_plate.wells()[dil_well + i]) for i in range(len(steps))]
+                if not tris_prefill:
+                    # one tube round trip per 20ul of tris, for each well
+                    for dil, (s_vol, tris) in zip(wells, steps):
+                        trips = int(math.ceil(round(tris / 20.0, 6)))
+                        points += [xy(tris_tubes[0]), dil] * trips
+                for dil in wells:
+                    points += [dil, source, dil]
+                    source = dil
+                dil_well += len(steps)
+            else:
+                points.append(source)
+            points += [xy(pool_tubes[row[4]]), trash]
+        return path_length(points)
+
+    def take_tris(vol):
+        # tris tube of the next aspiration (see tris_plan), the height below
+        # the surface left after vol and the aspiration speed: tris_aspeed
+        # in the cylinder of the tube, at the bottom with the sample speed
+        # once the tip would reach the cone (uncertain height)
+        idx = tris_plan.pop(0)
+        tris_left[idx] -= vol
+        height = tube_height(tris_left[idx]) - tris_depth
+        if height < falcon_cone:
+            return tris_tubes[idx], tris_tubes[idx].bottom(1.0), pspeed
+        return tris_tubes[idx], tris_tubes[idx].bottom(height), tris_aspeed
+
+    def prefill_tris(aspirations):
+        # dispense the tris into the dilution wells, the disposal volume of
+        # a multi-dispense is blown back in the tris tube
+        for aspiration in aspirations:
+            disposal = disposal_vol if len(aspiration) > 1 else 0.0
+            tris_tube, tris_loc, aspeed = take_tris(sum(v for w, v in aspiration))
+            set_speeds(pipette, aspeed, pspeed, pspeed)
+            pipette.aspirate(round(sum(v for w, v in aspiration) + disposal, 2), tris_loc)
+            set_speeds(pipette, pspeed)
+            for dil_well, vol in aspiration:
+                pipette.dispense(vol, dilution_plate.wells()[dil_well])
+            if disposal > 0:
+                pipette.blow_out(tris_tube.top())
+
+    def dilute_and_pool(s_pl, s_well, s_vol, d_fact, dil_wells, pool_tube):
+
+        # pipet s_vol from the last dilution well to pool
         ctx.comment(
             '\n' + '#'*3 + ' diluting ' + str(s_vol) + 'ul from plate' +
             str(s_pl) + " " + s_well + " " + str(d_fact) +
-            ' times, and adding ' + str(s_vol) + 'ul to the pool')
-
-        # pipette.pick_up_tip()
-
-        # add tris to dil_fact to dilution plate in well next_dil_well
-        tris_vol = (d_fact-1) * s_vol
-
-        # enough for next dilution or increment tris tube index
-        global tris_counter
-        tris_counter -= tris_vol
-
-        ctx.comment(
-            '\n' + '#'*2 + ' taking ' + str(tris_vol) +
-            'ul tris for dilution' +
-            '\n')
-
-        # pipet tris_vol to dilution plate next_dil_well
-        pipette.transfer(
-            tris_vol,
-            tris_tube,
-            dilution_plate.wells()[dil_well],
-            new_tip='never'
-            )
-
-        # pipet s_vol to dilution plate next_dil_well and mix with at most 20ul
-        mix_vol = min(20, 0.8 * tris_vol)
+            ' times' + (' in ' + str(len(dil_wells)) + ' steps' if len(dil_wells) > 1 else '') +
+            ', and adding ' + str(s_vol) + 'ul to the pool')
+
+        pick_up_for(s_pl, s_well)
+
+        # the tris is already in the wells after the pre-fill, otherwise it
+        # goes to every dilution well of the sample while the tip is clean
+        # (a tip that has mixed a sample never returns to the tris tube)
+        if not tris_prefill:
+            for dil_well, step_vol, tris_vol in dil_wells:
+                # next tris tube when this one runs low
+                tris_tube, tris_loc, aspeed = take_tris(tris_vol)
+
+                ctx.comment(
+                    '\n' + '#'*2 + ' taking ' + str(round(tris_vol, 2)) +
+                    'ul tris for dilution from ' + tris_tube.well_name +
+                    '\n')
+
+                # pipet tris_vol to dilution plate dil_well
+                set_speeds(pipette, aspeed, pspeed, pspeed)
+                pipette.transfer(
+                    tris_vol,
+                    tris_loc,
+                    dilution_plate.wells()[dil_well],
+                    new_tip='never'
+                    )
+                set_speeds(pipette, pspeed)
+
+        # sample, then each dilution well in turn (serial dilution)
         pltidx = s_pl-1
-        pipette.transfer(
-            s_vol,
-            source_list[pltidx][s_well],
-            dilution_plate.wells()[dil_well],
-            mix_after=(10, mix_vol),
-            new_tip='never'
-            )
+        source = source_list[pltidx][s_well]
+
+        for dil_well, step_vol, tris_vol in dil_wells:
+            # pipet step_vol to dilution plate dil_well and mix with at most 20ul
+            mix_vol = min(20, 0.8 * tris_vol)
+            pipette.transfer(
+                step_vol,
+                source,
+                dilution_plate.wells()[dil_well],
+                mix_after=(10, mix_vol),
+                new_tip='never'
+                )
+            source = dilution_plate.wells()[dil_well]
 
         # transfer s_vol (diluted) to pool
         pipette.transfer(
             s_vol,
-            dilution_plate.wells()[dil_well],
+            source,
             pool_tube,
             blow_out=True,
             blowout_location='destination well',
@@ -236,7 +655,7 @@ def run(ctx: protocol_api.ProtocolContext):
 
         pipette.drop_tip()
 
-    def add_to_pool(s_pl, s_well, s_vol, d_fact):
+    def add_to_pool(s_pl, s_well, s_vol, d_fact, pool_tube):
 
         # pipet s_vol to pool
         ctx.comment(
@@ -248,7 +667,7 @@ def run(ctx: protocol_api.ProtocolContext):
 
         # transfer s_vol (undiluted) to pool
         pltidx = s_pl-1
-        pipette.pick_up_tip()
+        pick_up_for(s_pl, s_well)
         pipette.transfer(
             s_vol,
             source_list[pltidx][s_well],
@@ -263,29 +682,86 @@ def run(ctx: protocol_api.ProtocolContext):
     # PROTOCOL STARTS HERE
     ############################
 
+    set_speeds(pipette, pspeed)
+    if multi_mount == 'right':
+        set_speeds(multi, pspeed)
+
+    # the full columns are pooled with the multichannel
+    data = ordered
+
+    # report the estimated gantry travel of the ordered transfers (none
+    # when every csv row is in a full column of the multichannel)
+    before = travel(single_data, False)
+    if before == 0:
+        ctx.comment("## no single channel transfers, all rows are pooled by column")
+    elif well_order == 'serpentine':
+        after = travel(data, True)
+        ctx.comment(
+            "## estimated gantry travel: " + str(round(before/1000, 1)) +
+            "m in csv order, " + str(round(after/1000, 1)) +
+            "m in serpentine order with the nearest tip rack (" +
+            str(round(100.0*(after-before)/before, 1)) + "%)")
+    else:
+        ctx.comment(
+            "## estimated gantry travel: " + str(round(before/1000, 1)) + "m in csv order")
+
     ############################
     # fill pool tube 50 uL Tris
     ############################
 
-    set_speeds(pipette, pspeed)
-
-    # prefill pool tube with ini_tris uL to receive small volumes
+    # prefill each pool tube with ini_tris uL to receive small volumes
+    refill_tips(pipette, 1)
     pipette.pick_up_tip()
-    pipette.transfer(
-        ini_tris,
-        tris_tube,
-        pool_tube,
-        new_tip='never'
-        )
+    for pool_tube in pool_tubes:
+        tris_tube, tris_loc, aspeed = take_tris(ini_tris)
+        set_speeds(pipette, aspeed, pspeed, pspeed)
+        pipette.transfer(
+            ini_tris,
+            tris_loc,
+            pool_tube,
+            new_tip='never'
+            )
+        set_speeds(pipette, pspeed)
+
+    # tris of all dilution wells with the same tip (multi-dispense)
+    if tris_prefill:
+        aspirations = pack_tris(volumes, 20.0, disposal_vol, min_vol)
+        if volumes:
+            ctx.comment(
+                "## tris pre-fill: " + str(len(aspirations)) + " aspirations for " +
+                str(len(volumes)) + " dilution wells with one tip (" +
+                str(sum(int(math.ceil(round(v / 20.0, 6))) for v in volumes.values())) +
+                " aspirations and tips well by well)")
+        prefill_tris(aspirations)
     pipette.drop_tip()
-    tris_counter -= ini_tris
+
+    #####################################
+    # full columns with the multichannel
+    #####################################
+
+    for s_pl, s_col in sorted(pooled, key=lambda key: serpentine_rank(key[0], 'A' + key[1])[0:2]):
+        ctx.comment(
+            '\n' + '#'*3 + ' adding ' + str(fast[(s_pl, s_col)]) + 'ul from plate' +
+            str(s_pl) + ' column ' + s_col + ' to pooling column ' +
+            str(pooled[(s_pl, s_col)] + 1))
+        refill_tips(multi, 8)
+        multi.pick_up_tip()
+        multi.transfer(
+            fast[(s_pl, s_col)],
+            source_list[s_pl-1]['A' + s_col],
+            dilution_plate.columns()[pooled[(s_pl, s_col)]][0],
+            blow_out=True,
+            blowout_location='destination well',
+            new_tip='never'
+            )
+        multi.drop_tip()
 
     ###################
     # process csv data
     ###################
 
     for line in data:
-        s_pl, s_well, s_vol, d_fact = line[0:4]
+        s_pl, s_well, s_vol, d_fact, tube = line[0:5]
 
         # change types
         s_pl = int(s_pl)
@@ -297,21 +773,50 @@ def run(ctx: protocol_api.ProtocolContext):
         # print(line," - ", s_well)
 
         if d_fact > 1:
-            # max dilution is 80x due to well size
-            if d_fact > max_dil_fact:
-                d_fact = max_dil_fact
             # set s_vol to min_vol if larger
             if s_vol > min_vol:
                 s_vol = min_vol
-            dilute_and_pool(s_pl, s_well, s_vol, d_fact, int(next_dil_well))
+            # max dilution is 80x due to well size, two wells above
+            dil_wells = [
+                (int(next_dil_well) + i, step_vol, tris_vol) for i, (step_vol, tris_vol)
+                in enumerate(dilution_steps(d_fact, s_vol, max_dil_fact))]
+            dilute_and_pool(s_pl, s_well, s_vol, d_fact, dil_wells, pool_tubes[tube])
             # increment for next dilution
-            next_dil_well = next_dil_well+1
+            next_dil_well = next_dil_well+len(dil_wells)
         else:
-            add_to_pool(s_pl, s_well, s_vol, d_fact)
+            add_to_pool(s_pl, s_well, s_vol, d_fact, pool_tubes[tube])
+
+    # consolidate the pooling columns in the pool tube with one tip
+    if fast:
+        ctx.comment('\n' + '#'*3 + ' adding the pooling column(s) to the pool')
+        refill_tips(pipette, 1)
+        pipette.pick_up_tip()
+        for index in pool_index:
+            col_vol = sum(fast[key] for key in pooled if pooled[key] == index)
+            for well in dilution_plate.columns()[index]:
+                pipette.transfer(
+                    col_vol,
+                    well,
+                    pool_tubes[column_tube[index]],
+                    blow_out=True,
+                    blowout_location='destination well',
+                    new_tip='never'
+                    )
+        pipette.drop_tip()
+
+    # samples in each pool tube (csv rows and full columns)
+    for i, name in enumerate(pool_slots[:len(pool_tubes)]):
+        wells = ['plate' + str(row[0]) + ':' + row[1] for row in data if row[4] == i]
+        columns = ['plate' + str(key[0]) + ':col' + key[1] for key in sorted(pooled)
+                   if column_tube[pooled[key]] == i]
+        ctx.comment(
+            "## pool tube " + name + " (" + str(round(tube_vols[i], 1)) + "uL, " +
+            str(len(wells) + 8*len(columns)) + " samples): " + " ".join(wells + columns))
 
     ctx.comment(
       "\n    #############################################" +
       "\n    ## All done!" +
-      "\n    ## the pool in the tube rack (last position)" +
+      "\n    ## the pool in the tube rack (" +
+      ",".join(pool_slots[:len(pool_tubes)]) + ")" +
       "\n    ## and contains " + str(pool_vol) + "uL"
       "\n    #############################################")
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+
+# scriptname: nc_compare.py
+# inject one protocol template with its yaml config and with variants of
+# some parameters, simulate each run and report the tip pick-ups, the tips
+# and the estimated run time saved against the config as it is
+#
+# each variant overrides parameters of the yaml config (name=value, comma
+# separated), the csv file of the config can be replaced with -c
+#
+# usage:
+#   nc_compare.py -t template.py -y config.yaml -v name=value[,name=value] [-v ...] [-c data.csv]
+#
+# visit our Git: https://github.com/Nucleomics-VIB
+
+import argparse
+import io
+import os
+import sys
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, here)
+sys.path.insert(0, os.path.join(here, '..', '..', 'NC_server', 'OT2MakeProtocol'))
+import nc_runtime  # noqa: E402
+import nc_simulate  # noqa: E402
+import OT_inject_params  # noqa: E402
+
+report_columns = ['variant', 'commands', 'pickups', 'tips', 'runtime', 'pauses',
+                  'saved_pickups', 'saved_time']
+
+
+def parse_variant(text):
+    # 'name=value,name=value' as a dictionary
+    overrides = {}
+    for item in text.split(','):
+        name, sep, value = item.partition('=')
+        if not sep or not name.strip():
+            raise ValueError('variant items should be name=value: ' + item)
+        overrides[name.strip()] = value.strip()
+    return overrides
+
+
+def build_protocol(template, config, overrides, csv_file=None):
+    # injected protocol text with the overridden parameters
+    values, csv_placeholder, config_csv = OT_inject_params.build_values(
+        config, datetag='nc_compare', verbose=False, yaml_dir_first=True)
+    for name in overrides:
+        if name not in values:
+            raise KeyError('no parameter ' + name + ' in ' + config)
+    values.update(overrides)
+    out = io.StringIO()
+    with open(template, newline='') as fh:
+        OT_inject_params.inject_stream(fh, out, values, csv_placeholder,
+                                       csv_file or config_csv)
+    return out.getvalue()
+
+
+def measure(text, name):
+    # simulation metrics of one injected protocol
+    ctx = nc_simulate.simulate_text(text, name)
+    sections = nc_runtime.estimate(ctx)
+    info = nc_simulate.summary(ctx)
+    return {
+        'commands': len(ctx.commands),
+        'pickups': sum(info['tips'].values()),
+        'tips': info['used_tips'],
+        'seconds': sum(s['seconds'] for s in sections),
+        'pauses': sum(s['pauses'] for s in sections)}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='compare the simulated runs of config variants of a protocol template')
+    parser.add_argument('-t', dest='template', required=True, help='protocol template')
+    parser.add_argument('-y', dest='config', required=True, help='yaml config')
+    parser.add_argument('-v', dest='variants', action='append', default=[],
+                        help='parameters to override (name=value,name=value), repeatable')
+    parser.add_argument('-c', dest='csv', help='csv file replacing the one of the config')
+    args = parser.parse_args(argv)
+
+    runs = [('config', {})] + [(v, parse_variant(v)) for v in args.variants]
+    results = []
+    for label, overrides in runs:
+        try:
+            text = build_protocol(args.template, args.config, overrides, args.csv)
+            results.append((label, measure(text, os.path.basename(args.template))))
+        except Exception as err:
+            results.append((label, type(err).__name__ + ': ' + str(err)))
+
+    print('\t'.join(report_columns))
+    base = results[0][1] if isinstance(results[0][1], dict) else None
+    for label, res in results:
+        if not isinstance(res, dict):
+            print('\t'.join([label] + [''] * (len(report_columns) - 2) + [res]))
+            continue
+        saved_pickups = str(base['pickups'] - res['pickups']) if base else ''
+        saved_time = ''
+        if base:
+            delta = base['seconds'] - res['seconds']
+            saved_time = ('-' if delta < 0 else '') + nc_runtime.hms(abs(delta))
+        print('\t'.join([label, str(res['commands']), str(res['pickups']), str(res['tips']),
+                         nc_runtime.hms(res['seconds']), str(res['pauses']),
+                         saved_pickups, saved_time]))
+    return 0 if all(isinstance(res, dict) for label, res in results) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
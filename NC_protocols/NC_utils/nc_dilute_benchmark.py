@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+
+# scriptname: nc_dilute_benchmark.py
+# compare the two-step dilution splits of NC_Dilute_96x_plate on random
+# 96-well dilution sheets
+#
+# each sheet is injected in the dilute template for every mode
+# (two_step_split sqrt/optimal x multi_mount), the exported transfer plan
+# gives the steps and the buffer volume, the run is simulated with
+# nc_simulate / nc_runtime for the tips and the run time
+#
+# sheets: each column is undiluted, one uniform factor, one-step factors,
+# two-step factors (> max_dil) or a mix (seeded, reproducible)
+#
+# usage:
+#   nc_dilute_benchmark.py [-n sheets] [-s seed] [-m none,left] [-j workers] [-a]
+#
+# visit our Git: https://github.com/Nucleomics-VIB
+
+import argparse
+import concurrent.futures
+import contextlib
+import csv
+import io
+import os
+import random
+import sys
+import tempfile
+import time
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, here)
+sys.path.insert(0, os.path.join(here, '..', '..', 'NC_server', 'OT2MakeProtocol'))
+import nc_runtime  # noqa: E402
+import nc_simulate  # noqa: E402
+import OT_inject_params  # noqa: E402
+
+dilute_dir = os.path.join(here, '..', 'NC_Dilute_96x_plate')
+default_template = os.path.join(dilute_dir, 'dilute_96w_plate_template.py')
+default_config = os.path.join(dilute_dir, 'dilute_96w_plate_config.yaml')
+
+splits = ['sqrt', 'optimal']
+column_kinds = ['undiluted', 'uniform', 'one_step', 'two_step', 'mixed']
+metrics = ['steps', 'aspirations', 'p300_steps', 'tips', 'buffer_ml', 'runtime_s']
+
+
+def random_sheet(rng, max_dil=20.0):
+    # csv text of a full plate, one random kind per column
+    lines = ['Position,Dilution']
+    for col in range(1, 13):
+        kind = rng.choice(column_kinds)
+        factor = round(rng.uniform(1.1, 400.0), 1)
+        for row in 'ABCDEFGH':
+            if kind == 'undiluted':
+                dil = 1.0
+            elif kind == 'uniform':
+                dil = factor
+            elif kind == 'one_step':
+                dil = round(rng.uniform(1.1, max_dil), 1)
+            elif kind == 'two_step':
+                dil = round(rng.uniform(max_dil + 0.1, 400.0), 1)
+            else:
+                dil = rng.choice([1.0, round(rng.uniform(1.1, 400.0), 1)])
+            lines.append(row + str(col) + ',' + str(dil))
+    return '\n'.join(lines) + '\n'
+
+
+def build_protocol(template, config, csv_file, overrides):
+    # injected protocol text for one sheet and mode
+    values, csv_placeholder, _ = OT_inject_params.build_values(
+        config, datetag='nc_dilute_benchmark', verbose=False, yaml_dir_first=True)
+    values.update(overrides)
+    out = io.StringIO()
+    with open(template, newline='') as fh:
+        OT_inject_params.inject_stream(fh, out, values, csv_placeholder, csv_file)
+    return out.getvalue()
+
+
+def export_plan(text):
+    # rows of the transfer plan printed by the protocol (__main__ block)
+    out = io.StringIO()
+    with nc_simulate.mocked_opentrons(), contextlib.redirect_stdout(out):
+        exec(compile(text, 'dilute_96w_plate.py', 'exec'), {'__name__': '__main__'})
+    return list(csv.DictReader(out.getvalue().splitlines()))
+
+
+def measure(text):
+    # plan and simulation metrics of one injected protocol
+    plan = export_plan(text)
+    ctx = nc_simulate.simulate_text(text, 'dilute_96w_plate.py')
+    buffer_ul = sum(float(row['volume']) * int(row['channels']) for row in plan
+                    if row['source'] in ['buffer', 'reservoir'])
+    return {
+        'steps': len(plan),
+        'aspirations': len(set(row['aspiration'] for row in plan)),
+        'p300_steps': sum(1 for row in plan if row['pipette'] == 'p300'),
+        'tips': nc_simulate.summary(ctx)['used_tips'],
+        'buffer_ml': buffer_ul / 1000.0,
+        'runtime_s': sum(s['seconds'] for s in nc_runtime.estimate(ctx))}
+
+
+def run_sheet(job):
+    # all modes for one sheet, [(sheet, split, mount, metrics or error), ...]
+    sheet, csv_text, modes, template, config = job
+    with tempfile.TemporaryDirectory() as tmp:
+        csv_file = os.path.join(tmp, 'data.csv')
+        with open(csv_file, 'w') as fh:
+            fh.write(csv_text)
+        results = []
+        for split, mount in modes:
+            try:
+                text = build_protocol(template, config, csv_file,
+                                      {'two_step_split': split, 'multi_mount': mount})
+                results.append((sheet, split, mount, measure(text)))
+            except Exception as err:
+                results.append((sheet, split, mount, type(err).__name__ + ': ' + str(err)))
+    return results
+
+
+def summarize(results, modes):
+    # mean metrics per mode (failed runs excluded) and the failure count
+    rows = []
+    for split, mount in modes:
+        done = [r[3] for r in results if r[1] == split and r[2] == mount and isinstance(r[3], dict)]
+        failed = sum(1 for r in results if r[1] == split and r[2] == mount and not isinstance(r[3], dict))
+        row = {'split': split, 'multi_mount': mount, 'sheets': len(done), 'failed': failed}
+        for m in metrics:
+            row[m] = sum(d[m] for d in done) / len(done) if done else 0.0
+        rows.append(row)
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='benchmark the two-step dilution splits on random dilution sheets')
+    parser.add_argument('-n', dest='sheets', type=int, default=20, help='number of random sheets')
+    parser.add_argument('-s', dest='seed', type=int, default=1, help='random seed')
+    parser.add_argument('-m', dest='mounts', default='none,left',
+                        help='multi_mount values to compare (comma separated)')
+    parser.add_argument('-j', dest='workers', type=int, default=None,
+                        help='number of parallel processes (default: all cpus)')
+    parser.add_argument('-t', dest='template', default=default_template, help='dilute template')
+    parser.add_argument('-y', dest='config', default=default_config, help='yaml config')
+    parser.add_argument('-a', dest='all', action='store_true', help='print one line per sheet and mode')
+    args = parser.parse_args(argv)
+
+    rng = random.Random(args.seed)
+    modes = [(split, mount) for mount in args.mounts.split(',') for split in splits]
+    jobs = [(i + 1, random_sheet(rng), modes, args.template, args.config)
+            for i in range(args.sheets)]
+
+    start = time.perf_counter()
+    with concurrent.futures.ProcessPoolExecutor(max_workers=args.workers) as pool:
+        results = [r for rs in pool.map(run_sheet, jobs) for r in rs]
+    elapsed = time.perf_counter() - start
+
+    if args.all:
+        print('\t'.join(['sheet', 'split', 'multi_mount'] + metrics + ['error']))
+        for sheet, split, mount, res in results:
+            values = (['%.3f' % res[m] if m == 'buffer_ml' else '%d' % round(res[m]) for m in metrics] + ['']
+                      if isinstance(res, dict) else [''] * len(metrics) + [res])
+            print('\t'.join([str(sheet), split, mount] + values))
+        print('')
+
+    rows = summarize(results, modes)
+    print('\t'.join(['split', 'multi_mount', 'sheets', 'failed'] + metrics + ['runtime']))
+    for row in rows:
+        print('\t'.join(
+            [row['split'], row['multi_mount'], str(row['sheets']), str(row['failed'])] +
+            ['%.3f' % row[m] if m == 'buffer_ml' else '%.1f' % row[m] for m in metrics] +
+            [nc_runtime.hms(row['runtime_s'])]))
+    sys.stderr.write('# ' + str(args.sheets) + ' sheets x ' + str(len(modes)) + ' modes in ' +
+                     '%.1f' % elapsed + 's\n')
+    return 0 if all(row['failed'] == 0 for row in rows) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
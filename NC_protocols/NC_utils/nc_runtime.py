@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+
+# scriptname: nc_runtime.py
+# estimate the robot run time of a protocol before it starts
+# the protocol is run against the nc_simulate mock context and modelled times
+# are summed for the recorded commands:
+#   gantry moves     arc (up to the travel height, across, down) at the
+#                    pipette default_speed (z at z_speed)
+#   aspirate/dispense  volume / flow rate (after set_speeds and rate=)
+#   mixes            their aspirate/dispense cycles
+#   tips             fixed pick up / drop time
+#   modules          magnet engage/disengage, temperature ramps
+#   delays           ctx.delay seconds (pauses count 0, listed apart)
+#
+# the times are split by protocol section: a run of consecutive comments
+# (ctx.comment or xcomment) opens a new section named by its first text line
+#
+# usage:
+#   nc_runtime.py protocol.py [-c] [-s]
+#
+# visit our Git: https://github.com/Nucleomics-VIB
+
+import argparse
+import math
+import os
+import sys
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, here)
+import nc_simulate  # noqa: E402
+
+# modelled durations (seconds) and speeds (mm/s)
+timings = {
+    'z_speed': 125.0,
+    'clearance': 10.0,          # mm above the highest labware when travelling
+    'move_overhead': 0.3,       # acceleration/settling per move
+    'plunger_overhead': 0.3,    # per aspirate/dispense
+    'pick_up_tip': 3.5,
+    'drop_tip': 3.0,
+    'blow_out': 1.0,
+    'touch_tip': 2.0,
+    'home': 10.0,
+    'engage': 4.0,
+    'disengage': 4.0,
+    'deactivate': 1.0,
+    'temperature_per_degree': 15.0,
+}
+
+# command name -> time category
+categories = {
+    'aspirate': 'liquid', 'dispense': 'liquid', 'blow_out': 'liquid',
+    'touch_tip': 'liquid', 'air_gap': 'liquid',
+    'pick_up_tip': 'tips', 'drop_tip': 'tips',
+    'engage': 'modules', 'disengage': 'modules',
+    'set_temperature': 'modules', 'deactivate': 'modules',
+    'delay': 'delays', 'home': 'moves', 'move_to': 'moves'}
+
+category_names = ['moves', 'liquid', 'tips', 'modules', 'delays']
+
+
+def travel_height(ctx):
+    # z of the highest labware on the deck plus clearance
+    highest = 0.0
+    for item in ctx.deck.values():
+        labware = item.labware if isinstance(item, nc_simulate.Module) else item
+        if labware is not None:
+            highest = max(highest, labware.highest_z)
+    return highest + timings['clearance']
+
+
+def move_time(start, end, same_well, speed, safe_z):
+    # arc move between two points, direct within the same well
+    if start is None:
+        return timings['move_overhead']
+    dx = end[0] - start[0]
+    dy = end[1] - start[1]
+    if same_well:
+        distance = math.sqrt(dx * dx + dy * dy + (end[2] - start[2]) ** 2)
+        return distance / speed + timings['move_overhead']
+    up = max(0.0, safe_z - start[2])
+    down = max(0.0, safe_z - end[2])
+    return ((up + down) / timings['z_speed'] + math.sqrt(dx * dx + dy * dy) / speed +
+            timings['move_overhead'])
+
+
+def command_time(command):
+    # time spent once the pipette/module is in place
+    name = command['name']
+    if name in ('aspirate', 'dispense'):
+        rate = command.get('flow_rate') or 1.0
+        return command.get('volume', 0.0) / rate + timings['plunger_overhead']
+    if name == 'delay':
+        return command.get('seconds', 0.0)
+    if name == 'set_temperature':
+        return command.get('delta', 0.0) * timings['temperature_per_degree']
+    return timings.get(name, 0.0)
+
+
+def section_name(text):
+    # first line of a comment with text, without the # decorations
+    for line in text.splitlines():
+        line = line.strip().strip('#').strip()
+        if line:
+            return line
+    return ''
+
+
+def estimate(ctx):
+    # [{'name', 'seconds', 'moves', 'liquid', ..., 'pauses'}, ...] per section
+    safe_z = travel_height(ctx)
+    sections = []
+    current = None
+    in_heading = False
+    position = None
+    last_well = None
+    for command in ctx.commands:
+        name = command['name']
+        if name == 'comment':
+            title = section_name(command['text'])
+            if not in_heading:
+                current = None
+            in_heading = True
+            if current is None and title:
+                current = new_section(title)
+                sections.append(current)
+            continue
+        in_heading = False
+        if current is None:
+            current = new_section('(start)' if not sections else sections[-1]['name'])
+            sections.append(current)
+        if name == 'pause':
+            current['pauses'] += 1
+            continue
+        if 'point' in command:
+            well = command.get('location')
+            seconds = move_time(position, command['point'], well == last_well,
+                                command.get('speed', 400.0), safe_z)
+            current['moves'] += seconds
+            current['seconds'] += seconds
+            position = command['point']
+            last_well = well
+        elif name == 'home':
+            position = None
+            last_well = None
+        seconds = command_time(command)
+        current[categories.get(name, 'liquid')] += seconds
+        current['seconds'] += seconds
+    return sections
+
+
+def new_section(name):
+    section = {'name': name, 'seconds': 0.0, 'pauses': 0}
+    for category in category_names:
+        section[category] = 0.0
+    return section
+
+
+def merge_sections(sections):
+    # sum the sections with the same name (eg. repeated per sample)
+    merged = {}
+    for section in sections:
+        if section['name'] not in merged:
+            merged[section['name']] = new_section(section['name'])
+        target = merged[section['name']]
+        for key in ['seconds', 'pauses'] + category_names:
+            target[key] += section[key]
+    return list(merged.values())
+
+
+def hms(seconds):
+    seconds = int(round(seconds))
+    return '%d:%02d:%02d' % (seconds // 3600, seconds // 60 % 60, seconds % 60)
+
+
+def estimate_file(protocol_file):
+    ctx = nc_simulate.simulate(protocol_file)
+    return estimate(ctx)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='estimate the run time of an opentrons protocol')
+    parser.add_argument('protocol', help='protocol file (python)')
+    parser.add_argument('-c', dest='combine', action='store_true',
+                        help='combine the sections with the same name')
+    parser.add_argument('-s', dest='sort', action='store_true',
+                        help='sort the sections by duration')
+    args = parser.parse_args(argv)
+
+    try:
+        sections = estimate_file(args.protocol)
+    except Exception as err:
+        print('# simulation failed: ' + type(err).__name__ + ': ' + str(err))
+        return 1
+    if args.combine:
+        sections = merge_sections(sections)
+    if args.sort:
+        sections = sorted(sections, key=lambda s: -s['seconds'])
+
+    total = sum(s['seconds'] for s in sections)
+    print('\t'.join(['section', 'time', 'share'] + category_names + ['pauses']))
+    for section in sections:
+        print('\t'.join(
+            [section['name'], hms(section['seconds']),
+             '%.1f%%' % (100.0 * section['seconds'] / total if total else 0.0)] +
+            ['%.0f' % section[c] for c in category_names] + [str(section['pauses'])]))
+    pauses = sum(s['pauses'] for s in sections)
+    print('# ' + os.path.basename(args.protocol) + ': estimated run time ' + hms(total) +
+          ' (' + str(pauses) + ' pauses for the operator not included)')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+
+# scriptname: nc_sim_matrix.py
+# inject and simulate every protocol template x config combination of
+# NC_protocols in a process pool, plus the pre-injected protocols found in
+# test_inject_results/ folders
+#
+# combinations: each *_template.py (test folders excluded) with each yaml
+# config found below its protocol folder (the parent of a 'template/' folder)
+# that gives a value to every placeholder of the template; a config can
+# name its template with a top-level 'template:' key (file name), it is
+# then only paired with that one
+# the protocols are injected in memory with OT_inject_params (NC_server) and
+# run with nc_simulate / nc_runtime
+#
+# results are cached by the sha256 of the injected protocol (and of the
+# simulator scripts) in sim_cache/, only changed protocols are re-simulated
+#
+# usage:
+#   nc_sim_matrix.py [-p NC_protocols] [-j workers] [-o report.tsv] [--no-cache]
+#
+# visit our Git: https://github.com/Nucleomics-VIB
+
+import argparse
+import concurrent.futures
+import hashlib
+import io
+import json
+import os
+import sys
+import time
+
+import yaml
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, here)
+sys.path.insert(0, os.path.join(here, '..', '..', 'NC_server', 'OT2MakeProtocol'))
+import nc_runtime  # noqa: E402
+import nc_simulate  # noqa: E402
+import OT_inject_params  # noqa: E402
+
+default_protocols = os.path.join(here, '..')
+default_cache = os.path.join(here, 'sim_cache')
+
+# fixed edit_date so that the injected protocols (and their hash) are stable
+datetag = 'nc_sim_matrix'
+
+report_columns = ['protocol', 'template', 'config', 'status', 'commands',
+                  'tips', 'runtime', 'cached', 'error']
+
+
+def simulator_hash():
+    # a change of the simulator invalidates the cached results
+    digest = hashlib.sha256()
+    for name in ['nc_simulate.py', 'nc_runtime.py']:
+        with open(os.path.join(here, name), 'rb') as fh:
+            digest.update(fh.read())
+    return digest.hexdigest()
+
+
+def protocol_root(template):
+    # protocol folder of a template (templates may sit in a template/ folder)
+    folder = os.path.dirname(template)
+    if os.path.basename(folder) == 'template':
+        return os.path.dirname(folder)
+    return folder
+
+
+def template_placeholders(template):
+    # placeholders of a template, edit_date is set by the injection
+    with open(template) as fh:
+        return set(OT_inject_params.placeholder_re.findall(fh.read())) - {'edit_date'}
+
+
+def config_fits(template, config):
+    # the config names this template, or names none and fills all its placeholders
+    with open(config) as fh:
+        data = yaml.safe_load(fh) or {}
+    if data.get('template'):
+        return data['template'] == os.path.basename(template)
+    keys = set(data.get('params') or {}) | set(data.get('csv') or {})
+    return template_placeholders(template) <= keys
+
+
+def find_jobs(protocols_dir):
+    # [(name, template, config), ...]; template is None for injected protocols
+    jobs = []
+    for root, dirs, files in os.walk(protocols_dir):
+        dirs[:] = sorted(d for d in dirs if d != 'NC_utils' and not d.startswith('.'))
+        if os.path.basename(root) == 'test_inject_results':
+            for name in sorted(files):
+                if name.endswith('.py'):
+                    path = os.path.join(root, name)
+                    jobs.append((os.path.relpath(path, protocols_dir), None, path))
+            continue
+        if any(part.startswith('test') for part in os.path.relpath(root, protocols_dir).split(os.sep)):
+            continue
+        for name in sorted(files):
+            if not name.endswith('_template.py'):
+                continue
+            template = os.path.join(root, name)
+            configs = []
+            for croot, cdirs, cfiles in os.walk(protocol_root(template)):
+                cdirs.sort()
+                configs.extend(os.path.join(croot, f) for f in sorted(cfiles)
+                               if f.endswith('.yaml') or f.endswith('.yml'))
+            for config in [c for c in configs if config_fits(template, c)]:
+                label = (os.path.relpath(template, protocols_dir) + ' x ' +
+                         os.path.relpath(config, protocol_root(template)))
+                jobs.append((label, template, config))
+    return jobs
+
+
+def build_protocol(template, config):
+    # injected protocol text (the file itself for pre-injected protocols)
+    if template is None:
+        with open(config) as fh:
+            return fh.read()
+    values, csv_placeholder, csv_file = OT_inject_params.build_values(
+        config, datetag=datetag, verbose=False, yaml_dir_first=True)
+    out = io.StringIO()
+    with open(template, newline='') as fh:
+        OT_inject_params.inject_stream(fh, out, values, csv_placeholder, csv_file)
+    return out.getvalue()
+
+
+def run_job(job, cache_dir=None, sim_hash=''):
+    # inject + simulate one combination, returns a report row (never raises)
+    name, template, config = job
+    row = {'protocol': name, 'template': template or '', 'config': config,
+           'status': 'fail', 'commands': '', 'tips': '', 'runtime': '',
+           'cached': 'no', 'error': ''}
+    try:
+        text = build_protocol(template, config)
+    except Exception as err:
+        row['status'] = 'inject-fail'
+        row['error'] = type(err).__name__ + ': ' + str(err)
+        return clean(row)
+
+    key = hashlib.sha256((sim_hash + '\n' + text).encode()).hexdigest()
+    entry = os.path.join(cache_dir, key + '.json') if cache_dir else None
+    if entry and os.path.isfile(entry):
+        with open(entry) as fh:
+            row.update(json.load(fh))
+        row['cached'] = 'yes'
+        return row
+
+    result = {}
+    try:
+        ctx = nc_simulate.simulate_text(text, config if template is None else name)
+        info = nc_simulate.summary(ctx)
+        seconds = sum(s['seconds'] for s in nc_runtime.estimate(ctx))
+        result = {'status': 'pass', 'commands': str(info['commands']),
+                  'tips': str(sum(info['tips'].values())),
+                  'runtime': nc_runtime.hms(seconds), 'error': ''}
+    except Exception as err:
+        result = {'status': 'fail', 'error': type(err).__name__ + ': ' + str(err)}
+    row.update(result)
+    row = clean(row)
+    if entry:
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp = entry + '.' + str(os.getpid())
+        with open(tmp, 'w') as fh:
+            json.dump(dict((k, row[k]) for k in result), fh)
+        os.replace(tmp, entry)
+    return row
+
+
+def clean(row):
+    row['error'] = row['error'].replace('\n', ' ').replace('\t', ' ')
+    return row
+
+
+def run_matrix(jobs, workers=None, cache_dir=default_cache):
+    # all combinations in parallel, rows in job order
+    if not jobs:
+        return []
+    sim_hash = simulator_hash()
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(run_job, job, cache_dir, sim_hash) for job in jobs]
+        return [future.result() for future in futures]
+
+
+def write_report(rows, out):
+    out.write('\t'.join(report_columns) + '\n')
+    for row in rows:
+        out.write('\t'.join(str(row[c]) for c in report_columns) + '\n')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='inject and simulate all NC protocol template x config combinations')
+    parser.add_argument('-p', dest='protocols', default=default_protocols,
+                        help='NC_protocols folder')
+    parser.add_argument('-j', dest='workers', type=int, default=None,
+                        help='number of parallel processes (default: all cpus)')
+    parser.add_argument('-o', dest='report', help='report file (tsv, default to stdout)')
+    parser.add_argument('-c', dest='cache', default=default_cache,
+                        help='result cache folder')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='simulate all combinations again')
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    jobs = find_jobs(args.protocols)
+    rows = run_matrix(jobs, args.workers, None if args.no_cache else args.cache)
+    elapsed = time.perf_counter() - start
+
+    if args.report:
+        with open(args.report, 'w') as fh:
+            write_report(rows, fh)
+    else:
+        write_report(rows, sys.stdout)
+
+    passed = sum(1 for row in rows if row['status'] == 'pass')
+    cached = sum(1 for row in rows if row['cached'] == 'yes')
+    sys.stderr.write('# ' + str(len(rows)) + ' combinations: ' + str(passed) + ' pass, ' +
+                     str(len(rows) - passed) + ' fail (' + str(cached) + ' from cache) in ' +
+                     '%.1f' % elapsed + 's\n')
+    return 0 if passed == len(rows) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,928 @@
+#!/usr/bin/env python3
+
+# scriptname: nc_simulate.py
+# fast simulation of NC protocols without the opentrons package
+# a light mock of the ProtocolContext covering the API subset used in
+# NC_protocols (labware, tip racks, pipettes, magnetic/temperature modules,
+# transfer/mix/aspirate/dispense, comment/delay/pause)
+# 'run(ctx)' of a protocol is executed unchanged against the mock and every
+# command is recorded in ctx.commands (a list of dicts) in milliseconds
+#
+# the mock raises where the robot would: out of tips (OutOfTipsError), tip
+# already attached, no tip attached, aspirating above the tip volume,
+# loading two items in the same slot or two pipettes on the same mount
+# geometry is approximate (well grids are guessed from the labware names)
+#
+# usage:
+#   nc_simulate.py protocol.py [-q] [-j commands.json]
+#   or from python:
+#     import nc_simulate
+#     ctx = nc_simulate.simulate('protocol.py')
+#     ctx.commands
+#
+# visit our Git: https://github.com/Nucleomics-VIB
+
+import argparse
+import contextlib
+import json
+import math
+import os
+import re
+import sys
+import time
+import types
+
+
+class OutOfTipsError(Exception):
+    pass
+
+
+class APIVersion(tuple):
+    # (major, minor) compared like the opentrons APIVersion
+    def __new__(cls, major, minor):
+        return tuple.__new__(cls, (major, minor))
+
+    @classmethod
+    def from_string(cls, text):
+        major, minor = str(text).split('.')
+        return cls(int(major), int(minor))
+
+    def __str__(self):
+        return '%d.%d' % self
+
+
+class Point(tuple):
+    # opentrons.types.Point
+    def __new__(cls, x=0.0, y=0.0, z=0.0):
+        return tuple.__new__(cls, (x, y, z))
+
+    x = property(lambda self: self[0])
+    y = property(lambda self: self[1])
+    z = property(lambda self: self[2])
+
+    def __add__(self, other):
+        return Point(self[0] + other[0], self[1] + other[1], self[2] + other[2])
+
+    def __sub__(self, other):
+        return Point(self[0] - other[0], self[1] - other[1], self[2] - other[2])
+
+    def __repr__(self):
+        return 'Point(x=%g, y=%g, z=%g)' % self
+
+
+class Location(object):
+    # opentrons.types.Location: a point and the well or labware it belongs to
+    def __init__(self, point, labware):
+        self.point = point
+        self.labware = labware
+
+    def move(self, point):
+        return Location(self.point + point, self.labware)
+
+    def __repr__(self):
+        return 'Location(point=%r, labware=%s)' % (self.point, self.labware)
+
+
+#######################
+# labware geometry
+#######################
+
+# front-left corner of the deck slots (mm)
+slot_origin = {
+    '1': (0.0, 0.0), '2': (132.5, 0.0), '3': (265.0, 0.0),
+    '4': (0.0, 90.5), '5': (132.5, 90.5), '6': (265.0, 90.5),
+    '7': (0.0, 181.0), '8': (132.5, 181.0), '9': (265.0, 181.0),
+    '10': (0.0, 271.5), '11': (132.5, 271.5), '12': (265.0, 271.5)}
+
+# height of the labware surface on a module (mm)
+module_height = {'magnetic': 35.0, 'temperature': 80.0}
+
+footprint = (127.76, 85.48)
+
+volume_re = re.compile(r'(\d+(?:\.\d+)?)(ul|ml)')
+
+
+def labware_shape(load_name):
+    # (rows, columns, well volume in ul, well depth, well diameter) guessed
+    # from an opentrons style load name
+    name = load_name.lower()
+    volumes = volume_re.findall(name)
+    volume = 200.0
+    if volumes:
+        value, unit = volumes[-1]
+        volume = float(value) * (1000.0 if unit == 'ml' else 1.0)
+    if 'trash' in name:
+        return 1, 1, 1100000.0, 40.0, None
+    if 'reservoir' in name:
+        columns = int(re.search(r'(\d+)_reservoir', name).group(1)) if re.search(r'(\d+)_reservoir', name) else 12
+        return 1, columns, volume, 40.0, None
+    if '384' in name:
+        return 16, 24, volume, 11.0, 3.3
+    if '_24_' in name:
+        return 4, 6, volume, 39.0 if volume <= 2000 else 42.0, 8.7
+    if '_15_' in name:
+        return 3, 5, volume, 117.0, 14.9
+    if '_6_' in name:
+        return 2, 3, volume, 113.0, 27.8
+    # 96 well plates, blocks and tip racks
+    return 8, 12, volume, 15.0 if volume <= 400 else 40.0, 5.5
+
+
+class Well(object):
+    def __init__(self, parent, name, row, column, top, depth, diameter, max_volume):
+        self.parent = parent
+        self.well_name = name
+        self.row = row
+        self.column = column
+        self.depth = depth
+        self.diameter = diameter
+        self.max_volume = max_volume
+        self.has_tip = parent.is_tiprack
+        self._top = top
+
+    @property
+    def display_name(self):
+        return str(self)
+
+    def top(self, z=0.0):
+        return Location(self._top + Point(0, 0, z), self)
+
+    def bottom(self, z=0.0):
+        return Location(self._top + Point(0, 0, z - self.depth), self)
+
+    def center(self):
+        return Location(self._top + Point(0, 0, -self.depth / 2.0), self)
+
+    def __repr__(self):
+        return self.well_name + ' of ' + str(self.parent)
+
+
+class Labware(object):
+    def __init__(self, load_name, slot, label=None, z_offset=0.0):
+        self.load_name = load_name
+        self.name = load_name
+        self.parent = slot
+        self.label = label
+        self.is_tiprack = 'tiprack' in load_name.lower()
+        self.uri = 'opentrons/' + load_name + '/1'
+        rows, columns, volume, depth, diameter = labware_shape(load_name)
+        self.tip_volume = volume if self.is_tiprack else None
+        x_pitch = 9.0 if columns == 12 else 4.5 if columns == 24 else (99.0 / (columns - 1) if columns > 1 else 0.0)
+        y_pitch = 9.0 if rows == 8 else 4.5 if rows == 16 else (63.0 / (rows - 1) if rows > 1 else 0.0)
+        x0 = slot_origin[slot][0] + (footprint[0] - (columns - 1) * x_pitch) / 2.0
+        y0 = slot_origin[slot][1] + footprint[1] - (footprint[1] - (rows - 1) * y_pitch) / 2.0
+        z0 = z_offset + (depth + 2.0 if not self.is_tiprack else 64.0)
+        self.highest_z = z0
+        self._columns = []
+        for c in range(columns):
+            column = []
+            for r in range(rows):
+                name = chr(ord('A') + r) + str(c + 1)
+                column.append(Well(self, name, r, c,
+                                   Point(x0 + c * x_pitch, y0 - r * y_pitch, z0),
+                                   depth, diameter, volume))
+            self._columns.append(column)
+        self._wells = [well for column in self._columns for well in column]
+        self._by_name = dict((well.well_name, well) for well in self._wells)
+
+    def __repr__(self):
+        return (self.label or self.load_name) + ' on ' + str(self.parent)
+
+    def __getitem__(self, name):
+        return self._by_name[name]
+
+    def well(self, index):
+        return self._by_name[index] if isinstance(index, str) else self._wells[index]
+
+    def wells(self, *names):
+        if names:
+            return [self.well(name) for name in names]
+        return list(self._wells)
+
+    def wells_by_name(self):
+        return dict(self._by_name)
+
+    def columns(self, *indices):
+        columns = [list(column) for column in self._columns]
+        return [columns[int(i) - 1 if isinstance(i, str) else i] for i in indices] if indices else columns
+
+    def rows(self, *indices):
+        rows = [list(row) for row in zip(*self._columns)]
+        if indices:
+            return [rows[ord(i) - ord('A') if isinstance(i, str) else i] for i in indices]
+        return rows
+
+    def columns_by_name(self):
+        return dict((str(i + 1), list(column)) for i, column in enumerate(self._columns))
+
+    def rows_by_name(self):
+        return dict((chr(ord('A') + i), list(row)) for i, row in enumerate(zip(*self._columns)))
+
+    # tip tracking (tip racks only)
+    def next_tip(self, num_tips=1, starting_tip=None):
+        start = self._wells.index(starting_tip) if starting_tip is not None else 0
+        for well in self._wells[start:]:
+            column = self._columns[well.column]
+            tips = column[well.row:well.row + num_tips]
+            if len(tips) == num_tips and all(tip.has_tip for tip in tips):
+                return well
+        return None
+
+    def use_tips(self, start_well, num_channels=1):
+        column = self._columns[start_well.column]
+        for tip in column[start_well.row:start_well.row + num_channels]:
+            tip.has_tip = False
+
+    def reset(self):
+        for well in self._wells:
+            well.has_tip = self.is_tiprack
+
+
+#######################
+# modules
+#######################
+
+class Module(object):
+    kind = ''
+
+    def __init__(self, ctx, name, slot):
+        self._ctx = ctx
+        self.name = name
+        self.slot = slot
+        self.labware = None
+
+    def load_labware(self, load_name, label=None, namespace=None, version=None):
+        if self.labware is not None:
+            raise ValueError('module on slot ' + self.slot + ' already has a labware')
+        self.labware = Labware(load_name, self.slot, label, module_height[self.kind])
+        return self.labware
+
+    def __repr__(self):
+        return self.name + ' on ' + self.slot
+
+
+class MagneticModule(Module):
+    kind = 'magnetic'
+    status = 'disengaged'
+
+    def engage(self, height=None, offset=None, height_from_base=None):
+        self.status = 'engaged'
+        value = height if height is not None else height_from_base if height_from_base is not None else offset
+        self._ctx._record('engage', 'Engaging Magnetic Module' +
+                          (' to ' + str(value) if value is not None else ''),
+                          module=self.slot, height=value)
+
+    def disengage(self):
+        self.status = 'disengaged'
+        self._ctx._record('disengage', 'Disengaging Magnetic Module', module=self.slot)
+
+
+class TemperatureModule(Module):
+    kind = 'temperature'
+    target = None
+    temperature = 25.0
+    status = 'idle'
+
+    def set_temperature(self, celsius):
+        delta = abs(celsius - self.temperature)
+        self.target = self.temperature = celsius
+        self.status = 'holding at target'
+        self._ctx._record('set_temperature', 'Setting Temperature Module temperature to ' +
+                          str(celsius) + ' °C', module=self.slot, celsius=celsius, delta=delta)
+
+    def start_set_temperature(self, celsius):
+        self.set_temperature(celsius)
+
+    def await_temperature(self, celsius):
+        pass
+
+    def deactivate(self):
+        self.target = None
+        self.status = 'idle'
+        self._ctx._record('deactivate', 'Deactivating Temperature Module', module=self.slot)
+
+
+module_classes = [
+    (('magnetic', 'magdeck'), MagneticModule),
+    (('temperature', 'tempdeck'), TemperatureModule)]
+
+
+#######################
+# pipettes
+#######################
+
+# default flow rates (ul/s) of the gen2 pipettes
+default_flow_rates = {
+    'p20_single_gen2': 7.56, 'p20_multi_gen2': 7.6,
+    'p300_single_gen2': 92.86, 'p300_multi_gen2': 94.0,
+    'p1000_single_gen2': 274.7}
+
+pipette_volumes = {'p20': (1.0, 20.0), 'p300': (20.0, 300.0), 'p1000': (100.0, 1000.0)}
+
+
+def flow_rate_property(name):
+    # flow rates must be numbers (the robot fails on eg. a string value)
+    def getter(self):
+        return self._rates[name]
+
+    def setter(self, value):
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            raise TypeError('flow_rate.' + name + ' should be a number, got ' + repr(value))
+        self._rates[name] = float(value)
+    return property(getter, setter)
+
+
+class FlowRates(object):
+    aspirate = flow_rate_property('aspirate')
+    dispense = flow_rate_property('dispense')
+    blow_out = flow_rate_property('blow_out')
+
+    def __init__(self, default):
+        self._default = default
+        self._rates = {}
+        self.set_defaults()
+
+    def set_defaults(self, api_level=None):
+        self.aspirate = self._default
+        self.dispense = self._default
+        self.blow_out = self._default
+
+
+class Clearances(object):
+    def __init__(self):
+        self.aspirate = 1.0
+        self.dispense = 1.0
+
+
+class InstrumentContext(object):
+    def __init__(self, ctx, name, mount, tip_racks):
+        self._ctx = ctx
+        self.name = name
+        self.model = name
+        self.mount = mount
+        self.channels = 8 if 'multi' in name else 1
+        self.min_volume, self.max_volume = pipette_volumes[name.split('_')[0]]
+        self.tip_racks = list(tip_racks or [])
+        self.starting_tip = None
+        self.flow_rate = FlowRates(default_flow_rates.get(name, self.max_volume / 3.0))
+        self.well_bottom_clearance = Clearances()
+        self.default_speed = 400.0
+        self.trash_container = ctx.fixed_trash
+        self.has_tip = False
+        self.current_volume = 0.0
+        self.tip_volume = None
+        self._location = None
+        self._last_tip = None
+
+    def __repr__(self):
+        return self.name + ' on ' + self.mount + ' mount'
+
+    @property
+    def hw_pipette(self):
+        return {'name': self.name, 'channels': self.channels, 'has_tip': self.has_tip,
+                'working_volume': self.working_volume, 'current_volume': self.current_volume}
+
+    @property
+    def working_volume(self):
+        # the volume of the attached (or next) tip limits the pipette volume
+        tip = self.tip_volume
+        if tip is None and self.tip_racks:
+            tip = self.tip_racks[0].tip_volume
+        return min(self.max_volume, tip) if tip else self.max_volume
+
+    def _record(self, name, text, location=None, **fields):
+        if location is not None:
+            fields['point'] = tuple(location.point)
+            fields['location'] = str(location.labware)
+            self._location = location
+        fields['mount'] = self.mount
+        fields['pipette'] = self.name
+        fields['speed'] = self.default_speed
+        self._ctx._record(name, text, **fields)
+
+    def _resolve(self, location, clearance=None):
+        # Location of a Well / Location argument (or the current location)
+        if location is None:
+            if self._location is None:
+                raise RuntimeError('no previous location for ' + str(self))
+            return self._location
+        if isinstance(location, Well):
+            return location.bottom(clearance) if clearance is not None else location.top()
+        if isinstance(location, Location):
+            return location
+        raise TypeError('location should be a Well or Location, got ' + repr(location))
+
+    def _current_well(self):
+        if self._location is None:
+            return None
+        labware = self._location.labware
+        return labware if isinstance(labware, Well) else None
+
+    # tips
+    def pick_up_tip(self, location=None, presses=None, increment=None):
+        if self.has_tip:
+            raise RuntimeError('Tip already attached to ' + str(self))
+        if location is None:
+            tip = None
+            for rack in self.tip_racks:
+                start = self.starting_tip if self.starting_tip is not None and self.starting_tip.parent is rack else None
+                tip = rack.next_tip(self.channels, start)
+                if tip is not None:
+                    break
+            if tip is None:
+                raise OutOfTipsError('Tip racks ' + str(self.tip_racks) + ' for ' + str(self) + ' are out of tips')
+        elif isinstance(location, Labware):
+            tip = location.next_tip(self.channels)
+            if tip is None:
+                raise OutOfTipsError('Tip rack ' + str(location) + ' is out of tips')
+        elif isinstance(location, Location):
+            tip = location.labware
+        else:
+            tip = location
+        tip.parent.use_tips(tip, self.channels)
+        self.has_tip = True
+        self.current_volume = 0.0
+        self.tip_volume = tip.parent.tip_volume
+        self._last_tip = tip
+        self._record('pick_up_tip', 'Picking up tip from ' + str(tip), tip.top())
+
+    def drop_tip(self, location=None, home_after=True):
+        if not self.has_tip:
+            raise RuntimeError('Cannot drop tip without a tip attached to ' + str(self))
+        if location is None:
+            location = self.trash_container.wells()[0]
+        target = self._resolve(location)
+        self.has_tip = False
+        self.current_volume = 0.0
+        self.tip_volume = None
+        self._last_tip = None
+        self._record('drop_tip', 'Dropping tip into ' + str(target.labware), target)
+        return self
+
+    def return_tip(self, home_after=True):
+        if self._last_tip is None:
+            raise RuntimeError('no tip to return for ' + str(self))
+        return self.drop_tip(self._last_tip, home_after)
+
+    def reset_tipracks(self):
+        for rack in self.tip_racks:
+            rack.reset()
+
+    # liquid handling
+    def aspirate(self, volume=None, location=None, rate=1.0):
+        if not self.has_tip:
+            raise RuntimeError('Cannot aspirate without a tip attached to ' + str(self))
+        target = self._resolve(location, self.well_bottom_clearance.aspirate)
+        if volume is None or volume == 0:
+            volume = self.working_volume - self.current_volume
+        if self.current_volume + volume > self.working_volume + 1e-6:
+            raise RuntimeError('Cannot aspirate more than the pipette max volume (' +
+                               str(self.current_volume + volume) + ' > ' +
+                               str(self.working_volume) + ' ul, ' + str(self) + ')')
+        self.current_volume += volume
+        speed = self.flow_rate.aspirate * rate
+        self._record('aspirate', 'Aspirating %s uL from %s at %s uL/sec' % (
+            round(volume, 2), target.labware, round(speed, 2)), target, volume=volume, flow_rate=speed)
+        return self
+
+    def dispense(self, volume=None, location=None, rate=1.0):
+        if not self.has_tip:
+            raise RuntimeError('Cannot dispense without a tip attached to ' + str(self))
+        target = self._resolve(location, self.well_bottom_clearance.dispense)
+        if volume is None or volume == 0:
+            volume = self.current_volume
+        if volume > self.current_volume + 1e-6:
+            raise RuntimeError('Cannot dispense more than the tip holds (' +
+                               str(volume) + ' > ' + str(self.current_volume) +
+                               ' ul, ' + str(self) + ')')
+        self.current_volume = max(0.0, self.current_volume - volume)
+        speed = self.flow_rate.dispense * rate
+        self._record('dispense', 'Dispensing %s uL into %s at %s uL/sec' % (
+            round(volume, 2), target.labware, round(speed, 2)), target, volume=volume, flow_rate=speed)
+        return self
+
+    def mix(self, repetitions=1, volume=None, location=None, rate=1.0):
+        if not self.has_tip:
+            raise RuntimeError('Cannot mix without a tip attached to ' + str(self))
+        volume = volume or self.working_volume
+        target = self._resolve(location, self.well_bottom_clearance.aspirate)
+        self._record('mix', 'Mixing %d times with a volume of %s ul' % (repetitions, volume),
+                     repetitions=repetitions, volume=volume)
+        self._ctx._depth += 1
+        try:
+            for _ in range(repetitions):
+                self.aspirate(volume, target, rate)
+                self.dispense(volume, None, rate)
+        finally:
+            self._ctx._depth -= 1
+        return self
+
+    def blow_out(self, location=None):
+        target = self._resolve(location)
+        self.current_volume = 0.0
+        self._record('blow_out', 'Blowing out at ' + str(target.labware), target,
+                     flow_rate=self.flow_rate.blow_out)
+        return self
+
+    def touch_tip(self, location=None, radius=1.0, v_offset=-1.0, speed=60.0):
+        well = location if isinstance(location, Well) else self._current_well()
+        if well is None:
+            raise RuntimeError('touch_tip needs a well for ' + str(self))
+        target = well.top(v_offset)
+        self._record('touch_tip', 'Touching tip', target, speed=speed)
+        return self
+
+    def air_gap(self, volume=None, height=None):
+        well = self._current_well()
+        if well is None:
+            raise RuntimeError('air_gap needs a previous well for ' + str(self))
+        target = well.top(5.0 if height is None else height)
+        self._location = target
+        self._record('air_gap', 'Air gap', target)
+        return self.aspirate(volume, target)
+
+    def move_to(self, location, force_direct=False, minimum_z_height=None, speed=None):
+        self._record('move_to', 'Moving to ' + str(location.labware), location)
+        return self
+
+    def home(self):
+        self._location = None
+        self._record('home', 'Homing pipette plunger on mount ' + self.mount)
+        return self
+
+    # complex commands
+    def transfer(self, volume, source, dest, **kwargs):
+        return self._complex('transfer', volume, source, dest, kwargs)
+
+    def distribute(self, volume, source, dest, **kwargs):
+        kwargs.setdefault('disposal_volume', self.min_volume)
+        return self._complex('distribute', volume, source, dest, kwargs)
+
+    def consolidate(self, volume, source, dest, **kwargs):
+        return self._complex('consolidate', volume, source, dest, kwargs)
+
+    def _targets(self, target):
+        # flat list of wells/locations, first row only for a multichannel
+        if isinstance(target, (Well, Location)):
+            targets = [target]
+        elif isinstance(target, Labware):
+            targets = target.wells()
+        else:
+            targets = []
+            for item in target:
+                targets.extend(self._targets(item))
+        if self.channels > 1:
+            targets = [t for t in targets if self._first_rows(t)]
+        return targets
+
+    def _first_rows(self, target):
+        well = target.labware if isinstance(target, Location) else target
+        if not isinstance(well, Well):
+            return True
+        rows = len(well.parent.rows())
+        return well.row < max(1, rows // 8)
+
+    def _complex(self, mode, volume, source, dest, kwargs):
+        sources = self._targets(source)
+        dests = self._targets(dest)
+        if not sources or not dests:
+            raise ValueError(mode + ': empty source or destination list')
+        if len(sources) == len(dests):
+            pairs = list(zip(sources, dests))
+        elif len(sources) == 1:
+            pairs = [(sources[0], d) for d in dests]
+        elif len(dests) == 1:
+            pairs = [(s, dests[0]) for s in sources]
+        else:
+            raise ValueError(mode + ': source and destination lists of different lengths')
+        if isinstance(volume, (list, tuple)) and not (isinstance(volume, tuple) and len(volume) == 2 and len(pairs) != 2):
+            if len(volume) != len(pairs):
+                raise ValueError(mode + ': volume list and well lists of different lengths')
+            volumes = list(volume)
+        elif isinstance(volume, tuple):
+            # gradient
+            n = max(1, len(pairs) - 1)
+            volumes = [volume[0] + (volume[1] - volume[0]) * i / n for i in range(len(pairs))]
+        else:
+            volumes = [volume] * len(pairs)
+
+        new_tip = kwargs.get('new_tip', 'once')
+        air_gap = kwargs.get('air_gap', 0) or 0
+        max_vol = self.working_volume - air_gap
+        self._record(mode, '%s %s from %s to %s' % (mode.capitalize(), volume, source, dest),
+                     volume=volume)
+        self._ctx._depth += 1
+        try:
+            if new_tip == 'once':
+                self.pick_up_tip()
+            if mode == 'distribute':
+                self._distribute(pairs, volumes, max_vol, new_tip, kwargs)
+            elif mode == 'consolidate':
+                self._consolidate(pairs, volumes, max_vol, new_tip, kwargs)
+            else:
+                steps = []
+                for (src, dst), vol in zip(pairs, volumes):
+                    # split like the opentrons transfer plan
+                    while vol > max_vol * 2:
+                        steps.append((src, dst, max_vol))
+                        vol -= max_vol
+                    if vol > max_vol:
+                        vol /= 2.0
+                        steps.append((src, dst, vol))
+                    steps.append((src, dst, vol))
+                for src, dst, vol in steps:
+                    if vol <= 0:
+                        continue
+                    if new_tip == 'always':
+                        if self.has_tip:
+                            self._end_tip(kwargs)
+                        self.pick_up_tip()
+                    self._step_aspirate(src, vol, kwargs)
+                    self._step_dispense(dst, vol + air_gap, src, kwargs)
+            if new_tip != 'never' and self.has_tip:
+                self._end_tip(kwargs)
+        finally:
+            self._ctx._depth -= 1
+        return self
+
+    def _distribute(self, pairs, volumes, max_vol, new_tip, kwargs):
+        disposal = kwargs.get('disposal_volume', 0) or 0
+        src = pairs[0][0]
+        batch = []
+        for (_, dst), vol in zip(pairs, volumes):
+            if batch and sum(v for _, v in batch) + vol + disposal > max_vol:
+                self._multi_dispense(src, batch, disposal, new_tip, kwargs)
+                batch = []
+            batch.append((dst, vol))
+        if batch:
+            self._multi_dispense(src, batch, disposal, new_tip, kwargs)
+
+    def _multi_dispense(self, src, batch, disposal, new_tip, kwargs):
+        if new_tip == 'always':
+            if self.has_tip:
+                self._end_tip(kwargs)
+            self.pick_up_tip()
+        self._step_aspirate(src, sum(v for _, v in batch) + disposal, kwargs)
+        for dst, vol in batch:
+            self.dispense(vol, dst)
+        if disposal or kwargs.get('blow_out'):
+            self.blow_out(self._blowout_location(src, batch[-1][0], kwargs))
+
+    def _consolidate(self, pairs, volumes, max_vol, new_tip, kwargs):
+        dst = pairs[0][1]
+        batch = []
+        for (src, _), vol in zip(pairs, volumes):
+            if batch and sum(v for _, v in batch) + vol > max_vol:
+                self._collect(batch, dst, new_tip, kwargs)
+                batch = []
+            batch.append((src, vol))
+        if batch:
+            self._collect(batch, dst, new_tip, kwargs)
+
+    def _collect(self, batch, dst, new_tip, kwargs):
+        if new_tip == 'always':
+            if self.has_tip:
+                self._end_tip(kwargs)
+            self.pick_up_tip()
+        for src, vol in batch:
+            self.aspirate(vol, src)
+        self._step_dispense(dst, sum(v for _, v in batch), batch[-1][0], kwargs)
+
+    def _step_aspirate(self, src, vol, kwargs):
+        mix_before = kwargs.get('mix_before')
+        if mix_before:
+            self.mix(mix_before[0], mix_before[1], src)
+        self.aspirate(vol, src)
+        if kwargs.get('touch_tip'):
+            self.touch_tip()
+        if kwargs.get('air_gap'):
+            self.air_gap(kwargs['air_gap'])
+
+    def _step_dispense(self, dst, vol, src, kwargs):
+        self.dispense(vol, dst)
+        mix_after = kwargs.get('mix_after')
+        if mix_after:
+            self.mix(mix_after[0], mix_after[1])
+        if kwargs.get('blow_out'):
+            self.blow_out(self._blowout_location(src, dst, kwargs))
+        if kwargs.get('touch_tip'):
+            self.touch_tip()
+
+    def _blowout_location(self, src, dst, kwargs):
+        where = kwargs.get('blowout_location', 'trash')
+        if where == 'source well':
+            return src
+        if where == 'destination well':
+            return dst
+        return self.trash_container.wells()[0]
+
+    def _end_tip(self, kwargs):
+        if kwargs.get('trash', True):
+            self.drop_tip()
+        else:
+            self.return_tip()
+
+
+#######################
+# protocol context
+#######################
+
+class ProtocolContext(object):
+    def __init__(self, api_version='2.10'):
+        self.api_version = APIVersion.from_string(api_version)
+        self.commands = []
+        self.deck = {}
+        self.loaded_labwares = {}
+        self.loaded_instruments = {}
+        self.loaded_modules = {}
+        self.max_speeds = {}
+        self.rail_lights_on = False
+        self.door_closed = True
+        self._depth = 0
+        self.fixed_trash = Labware('opentrons_1_trash_1100ml_fixed', '12')
+        self.deck['12'] = self.fixed_trash
+        self.loaded_labwares[12] = self.fixed_trash
+
+    def _record(self, name, text, **fields):
+        fields['name'] = name
+        fields['text'] = text
+        fields['depth'] = self._depth
+        self.commands.append(fields)
+
+    def _slot(self, location):
+        slot = str(location)
+        if slot not in slot_origin:
+            raise ValueError('invalid deck slot ' + slot)
+        if slot in self.deck:
+            raise ValueError('Deck location ' + slot + ' already has an item: ' + str(self.deck[slot]))
+        return slot
+
+    def is_simulating(self):
+        return True
+
+    def load_labware(self, load_name, location, label=None, namespace=None, version=None):
+        slot = self._slot(location)
+        labware = Labware(load_name, slot, label)
+        self.deck[slot] = labware
+        self.loaded_labwares[int(slot)] = labware
+        return labware
+
+    def load_instrument(self, instrument_name, mount, tip_racks=None, replace=False):
+        mount = str(mount).lower()
+        if mount not in ('left', 'right'):
+            raise ValueError('invalid mount ' + mount)
+        if mount in self.loaded_instruments and not replace:
+            raise RuntimeError('Instrument already present in ' + mount + ' mount: ' +
+                               str(self.loaded_instruments[mount]))
+        pipette = InstrumentContext(self, instrument_name, mount, tip_racks)
+        self.loaded_instruments[mount] = pipette
+        return pipette
+
+    def load_module(self, module_name, location=None, configuration=None):
+        name = module_name.lower()
+        for keys, cls in module_classes:
+            if any(key in name for key in keys):
+                break
+        else:
+            raise ValueError('unsupported module ' + module_name)
+        slot = self._slot(location)
+        module = cls(self, module_name, slot)
+        self.deck[slot] = module
+        self.loaded_modules[int(slot)] = module
+        return module
+
+    def comment(self, msg):
+        self._record('comment', msg)
+
+    def pause(self, msg=None):
+        self._record('pause', 'Pausing robot operation' + (': ' + msg if msg else ''))
+
+    def delay(self, seconds=0, minutes=0, msg=None):
+        total = minutes * 60 + seconds
+        self._record('delay', 'Delaying for %d minutes and %s seconds' % (
+            total // 60, round(total % 60, 2)) + (': ' + msg if msg else ''), seconds=total)
+
+    def home(self):
+        for pipette in self.loaded_instruments.values():
+            pipette._location = None
+        self._record('home', 'Homing')
+
+    def set_rail_lights(self, on):
+        self.rail_lights_on = bool(on)
+        self._record('set_rail_lights', 'Turning rail lights ' + ('on' if on else 'off'))
+
+
+#######################
+# running protocols
+#######################
+
+def fake_opentrons():
+    # module objects standing in for opentrons, opentrons.protocol_api (and
+    # its labware submodule) and opentrons.types
+    labware = types.ModuleType('opentrons.protocol_api.labware')
+    labware.OutOfTipsError = OutOfTipsError
+    labware.Labware = Labware
+    labware.Well = Well
+    protocol_api = types.ModuleType('opentrons.protocol_api')
+    protocol_api.ProtocolContext = ProtocolContext
+    protocol_api.InstrumentContext = InstrumentContext
+    protocol_api.labware = labware
+    opentrons_types = types.ModuleType('opentrons.types')
+    opentrons_types.Point = Point
+    opentrons_types.Location = Location
+    opentrons = types.ModuleType('opentrons')
+    opentrons.protocol_api = protocol_api
+    opentrons.types = opentrons_types
+    return {'opentrons': opentrons,
+            'opentrons.protocol_api': protocol_api,
+            'opentrons.protocol_api.labware': labware,
+            'opentrons.types': opentrons_types}
+
+
+@contextlib.contextmanager
+def mocked_opentrons():
+    # install the fake opentrons modules, restore sys.modules afterwards
+    fakes = fake_opentrons()
+    saved = dict((name, sys.modules.get(name)) for name in fakes)
+    sys.modules.update(fakes)
+    try:
+        yield
+    finally:
+        for name, module in saved.items():
+            if module is None:
+                sys.modules.pop(name, None)
+            else:
+                sys.modules[name] = module
+
+
+def simulate_text(text, filename='<protocol>'):
+    # run the protocol source text, returns the mock context
+    code = compile(text, filename, 'exec')
+    namespace = {'__name__': 'nc_protocol', '__file__': filename}
+    with mocked_opentrons():
+        exec(code, namespace)
+        metadata = namespace.get('metadata', {})
+        ctx = ProtocolContext(metadata.get('apiLevel', '2.10'))
+        if 'run' not in namespace:
+            raise ValueError(filename + ' has no run(ctx) function')
+        namespace['run'](ctx)
+    return ctx
+
+
+def simulate(protocol_file):
+    with open(protocol_file) as fh:
+        return simulate_text(fh.read(), protocol_file)
+
+
+def summary(ctx):
+    # counts of the recorded commands, tip pick-ups per pipette (tips) and
+    # tips taken from the racks (used_tips, 8 per multichannel pick-up)
+    counts = {}
+    for command in ctx.commands:
+        counts[command['name']] = counts.get(command['name'], 0) + 1
+    tips = {}
+    for command in ctx.commands:
+        if command['name'] == 'pick_up_tip':
+            key = command['pipette'] + ' (' + command['mount'] + ')'
+            tips[key] = tips.get(key, 0) + 1
+    used_tips = sum(1 for item in ctx.deck.values()
+                    if isinstance(item, Labware) and item.is_tiprack
+                    for well in item.wells() if not well.has_tip)
+    return {'commands': len(ctx.commands), 'counts': counts, 'tips': tips,
+            'used_tips': used_tips}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='simulate an opentrons protocol with the NC mock context')
+    parser.add_argument('protocol', help='protocol file (python)')
+    parser.add_argument('-q', dest='quiet', action='store_true',
+                        help='only print the summary')
+    parser.add_argument('-j', dest='json', help='write the commands to a json file')
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    try:
+        ctx = simulate(args.protocol)
+    except Exception as err:
+        print('# simulation failed: ' + type(err).__name__ + ': ' + str(err))
+        return 1
+    elapsed = time.perf_counter() - start
+
+    if not args.quiet:
+        for command in ctx.commands:
+            print('\t' * command['depth'] + command['text'])
+    if args.json:
+        with open(args.json, 'w') as fh:
+            json.dump(ctx.commands, fh, indent=1)
+
+    info = summary(ctx)
+    print('# ' + os.path.basename(args.protocol) + ': ' + str(info['commands']) +
+          ' commands simulated in ' + str(math.ceil(elapsed * 1000)) + ' ms')
+    for pipette, count in sorted(info['tips'].items()):
+        print('# tips used by ' + pipette + ': ' + str(count))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,78 @@
+<?php
+// content-addressed cache for generated protocols
+// the key is the sha256 of the uploaded template, yaml and csv bytes
+// entries are written by OT2_worker.py (cache_put) when a job is done
+// entries are evicted least-recently-used first when the cache grows
+// above OT2_CACHE_MAX_BYTES (the mtime of an entry is its last use)
+//
+// note: a cached protocol keeps the <edit_date> of its first generation
+
+define('OT2_CACHE_DIR', __DIR__ . '/cache');
+define('OT2_CACHE_MAX_BYTES', 50 * 1024 * 1024);
+
+function ot2_cache_key($files, $template_sha = '') {
+  // $files: paths of the template, yaml and (optional) csv uploads, in that order
+  // $template_sha: sha256 of a registered template (used instead of $files[0])
+  $parts = array();
+  foreach ($files as $i => $path) {
+    if ($i == 0 && $template_sha != '') {
+      $parts[] = $i . ':' . $template_sha;
+      continue;
+    }
+    $parts[] = $i . ':' . (($path != "" && is_file($path)) ? hash_file('sha256', $path) : '-');
+  }
+  return hash('sha256', implode("\n", $parts));
+}
+
+function ot2_cache_path($key) {
+  return OT2_CACHE_DIR . '/' . $key . '.py';
+}
+
+function ot2_cache_get($key, $dest) {
+  // copy the cached protocol to $dest, returns true on a hit
+  $entry = ot2_cache_path($key);
+  if (!is_file($entry)) {
+    return false;
+  }
+  touch($entry);  // mark as recently used
+  return copy($entry, $dest);
+}
+
+function ot2_cache_put($key, $src) {
+  // store a generated protocol then trim the cache to its max size
+  if (!is_file($src) || filesize($src) == 0) {
+    return false;
+  }
+  if (!is_dir(OT2_CACHE_DIR)) {
+    mkdir(OT2_CACHE_DIR, 0775, true);
+  }
+  // write next to the entry then rename so readers never see a partial file
+  $tmp = tempnam(OT2_CACHE_DIR, 'tmp_');
+  if ($tmp === false || !copy($src, $tmp)) {
+    return false;
+  }
+  rename($tmp, ot2_cache_path($key));
+  ot2_cache_evict(OT2_CACHE_MAX_BYTES);
+  return true;
+}
+
+function ot2_cache_evict($max_bytes) {
+  // delete least-recently-used entries until the cache fits in $max_bytes
+  $entries = array();
+  $total = 0;
+  foreach (glob(OT2_CACHE_DIR . '/*.py') as $entry) {
+    $size = filesize($entry);
+    $entries[] = array('path' => $entry, 'mtime' => filemtime($entry), 'size' => $size);
+    $total += $size;
+  }
+  usort($entries, function($a, $b) { return $a['mtime'] - $b['mtime']; });
+  foreach ($entries as $entry) {
+    if ($total <= $max_bytes) {
+      break;
+    }
+    if (unlink($entry['path'])) {
+      $total -= $entry['size'];
+    }
+  }
+}
+?>
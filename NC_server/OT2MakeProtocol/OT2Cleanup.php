@@ -1,11 +1,7 @@
 <?php
-chdir('/var/www/cgi-bin/OT2MakeProtocol/uploads/');
+include_once 'OT2Jobs.php';
 
-// cleanup for next run
-$files = glob("/var/www/cgi-bin/OT2MakeProtocol/uploads/*"); // get all file names
-foreach($files as $file){ // iterate files
-  if(is_file($file)) {
-    unlink($file); // delete file
-  }
-};
+// cleanup job folders older than OT2_JOB_TTL
+// (recent jobs of other users are left untouched)
+ot2_cleanup_jobs();
 ?>
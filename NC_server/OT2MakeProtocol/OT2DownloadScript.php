@@ -1,5 +1,14 @@
 <?php
-chdir('/var/www/cgi-bin/OT2MakeProtocol/uploads');
+include_once 'OT2Jobs.php';
+
+$jobdir = ot2_job_dir(isset($_GET['job']) ? $_GET['job'] : '');
+if ($jobdir === false || !is_file($jobdir . "/NC_protocol.py")) {
+  http_response_code(404);
+  echo '<p>This protocol is no longer available, please generate it again.</p>';
+  echo '<p><a href=http://10.112.84.39/cgi-bin/OT2MakeProtocol/OT2MakeProtocol.php>Back to OT2MakeProtocol</a></p>';
+  exit;
+}
+chdir($jobdir);
 $file = "NC_protocol.py";
 header('Content-Description: File Transfer');
 header('Content-Disposition: attachment; filename='.basename($file));
@@ -9,6 +18,4 @@ header('Pragma: public');
 header('Content-Length: ' . filesize($file));
 header("Content-Type: text/plain");
 readfile($file);
-close($file);
-echo '<p><a href=http://10.112.84.39/webtools/Workflow.htm>Return to NC Webtools</a></p>';
 ?>
@@ -0,0 +1,28 @@
+<?php
+include_once 'OT2Jobs.php';
+
+// JSON status of a protocol generation job
+// {"job": id, "status": "queued|running|done|error|unknown", "message": ..., "download": url}
+header('Content-Type: application/json');
+header('Cache-Control: no-store');
+
+$job = isset($_GET['job']) ? $_GET['job'] : '';
+$jobdir = ot2_job_dir($job);
+if ($jobdir === false) {
+  http_response_code(404);
+  echo json_encode(array('job' => $job, 'status' => 'unknown', 'message' => 'no such job'));
+  exit;
+}
+
+$status = ot2_read_status($jobdir);
+$reply = array(
+  'job' => $job,
+  'status' => $status['status'],
+  'message' => isset($status['message']) ? $status['message'] : '');
+
+if ($status['status'] == 'done') {
+  $reply['download'] = 'OT2DownloadScript.php?job=' . $job;
+}
+
+echo json_encode($reply);
+?>
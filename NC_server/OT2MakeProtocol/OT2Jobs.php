@@ -0,0 +1,92 @@
+<?php
+// per-request job folders for the protocol server
+// each upload gets its own folder uploads/<job id> so that concurrent users
+// never share (or delete) each other's files
+// job folders are removed by ot2_cleanup_jobs() once older than OT2_JOB_TTL
+//
+// generation is asynchronous: the upload page queues the job (an entry in
+// OT2_QUEUE_DIR) and OT2_worker.py processes the queue; the job state is
+// kept in <job folder>/status.json (queued, running, done or error)
+
+define('OT2_UPLOADS_DIR', __DIR__ . '/uploads');
+define('OT2_QUEUE_DIR', __DIR__ . '/queue');
+define('OT2_JOB_TTL', 3600);    // seconds a job folder is kept
+
+function ot2_new_job() {
+  // create a new job folder and return its id
+  if (!is_dir(OT2_UPLOADS_DIR)) {
+    mkdir(OT2_UPLOADS_DIR, 0775, true);
+  }
+  do {
+    $id = date('YmdHis') . '_' . bin2hex(random_bytes(6));
+  } while (!@mkdir(OT2_UPLOADS_DIR . '/' . $id, 0775));
+  return $id;
+}
+
+function ot2_job_dir($id) {
+  // folder of an existing job, false for invalid or expired ids
+  if (!is_string($id) || !preg_match('/^[0-9]{14}_[0-9a-f]{12}$/', $id)) {
+    return false;
+  }
+  $dir = OT2_UPLOADS_DIR . '/' . $id;
+  return is_dir($dir) ? $dir : false;
+}
+
+function ot2_write_status($jobdir, $status, $fields = array()) {
+  // replace status.json atomically (readers never see a partial file)
+  $data = array_merge($fields, array('status' => $status, 'updated' => time()));
+  $tmp = $jobdir . '/status.json.tmp';
+  file_put_contents($tmp, json_encode($data));
+  rename($tmp, $jobdir . '/status.json');
+}
+
+function ot2_read_status($jobdir) {
+  $data = @file_get_contents($jobdir . '/status.json');
+  $status = ($data === false) ? null : json_decode($data, true);
+  return is_array($status) ? $status : array('status' => 'unknown');
+}
+
+function ot2_queue_job($job) {
+  // add the job to the queue processed by OT2_worker.py
+  if (!is_dir(OT2_QUEUE_DIR)) {
+    mkdir(OT2_QUEUE_DIR, 0775, true);
+  }
+  touch(OT2_QUEUE_DIR . '/' . $job);
+}
+
+function ot2_templates() {
+  // registered templates {id: entry} from the catalog written by OT2_worker.py
+  $data = @file_get_contents(__DIR__ . '/templates.json');
+  $catalog = ($data === false) ? null : json_decode($data, true);
+  $templates = array();
+  if (is_array($catalog) && isset($catalog['templates'])) {
+    foreach ($catalog['templates'] as $entry) {
+      $templates[$entry['id']] = $entry;
+    }
+  }
+  return $templates;
+}
+
+function ot2_remove_dir($dir) {
+  foreach (array_diff(scandir($dir), array('.', '..')) as $name) {
+    $path = $dir . '/' . $name;
+    is_dir($path) ? ot2_remove_dir($path) : unlink($path);
+  }
+  rmdir($dir);
+}
+
+function ot2_cleanup_jobs($ttl = OT2_JOB_TTL) {
+  // remove the job folders (and loose files) older than $ttl seconds
+  $limit = time() - $ttl;
+  foreach (glob(OT2_UPLOADS_DIR . '/*') as $path) {
+    if (filemtime($path) >= $limit) {
+      continue;
+    }
+    if (is_dir($path)) {
+      ot2_remove_dir($path);
+    } else {
+      unlink($path);
+    }
+  }
+}
+?>
@@ -10,7 +10,7 @@
 <p>This webtool requires uploading several user-edited files in order to do its job.</p>
 
 <ul>
-<li>The <b>template</b> file contains the OT2 protocol script with placeholders for user editable variables (<i>see example file</i>)</li>
+<li>The <b>template</b> contains the OT2 protocol script with placeholders for user editable variables; pick one of the NC_protocols templates (<a href=OT2Templates.php>catalog</a> with the placeholders of each) or upload your own (<i>see example file</i>)</li>
 <li>The <b>yaml</b> (plain text) file contains the names of the placeholders and the user-defined values to replace them in the code (<i>see example file</i>)</li>
 <li>Finally, a <b>CSV</b> file can optionally be uploaded when a protocol requires a list of actions / plate locations
 (eg cherry picking across wells of plates; <i>see example file</i>).</li>
@@ -19,12 +19,23 @@
 <b>Note:</b> when present, the CSV file should be saved with comma-separators (',' and not ';') and saved as a plain text file from your favorite editor.
 
 <?php include 'OT2Cleanup.php'; ?>
+<?php $templates = ot2_templates(); ?>
 
 <form method="post" action='OT2MakeProtocol_upload.php' enctype='multipart/form-data'>
   <h3>Select the proper files for this job</h3>
   <input type="reset" style="font-size:14px";>
   <hr>
-  <h4>Template protocol file (.py):
+  <h4>Template protocol:
+  <select name="template_id">
+    <option value="">upload my own template below</option>
+<?php
+foreach ($templates as $id => $entry) {
+  $name = isset($entry['metadata']['protocolName']) ? $entry['metadata']['protocolName'] : $id;
+  echo '    <option value="' . htmlspecialchars($id) . '">' . htmlspecialchars($id . ' (' . $name . ')') . "</option>\n";
+}
+?>
+  </select></h4>
+  <h4>or template protocol file (.py):
   <input name="upload[]" type="file" /></h4>
   <h4>Configuration file (.yaml):
   <input name="upload[]" type="file" /></h4>
@@ -1,17 +1,51 @@
+<?php
+include_once 'OT2Jobs.php';
+$job = isset($_GET['job']) ? $_GET['job'] : '';
+$jobdir = ot2_job_dir($job);
+$status = ($jobdir === false) ? array('status' => 'unknown') : ot2_read_status($jobdir);
+?>
 <html>
  <head>
   <title>OT2 script results</title>
  </head>
  <body>
 
- <?php echo '<p><a href=http://10.112.84.39/cgi-bin/OT2MakeProtocol/OT2DownloadScript.php>Download your script</a></p>'; ?>
+ <?php if ($status['status'] == 'queued' || $status['status'] == 'running') { ?>
+ <h3>Your protocol is being generated (job <?php echo htmlspecialchars($job); ?>: <span id="status"><?php echo $status['status']; ?></span>)</h3>
+ <script>
+ // poll the job status and reload this page when the job has finished
+ function poll() {
+   fetch('OT2JobStatus.php?job=<?php echo urlencode($job); ?>')
+     .then(function(r) { return r.json(); })
+     .then(function(s) {
+       document.getElementById('status').textContent = s.status;
+       if (s.status == 'queued' || s.status == 'running') {
+         setTimeout(poll, 1000);
+       } else {
+         window.location.reload();
+       }
+     })
+     .catch(function() { setTimeout(poll, 2000); });
+ }
+ setTimeout(poll, 500);
+ </script>
+ <?php } else { ?>
+ <?php if ($status['status'] == 'done') echo '<p><a href=OT2DownloadScript.php?job=' . urlencode($job) . '>Download your script</a></p>'; ?>
  <?php echo '<p><a href=http://10.112.84.39/webtools/Workflow.htm>Return to NC Webtools</a></p>'; ?>
  <hr>
- <?php chdir('/var/www/cgi-bin/OT2MakeProtocol/uploads'); ?>
  <h3><?php echo "The resulting protocol is as follows:" ?></h3>
  <hr>
- <pre><?php echo nl2br( file_get_contents( "NC_protocol.py" ) ) ?></pre>
+ <pre><?php
+ if ($status['status'] == 'done' && is_file($jobdir . "/NC_protocol.py")) {
+   echo htmlspecialchars(file_get_contents($jobdir . "/NC_protocol.py"));
+ } elseif ($status['status'] == 'error') {
+   echo "The protocol could not be generated:\n" . htmlspecialchars($status['message']);
+ } else {
+   echo "This protocol is no longer available, please generate it again.";
+ }
+ ?></pre>
  <hr>
+ <?php } ?>
 
  </body>
 </html>
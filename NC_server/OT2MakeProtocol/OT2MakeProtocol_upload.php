@@ -1,22 +1,44 @@
 <?php
+include_once 'OT2Cache.php';
+include_once 'OT2Jobs.php';
+
+// each request works in its own job folder
+$job = ot2_new_job();
+$jobdir = ot2_job_dir($job);
+
+$file = array("", "", "");
 for($i=0; $i<3; $i++) {
  $tmpFilePath = $_FILES['upload']['tmp_name'][$i];
   if ($tmpFilePath != ""){
-  $file[$i] = $newFilePath = "/var/www/cgi-bin/OT2MakeProtocol/uploads/" . $_FILES['upload']['name'][$i];
+  $file[$i] = $newFilePath = $jobdir . "/" . basename($_FILES['upload']['name'][$i]);
     if(move_uploaded_file($tmpFilePath, $newFilePath)) {
     }
   }
 }
 
-// run it
-$cmd = "/var/www/cgi-bin/OT2MakeProtocol/OT_inject_params.sh -i " . basename($file[0]) . " -y " . basename($file[1]) . " -o NC_protocol.py ;";
-echo "<pre># command: " . $cmd . "</pre>";
+$fields = array(
+  'job' => $job,
+  'template' => basename($file[0]),
+  'yaml' => basename($file[1]));
 
-chdir('/var/www/cgi-bin/OT2MakeProtocol/uploads');
-$cmdresult = shell_exec("$cmd");
+// a registered template (picked by id in the form) replaces the template upload
+$templates = ot2_templates();
+$template_id = isset($_POST['template_id']) ? $_POST['template_id'] : '';
+$template_sha = '';
+if ($template_id != '' && isset($templates[$template_id])) {
+  $fields['template_id'] = $template_id;
+  $template_sha = $templates[$template_id]['sha256'];
+}
+$fields['cachekey'] = ot2_cache_key($file, $template_sha);
 
-// echo script results
-echo "<pre>" . $cmdresult . "</pre>";
+// return the cached protocol when the same template, yaml and csv were seen before
+// otherwise queue the job for OT2_worker.py and return immediately
+if (ot2_cache_get($fields['cachekey'], $jobdir . "/NC_protocol.py")) {
+  ot2_write_status($jobdir, 'done', array_merge($fields, array('message' => 'cache hit')));
+} else {
+  ot2_write_status($jobdir, 'queued', $fields);
+  ot2_queue_job($job);
+}
 
-header("Location: http://10.112.84.39/cgi-bin/OT2MakeProtocol/OT2MakeProtocol_done.php");
+header("Location: OT2MakeProtocol_done.php?job=" . $job);
 ?>
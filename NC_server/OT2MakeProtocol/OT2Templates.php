@@ -0,0 +1,8 @@
+<?php
+include_once 'OT2Jobs.php';
+
+// catalog of the registered templates (metadata, placeholders, fields.json)
+// written by OT2_worker.py at startup (or OT2_registry.py)
+header('Content-Type: application/json');
+echo json_encode(array('templates' => array_values(ot2_templates())));
+?>
@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+
+# scriptname: OT2_load_test.py
+# load test for the OT2MakeProtocol php pages
+# N protocol generations are posted concurrently to the upload page; each
+# request gets a unique marker line appended to its template so that the
+# downloaded protocol can be checked to belong to that request (no files
+# shared or overwritten between jobs)
+#
+# run against a local php server and worker pool, eg:
+#   PHP_CLI_SERVER_WORKERS=8 php -S 127.0.0.1:8000 -t NC_server/OT2MakeProtocol
+#   NC_server/OT2MakeProtocol/OT2_worker.py -w 4
+#   OT2_load_test.py -u http://127.0.0.1:8000 -n 16
+#
+# visit our Git: https://github.com/Nucleomics-VIB
+
+import argparse
+import concurrent.futures
+import json
+import os
+import re
+import statistics
+import sys
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+import uuid
+
+here = os.path.dirname(os.path.abspath(__file__))
+test_dir = os.path.join(here, '..', '..', 'NC_protocols', 'NC_repooling_with_dilution', 'template')
+default_template = os.path.join(test_dir, 'NC_repooling_with_dilution_template.py')
+default_yaml = os.path.join(test_dir, 'test', 'config.yaml')
+default_csv = os.path.join(test_dir, 'test', 'data.csv')
+
+
+class NoRedirect(urllib.request.HTTPRedirectHandler):
+    # keep the upload redirect to read the job id from its Location
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        return None
+
+
+def multipart(files):
+    # encode [(filename, bytes), ...] as the 'upload[]' fields of the form
+    boundary = uuid.uuid4().hex
+    body = []
+    for name, data in files:
+        body.append(
+            ('--' + boundary + '\r\n' +
+             'Content-Disposition: form-data; name="upload[]"; filename="' + name + '"\r\n' +
+             'Content-Type: application/octet-stream\r\n\r\n').encode() + data + b'\r\n')
+    body.append(('--' + boundary + '\r\n' +
+                 'Content-Disposition: form-data; name="submit"\r\n\r\nSubmit\r\n' +
+                 '--' + boundary + '--\r\n').encode())
+    return b''.join(body), 'multipart/form-data; boundary=' + boundary
+
+
+def wait_done(base_url, job, timeout=120, poll=0.2):
+    # poll the job status until the worker has finished the job
+    url = base_url + '/OT2JobStatus.php?job=' + urllib.parse.quote(job)
+    limit = time.time() + timeout
+    while time.time() < limit:
+        with urllib.request.urlopen(url, timeout=30) as response:
+            status = json.loads(response.read().decode())
+        if status.get('status') == 'done':
+            return
+        if status.get('status') not in ('queued', 'running'):
+            raise RuntimeError('job ' + job + ' ' + str(status.get('status')) +
+                               ': ' + str(status.get('message', '')))
+        time.sleep(poll)
+    raise RuntimeError('job ' + job + ' not done after ' + str(timeout) + 's')
+
+
+def generate(base_url, files, index, unique=True):
+    # one upload + download, returns a result dict
+    marker = ('# load test request ' + str(index) + ' ' + uuid.uuid4().hex).encode()
+    tpl_name, tpl_data = files[0]
+    if unique:
+        tpl_data = tpl_data + b'\n' + marker + b'\n'
+    body, ctype = multipart([(tpl_name, tpl_data)] + files[1:])
+
+    result = {'index': index, 'ok': False, 'job': '', 'seconds': 0.0, 'error': ''}
+    start = time.perf_counter()
+    try:
+        opener = urllib.request.build_opener(NoRedirect)
+        request = urllib.request.Request(
+            base_url + '/OT2MakeProtocol_upload.php', data=body,
+            headers={'Content-Type': ctype})
+        try:
+            opener.open(request, timeout=120)
+            raise RuntimeError('the upload page did not redirect')
+        except urllib.error.HTTPError as err:
+            if err.code not in (301, 302, 303):
+                raise
+            location = err.headers.get('Location', '')
+        job = urllib.parse.parse_qs(urllib.parse.urlparse(location).query).get('job', [''])[0]
+        result['job'] = job
+        if not job:
+            raise RuntimeError('no job id in redirect: ' + location)
+
+        wait_done(base_url, job)
+        with urllib.request.urlopen(
+                base_url + '/OT2DownloadScript.php?job=' + urllib.parse.quote(job),
+                timeout=120) as response:
+            protocol = response.read()
+        if unique and marker not in protocol:
+            raise RuntimeError('the protocol of job ' + job + ' belongs to another request')
+        if re.search(rb'"<\w+>"', protocol):
+            raise RuntimeError('placeholders left in the protocol of job ' + job)
+        result['ok'] = True
+    except Exception as err:
+        result['error'] = str(err)
+    result['seconds'] = time.perf_counter() - start
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='concurrent protocol generations against the OT2MakeProtocol pages')
+    parser.add_argument('-u', dest='url', default='http://127.0.0.1:8000',
+                        help='base url of the OT2MakeProtocol pages')
+    parser.add_argument('-n', dest='number', type=int, default=8,
+                        help='number of concurrent generations')
+    parser.add_argument('-t', dest='template', default=default_template)
+    parser.add_argument('-y', dest='yaml', default=default_yaml)
+    parser.add_argument('-c', dest='csv', default=default_csv,
+                        help='csv file (use "" for none)')
+    parser.add_argument('--same', action='store_true',
+                        help='send identical files (exercises the protocol cache)')
+    args = parser.parse_args(argv)
+
+    files = []
+    for path in [args.template, args.yaml, args.csv]:
+        if path:
+            with open(path, 'rb') as fh:
+                files.append((os.path.basename(path), fh.read()))
+
+    base_url = args.url.rstrip('/')
+    start = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=args.number) as pool:
+        results = list(pool.map(
+            lambda i: generate(base_url, files, i, unique=not args.same),
+            range(args.number)))
+    wall = time.perf_counter() - start
+
+    for result in results:
+        if not result['ok']:
+            print('# request ' + str(result['index']) + ' failed: ' + result['error'])
+
+    ok = [r for r in results if r['ok']]
+    jobs = set(r['job'] for r in results if r['job'])
+    times = [r['seconds'] for r in results]
+    print('requests\tok\tdistinct_jobs\twall_s\tmean_s\tmax_s')
+    print('\t'.join([
+        str(len(results)), str(len(ok)), str(len(jobs)), '%.2f' % wall,
+        '%.2f' % statistics.mean(times), '%.2f' % max(times)]))
+    return 0 if len(ok) == len(results) and len(jobs) == len(results) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
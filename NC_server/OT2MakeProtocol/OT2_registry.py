@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+
+# scriptname: OT2_registry.py
+# catalog of the protocol templates found in NC_protocols
+# every *_template.py file (test folders excluded) is indexed with:
+#   id            template file name without '_template.py'
+#   path          path relative to the NC_protocols folder
+#   metadata      the protocol 'metadata' dictionary
+#   placeholders  the <placeholder> names found in the template
+#   fields        the fields.json schema of the protocol folder (when present)
+#   sha256        hash of the template bytes (used as protocol cache key)
+#
+# the catalog is written as json for the OT2MakeProtocol form (templates.json)
+# and OT2_worker.py keeps the template texts in memory
+#
+# visit our Git: https://github.com/Nucleomics-VIB
+
+import argparse
+import ast
+import hashlib
+import json
+import os
+import re
+import sys
+
+here = os.path.dirname(os.path.abspath(__file__))
+default_protocols = os.path.join(here, '..', '..', 'NC_protocols')
+
+placeholder_re = re.compile(r'<(\w+)>')
+
+
+def read_metadata(text):
+    # the literal 'metadata = {...}' of a protocol (empty when missing)
+    try:
+        tree = ast.parse(text)
+    except SyntaxError:
+        return {}
+    for node in tree.body:
+        if isinstance(node, ast.Assign) and any(
+                isinstance(t, ast.Name) and t.id == 'metadata' for t in node.targets):
+            try:
+                return ast.literal_eval(node.value)
+            except ValueError:
+                return {}
+    return {}
+
+
+def read_fields(template_path):
+    # fields.json of the protocol folder (the template may be in template/)
+    folder = os.path.dirname(template_path)
+    for candidate in [folder, os.path.dirname(folder)]:
+        path = os.path.join(candidate, 'fields.json')
+        if os.path.isfile(path):
+            with open(path) as fh:
+                return json.load(fh)
+    return []
+
+
+def index_template(path, protocols_dir):
+    with open(path, 'rb') as fh:
+        data = fh.read()
+    text = data.decode('utf-8')
+    placeholders = []
+    for name in placeholder_re.findall(text):
+        if name not in placeholders:
+            placeholders.append(name)
+    return {
+        'id': os.path.basename(path)[:-len('_template.py')],
+        'path': os.path.relpath(path, protocols_dir),
+        'metadata': read_metadata(text),
+        'placeholders': placeholders,
+        'fields': read_fields(path),
+        'sha256': hashlib.sha256(data).hexdigest(),
+        'text': text,
+    }
+
+
+def scan(protocols_dir=default_protocols):
+    # {id: entry} for all templates of protocols_dir, scanned once
+    templates = {}
+    for root, dirs, files in os.walk(protocols_dir):
+        dirs[:] = sorted(d for d in dirs if not d.startswith('test'))
+        for name in sorted(files):
+            if not name.endswith('_template.py'):
+                continue
+            entry = index_template(os.path.join(root, name), protocols_dir)
+            if entry['id'] in templates:
+                # same file name in two folders: use the folder as prefix
+                entry['id'] = os.path.dirname(entry['path']).replace(os.sep, '/') + '/' + entry['id']
+            templates[entry['id']] = entry
+    return templates
+
+
+def catalog(templates):
+    # json-ready catalog (without the template texts)
+    return {'templates': [
+        {key: value for key, value in entry.items() if key != 'text'}
+        for entry in templates.values()]}
+
+
+def write_catalog(templates, path):
+    tmp = path + '.' + str(os.getpid())
+    with open(tmp, 'w') as fh:
+        json.dump(catalog(templates), fh, indent=1)
+    os.replace(tmp, path)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='write the catalog of the NC_protocols templates')
+    parser.add_argument('-p', dest='protocols', default=default_protocols,
+                        help='NC_protocols folder')
+    parser.add_argument('-o', dest='output', default=os.path.join(here, 'templates.json'),
+                        help='catalog file (json)')
+    args = parser.parse_args(argv)
+
+    templates = scan(args.protocols)
+    write_catalog(templates, args.output)
+    for entry in templates.values():
+        print(entry['id'] + '\t' + entry['path'] + '\t' + str(len(entry['placeholders'])) + ' placeholders')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
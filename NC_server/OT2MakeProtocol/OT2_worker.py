@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+
+# scriptname: OT2_worker.py
+# worker pool for the OT2MakeProtocol php pages
+# the upload page stores the files of a job in uploads/<job id>, writes its
+# status.json ('queued') and adds an entry queue/<job id>
+# each worker claims the oldest queue entry by moving it to running/ (an
+# atomic rename, so a job is never processed twice), injects the protocol
+# in the job folder and sets the job status to 'done' or 'error'
+# a generated protocol is stored in the cache (cache/<key>.py, same layout
+# and size limit as OT2Cache.php) before the job is marked 'done', so
+# identical uploads get it whether or not the job was polled
+#
+# the NC_protocols templates are scanned once at startup (OT2_registry.py),
+# kept in memory for jobs that give a template_id instead of a template file
+# and their catalog is written to templates.json for the upload form
+#
+# run as a service next to the php files, eg:
+#   OT2_worker.py -w 4 -t /path/to/NC_protocols
+#
+# visit our Git: https://github.com/Nucleomics-VIB
+
+import argparse
+import io
+import json
+import multiprocessing
+import os
+import sys
+import time
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, here)
+import OT_inject_params  # noqa: E402
+import OT2_registry  # noqa: E402
+
+# as OT2_CACHE_MAX_BYTES in OT2Cache.php
+cache_max_bytes = 50 * 1024 * 1024
+
+
+def write_status(jobdir, status, **fields):
+    # replace status.json atomically (same format as OT2Jobs.php)
+    data = read_status(jobdir)
+    data.update(fields)
+    data['status'] = status
+    data['updated'] = int(time.time())
+    tmp = os.path.join(jobdir, 'status.json.' + str(os.getpid()))
+    with open(tmp, 'w') as fh:
+        json.dump(data, fh)
+    os.replace(tmp, os.path.join(jobdir, 'status.json'))
+
+
+def read_status(jobdir):
+    try:
+        with open(os.path.join(jobdir, 'status.json')) as fh:
+            return json.load(fh)
+    except (OSError, ValueError):
+        return {}
+
+
+def cache_put(cache_dir, key, src, max_bytes=cache_max_bytes):
+    # store a generated protocol as cache/<key>.py then trim the cache to
+    # max_bytes, least recently used (oldest mtime) first (see OT2Cache.php)
+    if not key or not os.path.isfile(src) or os.path.getsize(src) == 0:
+        return False
+    os.makedirs(cache_dir, exist_ok=True)
+    # write next to the entry then rename so readers never see a partial file
+    tmp = os.path.join(cache_dir, 'tmp_' + key + '.' + str(os.getpid()))
+    with open(src, 'rb') as fin, open(tmp, 'wb') as fout:
+        fout.write(fin.read())
+    os.replace(tmp, os.path.join(cache_dir, key + '.py'))
+    cache_evict(cache_dir, max_bytes)
+    return True
+
+
+def cache_evict(cache_dir, max_bytes):
+    # delete least-recently-used entries until the cache fits in max_bytes
+    entries = []
+    for name in os.listdir(cache_dir):
+        if not name.endswith('.py'):
+            continue
+        try:
+            info = os.stat(os.path.join(cache_dir, name))
+        except FileNotFoundError:
+            # evicted by another worker
+            continue
+        entries.append((info.st_mtime, info.st_size, name))
+    total = sum(e[1] for e in entries)
+    for mtime, size, name in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(os.path.join(cache_dir, name))
+        except FileNotFoundError:
+            pass
+        total -= size
+
+
+def claim_job(queue_dir, running_dir):
+    # move the oldest queued job to running/, returns its id or None
+    try:
+        names = sorted(os.listdir(queue_dir))
+    except FileNotFoundError:
+        return None
+    for name in names:
+        try:
+            os.rename(os.path.join(queue_dir, name), os.path.join(running_dir, name))
+        except FileNotFoundError:
+            # claimed by another worker
+            continue
+        return name
+    return None
+
+
+def process_job(job, uploads_dir, templates, cache_dir=None):
+    # generate NC_protocol.py in the job folder
+    jobdir = os.path.join(uploads_dir, job)
+    if not os.path.isdir(jobdir):
+        # job folder expired before the job was processed
+        return
+    status = read_status(jobdir)
+    write_status(jobdir, 'running')
+    template_id = status.get('template_id', '')
+    if template_id:
+        if template_id not in templates:
+            write_status(jobdir, 'error', message='unknown template ' + template_id)
+            return
+        template = io.StringIO(templates[template_id]['text'], newline='')
+    else:
+        template = os.path.join(jobdir, os.path.basename(status.get('template', '')))
+    yaml_file = os.path.join(jobdir, os.path.basename(status.get('yaml', '')))
+    protocol = os.path.join(jobdir, 'NC_protocol.py')
+    tmp = protocol + '.tmp'
+    try:
+        OT_inject_params.inject_file(
+            template, yaml_file, tmp, verbose=False, yaml_dir_first=True)
+        os.replace(tmp, protocol)
+    except Exception as err:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        write_status(jobdir, 'error', message=str(err))
+        return
+    if cache_dir:
+        try:
+            cache_put(cache_dir, status.get('cachekey', ''), protocol)
+        except OSError:
+            # the protocol is made, a failed cache write only costs a later hit
+            pass
+    write_status(jobdir, 'done', message='')
+
+
+def worker(base_dir, templates, poll, once):
+    # process queued jobs until the queue is empty (once) or forever
+    uploads_dir = os.path.join(base_dir, 'uploads')
+    queue_dir = os.path.join(base_dir, 'queue')
+    running_dir = os.path.join(base_dir, 'running')
+    cache_dir = os.path.join(base_dir, 'cache')
+    os.makedirs(running_dir, exist_ok=True)
+    while True:
+        job = claim_job(queue_dir, running_dir)
+        if job is None:
+            if once:
+                return
+            time.sleep(poll)
+            continue
+        try:
+            process_job(job, uploads_dir, templates, cache_dir)
+        except Exception as err:
+            # a failed job must not stop this worker (the pool would shrink)
+            sys.stderr.write('# job ' + job + ' failed: ' + type(err).__name__ + ': ' +
+                             str(err) + '\n')
+            try:
+                write_status(os.path.join(uploads_dir, job), 'error', message=str(err))
+            except OSError:
+                # job folder removed meanwhile (OT2Cleanup.php)
+                pass
+        finally:
+            try:
+                os.remove(os.path.join(running_dir, job))
+            except FileNotFoundError:
+                pass
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='process the OT2MakeProtocol job queue')
+    parser.add_argument('-d', dest='base_dir', default=here,
+                        help='folder of the php pages (with uploads/ and queue/)')
+    parser.add_argument('-t', dest='protocols', default=OT2_registry.default_protocols,
+                        help='NC_protocols folder with the registered templates')
+    parser.add_argument('-w', dest='workers', type=int, default=os.cpu_count(),
+                        help='number of parallel workers')
+    parser.add_argument('-p', dest='poll', type=float, default=0.2,
+                        help='seconds between queue checks when idle')
+    parser.add_argument('--once', action='store_true',
+                        help='exit when the queue is empty')
+    args = parser.parse_args(argv)
+
+    # scan the templates once, the workers share them in memory
+    templates = OT2_registry.scan(args.protocols) if os.path.isdir(args.protocols) else {}
+    OT2_registry.write_catalog(templates, os.path.join(args.base_dir, 'templates.json'))
+
+    procs = [multiprocessing.Process(
+        target=worker, args=(args.base_dir, templates, args.poll, args.once))
+             for _ in range(max(1, args.workers))]
+    for proc in procs:
+        proc.start()
+    try:
+        for proc in procs:
+            proc.join()
+    except KeyboardInterrupt:
+        for proc in procs:
+            proc.terminate()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,383 @@
+#!/usr/bin/env python3
+
+# scriptname: OT_inject_params.py
+# A script to replace placeholders in an Opentrons protocol template
+# placeholders are filled from a yaml file for single variables
+# when the yaml file contains a CSV entry: CSV data is injected on top of the script
+#
+# python port of OT_inject_params.sh (same -i/-y/-o arguments)
+# the yaml is read once and all <placeholders> are replaced in a single pass
+# in memory (no yq / sed process per parameter)
+#
+# Stephane Plaisance VIB-NC September-17-2021 v1.0
+# requires: python3, PyYAML
+#
+# visit our Git: https://github.com/Nucleomics-VIB
+
+import argparse
+import concurrent.futures
+import contextlib
+import csv
+import datetime
+import hashlib
+import io
+import os
+import re
+import sys
+
+import yaml
+
+version = "2.0, 2026-10-18"
+
+usage = '''# Usage: OT_inject_params.py
+#    -i <opentrons protocol template>
+#    -o <output file name (default to "OT2_protocol.py")
+#    -y <yaml parameter file with variables to inject
+#    -h <this help message>
+# batch mode:
+#    -b <manifest file (template,yaml[,output] per line) or folder with yaml files>
+#    -i <template used for the yaml files of a folder (or when missing in the manifest)>
+#    -o <output folder (default to "batch_protocols")>
+#    -j <number of parallel jobs (default to the number of cores)>
+#    -s <summary table (default to <output folder>/batch_summary.tsv)>
+# version: ''' + version
+
+# any <name> token is a candidate placeholder
+placeholder_re = re.compile(r'<(\w+)>')
+
+
+#######################
+## parameter functions
+
+def scalar_values(node):
+    # return the yaml mapping as {key: raw scalar text}
+    # the raw text is used (not the typed value) to inject exactly
+    # what was typed in the yaml (eg. '2.50' stays '2.50')
+    if node is None or not isinstance(node, yaml.MappingNode):
+        return {}
+    values = {}
+    for key, value in node.value:
+        if isinstance(value, yaml.ScalarNode):
+            values[key.value] = value.value
+    return values
+
+
+def read_config(yaml_file):
+    # read the yaml once and return (params, csv_placeholder, csv_filename)
+    with open(yaml_file, 'r') as fh:
+        root = yaml.compose(fh)
+    sections = {}
+    if isinstance(root, yaml.MappingNode):
+        sections = {key.value: value for key, value in root.value}
+    params = scalar_values(sections.get('params'))
+    csv_entries = scalar_values(sections.get('csv'))
+    csv_placeholder, csv_filename = None, None
+    if csv_entries:
+        csv_placeholder, csv_filename = next(iter(csv_entries.items()))
+    return params, csv_placeholder, csv_filename
+
+
+#######################
+## CSV functions
+
+def locate_csv(csv_filename, yaml_file, yaml_dir_first=False):
+    # the CSV is looked up in the current folder first (as in the bash version)
+    # then next to the yaml file (batch mode looks next to the yaml first)
+    candidates = [
+        csv_filename,
+        os.path.join(os.path.dirname(os.path.abspath(yaml_file)), csv_filename)]
+    if yaml_dir_first:
+        candidates.reverse()
+    for candidate in candidates:
+        if os.path.isfile(candidate):
+            return candidate
+    return None
+
+
+def stream_csv(csv_file, out):
+    # copy the CSV data to out as a json-escaped single line
+    # the file is read line by line and never held in memory or passed as
+    # an argument (large cherry-picking CSVs exceed the sed/ARG_MAX limits)
+    # CR are removed, line-ends become '\\n' and trailing empty lines are dropped
+    # returns the number of CSV lines written
+    written = 0
+    pending = 0
+    with open(csv_file, 'r', newline='\n') as fh:
+        for line in fh:
+            line = line.rstrip('\n').replace('\r', '')
+            if not line:
+                pending += 1
+                continue
+            for segment in [''] * pending + [line]:
+                if written:
+                    out.write('\\\\n')
+                out.write(segment)
+                written += 1
+            pending = 0
+    return written
+
+
+def parse_csv(csv_file):
+    # return the json-escaped CSV data as a string
+    buf = io.StringIO()
+    stream_csv(csv_file, buf)
+    return buf.getvalue()
+
+
+#######################
+## injection
+
+def inject_text(text, values):
+    # replace all known <placeholders> in a single pass
+    # unknown <tokens> are left untouched
+    def replace(match):
+        return values.get(match.group(1), match.group(0))
+    return placeholder_re.sub(replace, text)
+
+
+def build_values(yaml_file, datetag=None, verbose=True, yaml_dir_first=False):
+    # collect all placeholder values defined by the yaml file
+    # returns (values, csv_placeholder, csv_file), the CSV data itself is
+    # not loaded (see stream_csv)
+    params, csv_placeholder, csv_filename = read_config(yaml_file)
+    values = dict(params)
+    values['edit_date'] = datetag or datetime.date.today().isoformat()
+
+    if verbose:
+        for param, value in params.items():
+            print("# " + param + " has now value: " + value)
+
+    csv_file = None
+    if csv_filename:
+        csv_file = locate_csv(csv_filename, yaml_file, yaml_dir_first)
+        if csv_file is None:
+            raise FileNotFoundError(
+                "# the CSV file linked in the config file was not found (" +
+                csv_filename + ")")
+
+    return values, csv_placeholder, csv_file
+
+
+def inject_stream(template_fh, out, values, csv_placeholder=None, csv_file=None):
+    # write the template to out with all placeholders replaced
+    # the template is processed line by line and the CSV data is streamed
+    # from its file at the CSV placeholder; returns the number of CSV lines
+    csv_token = '<' + csv_placeholder + '>' if csv_file else None
+    csv_lines = 0
+    for line in template_fh:
+        if csv_token is None or csv_token not in line:
+            out.write(inject_text(line, values))
+            continue
+        parts = line.split(csv_token)
+        out.write(inject_text(parts[0], values))
+        for part in parts[1:]:
+            csv_lines = stream_csv(csv_file, out)
+            out.write(inject_text(part, values))
+    return csv_lines
+
+
+def inject_file(template, yaml_file, protocol, datetag=None, verbose=True,
+                yaml_dir_first=False):
+    # create the protocol from the template and the yaml (+csv) values
+    # template is a file name or an open text stream (eg. a template kept
+    # in memory as io.StringIO)
+    values, csv_placeholder, csv_file = build_values(
+        yaml_file, datetag=datetag, verbose=verbose,
+        yaml_dir_first=yaml_dir_first)
+    if hasattr(template, 'read'):
+        source = contextlib.nullcontext(template)
+    else:
+        source = open(template, 'r', newline='')
+    with source as fh, open(protocol, 'w', newline='') as out:
+        csv_lines = inject_stream(fh, out, values, csv_placeholder, csv_file)
+    if verbose and csv_file:
+        print("# CSV file " + os.path.basename(csv_file) + " found and injected")
+        print("# " + csv_placeholder + " has content: " +
+              str(csv_lines) + " lines (including header)")
+
+
+#######################
+## batch functions
+
+def read_manifest(manifest, template=None, outdir='batch_protocols'):
+    # list of (template, yaml, output, error) jobs from a manifest file
+    # one job per line: template,yaml[,output] (comma or tab separated)
+    # relative paths are relative to the manifest folder, a header line
+    # starting with 'template' and lines starting with '#' are skipped
+    # the -i template is used when the template column is empty
+    base = os.path.dirname(os.path.abspath(manifest))
+    jobs = []
+    with open(manifest, 'r', newline='') as fh:
+        text = fh.read()
+    dialect = 'excel-tab' if '\t' in text else 'excel'
+    for fields in csv.reader(text.splitlines(), dialect):
+        fields = [f.strip() for f in fields]
+        if not any(fields) or fields[0].startswith('#') or fields[0] == 'template':
+            continue
+        fields += [''] * (3 - len(fields))
+        tpl, yml, out = fields[:3]
+        tpl = os.path.join(base, tpl) if tpl else template
+        yml = os.path.join(base, yml)
+        if not out:
+            out = os.path.join(outdir, output_name(tpl, yml, base))
+        elif not os.path.isabs(out):
+            out = os.path.join(outdir, out)
+        jobs.append((tpl, yml, out, ''))
+    return unique_outputs(jobs)
+
+
+def scan_folder(folder, template, outdir='batch_protocols'):
+    # list of (template, yaml, output, error) jobs for all yaml files in folder
+    jobs = []
+    for root, dirs, files in os.walk(folder):
+        dirs.sort()
+        for name in sorted(files):
+            if name.endswith(('.yaml', '.yml')):
+                yml = os.path.join(root, name)
+                jobs.append((template, yml,
+                             os.path.join(outdir, output_name(template, yml, folder)), ''))
+    return unique_outputs(jobs)
+
+
+def output_name(template, yaml_file, base):
+    # dilute_96w_plate_template.py + run1/config.yaml -> dilute_96w_plate_run1_config.py
+    # (the yaml alone when no template is given)
+    rel = os.path.splitext(os.path.relpath(os.path.abspath(yaml_file), os.path.abspath(base)))[0]
+    name = rel.replace(os.sep, '_')
+    if template:
+        stem = os.path.splitext(os.path.basename(template))[0]
+        if stem.endswith('_template'):
+            stem = stem[:-len('_template')]
+        name = stem + '_' + name
+    return name + '.py'
+
+
+def unique_outputs(jobs):
+    # a job writing the output of an earlier job is not run, its error
+    # names the earlier job (parallel jobs would overwrite each other)
+    seen = {}
+    checked = []
+    for template, yaml_file, protocol, error in jobs:
+        key = os.path.normcase(os.path.abspath(protocol))
+        if not error and key in seen:
+            error = ('output ' + protocol + ' is already written for ' +
+                     seen[key][1] + ' (' + (seen[key][0] or 'no template') + ')')
+        seen.setdefault(key, (template, yaml_file))
+        checked.append((template, yaml_file, protocol, error))
+    return checked
+
+
+def run_job(job):
+    # inject one protocol, returns a summary row (never raises)
+    template, yaml_file, protocol, error = job
+    row = {'protocol': protocol, 'template': template or '', 'yaml': yaml_file,
+           'sha256': '', 'status': 'ok', 'error': ''}
+    try:
+        if error:
+            raise ValueError(error)
+        if not template:
+            raise ValueError('no template given for this yaml file')
+        os.makedirs(os.path.dirname(os.path.abspath(protocol)), exist_ok=True)
+        inject_file(template, yaml_file, protocol, verbose=False, yaml_dir_first=True)
+        with open(protocol, 'rb') as fh:
+            row['sha256'] = hashlib.sha256(fh.read()).hexdigest()
+    except Exception as err:
+        row['status'] = 'error'
+        row['error'] = str(err).replace('\n', ' ').replace('\t', ' ')
+    return row
+
+
+def run_batch(jobs, workers=None):
+    # inject all jobs in parallel, rows are returned in job order
+    if not jobs:
+        return []
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(run_job, jobs))
+
+
+def write_summary(rows, summary):
+    # tab-separated summary table, one row per protocol
+    fields = ['protocol', 'sha256', 'status', 'error', 'template', 'yaml']
+    os.makedirs(os.path.dirname(os.path.abspath(summary)), exist_ok=True)
+    with open(summary, 'w', newline='') as fh:
+        writer = csv.DictWriter(fh, fields, dialect='excel-tab')
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+############## MAIN ##############
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(add_help=False, usage=usage)
+    parser.add_argument('-i', dest='template')
+    parser.add_argument('-y', dest='yaml')
+    parser.add_argument('-o', dest='protocol')
+    parser.add_argument('-b', dest='batch')
+    parser.add_argument('-j', dest='jobs', type=int)
+    parser.add_argument('-s', dest='summary')
+    parser.add_argument('-h', dest='help', action='store_true')
+    args = parser.parse_args(argv)
+
+    if args.help:
+        print(usage, file=sys.stderr)
+        return 0
+
+    if args.batch:
+        return main_batch(args)
+
+    # check if template & yaml are provided
+    if not args.template:
+        print("# provide an OT2 protocol template file with placeholders")
+        print(usage)
+        return 1
+
+    if not args.yaml:
+        print("# provide a yaml file with variables to replace the template placeholders")
+        print(usage)
+        return 1
+
+    try:
+        inject_file(args.template, args.yaml, args.protocol or 'OT2_protocol.py')
+    except (OSError, yaml.YAMLError) as err:
+        print(str(err))
+        print(usage)
+        return 1
+
+    return 0
+
+
+def main_batch(args):
+    # generate all protocols of a manifest or a folder of yaml files
+    outdir = args.protocol or 'batch_protocols'
+    if os.path.isdir(args.batch):
+        if not args.template:
+            print("# provide the OT2 protocol template to use for the yaml files")
+            print(usage)
+            return 1
+        jobs = scan_folder(args.batch, args.template, outdir)
+    elif os.path.isfile(args.batch):
+        jobs = read_manifest(args.batch, args.template, outdir)
+    else:
+        print("# the batch manifest or folder was not found (" + args.batch + ")")
+        return 1
+
+    rows = run_batch(jobs, args.jobs)
+    summary = args.summary or os.path.join(outdir, 'batch_summary.tsv')
+    write_summary(rows, summary)
+
+    failed = [row for row in rows if row['status'] != 'ok']
+    print("# " + str(len(rows) - len(failed)) + " of " + str(len(rows)) +
+          " protocols created, summary in " + summary)
+    for row in failed:
+        print("# failed: " + row['yaml'] + ": " + row['error'])
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
+
+
+############################### EXAMPLE ##############################
+# OT_inject_params.py -i template.py -y config.yaml -o my_protocol.py
+#
+# see OT_inject_params.sh for the template, yaml and csv formats
@@ -6,11 +6,11 @@
 # when the yaml file contains a CSV entry: CSV data is injected on top of the script
 #
 # Stephane Plaisance VIB-NC September-17-2021 v1.0
-# requires: sed, yq (https://github.com/mikefarah/yq/ for yaml parsing)
+# requires: sed, perl, yq (https://github.com/mikefarah/yq/ for yaml parsing)
 #
 # visit our Git: https://github.com/Nucleomics-VIB
 
-version="1.1, 2021-09-20"
+version="1.2, 2026-10-18"
 datetag=$(date '+%Y-%m-%d')
 
 usage='# Usage: OT_inject_params.sh
@@ -129,15 +129,22 @@ echo "# ${CSVPLACEHOLDER} has content: ${CSVDATA}"
 function inject_csv() {
 # $1 is ${YAML}
 # inject CSV data at placeholder
+# the CSV is read from its file by perl and never passed on the command line
+# (large cherry-picking files exceed the max argument size of sed)
 CSVPLACEHOLDER=$(get_csv_placeholder "$1")
 CSVFILENAME=$(get_csv_filename "$1" | sed 's/\"//g')
-CSVDATA=$(parse_csv "${CSVFILENAME}")
-# sed -i should be followed by '' under OSX
-if [[ "$OSTYPE" =~ ^[dD]arwin* ]]; then
-  sed -i '' "s/<${CSVPLACEHOLDER}>/$(echo ${CSVDATA} | sed -e 's/\\/\\\\/'g)/" "${PROTOCOL}"
-else
-  sed -i "s/<${CSVPLACEHOLDER}>/$(echo ${CSVDATA} | sed -e 's/\\/\\\\/'g)/" "${PROTOCOL}"
-fi
+CSVPLACEHOLDER="${CSVPLACEHOLDER}" CSVFILENAME="${CSVFILENAME}" \
+  perl -i -pe '
+    BEGIN {
+      open(my $fh, "<", $ENV{CSVFILENAME}) or die "# cannot read $ENV{CSVFILENAME}\n";
+      local $/;
+      $csv = <$fh>;
+      close($fh);
+      $csv =~ s/\r//g;
+      $csv =~ s/\R*\z//;
+      $csv =~ s/\n/\\\\n/g;
+    }
+    s/<\Q$ENV{CSVPLACEHOLDER}\E>/$csv/;' "${PROTOCOL}"
 }
 
 
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+
+# scriptname: bench_inject_csv.py
+# benchmark the CSV injection of OT_inject_params.py with growing CSV sizes
+# random cherry-picking CSVs (repooling format) of 96, 384, 1536 and 6144 rows
+# are injected in a template; the time and the peak python memory are
+# reported for each size (tab-separated table)
+#
+# when yq is available, the bash injector can be timed too (--bash)
+#
+# visit our Git: https://github.com/Nucleomics-VIB
+
+import argparse
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import OT_inject_params  # noqa: E402
+
+default_template = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)),
+    '..', '..', 'NC_protocols', 'NC_repooling_with_dilution', 'template',
+    'NC_repooling_with_dilution_template.py')
+
+default_sizes = [96, 384, 1536, 6144]
+
+rows = 'ABCDEFGH'
+
+
+def write_csv(path, nrows, seed=0):
+    # one line per well, plates of 96 wells are filled in order
+    rng = random.Random(seed)
+    with open(path, 'w') as fh:
+        fh.write('source_plate,source_well,source_volume,dil_factor\n')
+        for i in range(nrows):
+            plate, idx = divmod(i, 96)
+            well = rows[idx // 12] + str(idx % 12 + 1)
+            vol = round(rng.uniform(2.0, 6.0), 1)
+            dil = rng.choice(['1', '1', '1', '10', '40'])
+            fh.write(str(plate + 1) + ',' + well + ',' + str(vol) + ',' + dil + '\n')
+
+
+def write_yaml(path, csv_name):
+    with open(path, 'w') as fh:
+        fh.write(
+            'params:\n'
+            '  min_vol: 2.5\n'
+            '  sp_type: "biorad_96_wellplate_200ul_pcr"\n'
+            '  dp_type: "biorad_96_wellplate_200ul_pcr"\n'
+            'csv:\n'
+            '  uploaded_csv: "' + csv_name + '"\n')
+
+
+def bench_python(template, yaml_file, protocol, repeats):
+    # best time over repeats and peak traced memory of one run
+    best = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        OT_inject_params.inject_file(template, yaml_file, protocol, verbose=False)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    tracemalloc.start()
+    OT_inject_params.inject_file(template, yaml_file, protocol, verbose=False)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return best, peak
+
+
+def bench_bash(template, yaml_file, protocol, workdir):
+    # wall time of one run of the bash injector, None when it failed
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                          'OT_inject_params.sh')
+    start = time.perf_counter()
+    result = subprocess.run(
+        ['bash', script, '-i', template, '-y', yaml_file, '-o', protocol],
+        cwd=workdir, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    elapsed = time.perf_counter() - start
+    return elapsed if result.returncode == 0 else None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='benchmark CSV injection for growing CSV sizes')
+    parser.add_argument('-i', dest='template', default=default_template,
+                        help='template with an <uploaded_csv> placeholder')
+    parser.add_argument('-s', dest='sizes', type=int, nargs='+',
+                        default=default_sizes, help='CSV row counts')
+    parser.add_argument('-r', dest='repeats', type=int, default=5,
+                        help='repeats per size (best time is kept)')
+    parser.add_argument('--bash', action='store_true',
+                        help='also time OT_inject_params.sh (requires yq)')
+    args = parser.parse_args(argv)
+
+    if args.bash and shutil.which('yq') is None:
+        print('# yq is not installed or not in PATH, skipping the bash injector',
+              file=sys.stderr)
+        args.bash = False
+
+    template = os.path.abspath(args.template)
+    header = ['rows', 'csv_bytes', 'protocol_bytes', 'time_ms', 'peak_mem_kb']
+    if args.bash:
+        header.append('bash_time_ms')
+    print('\t'.join(header))
+
+    with tempfile.TemporaryDirectory() as workdir:
+        for size in args.sizes:
+            csv_name = 'data_' + str(size) + '.csv'
+            csv_file = os.path.join(workdir, csv_name)
+            yaml_file = os.path.join(workdir, 'config_' + str(size) + '.yaml')
+            protocol = os.path.join(workdir, 'NC_protocol_' + str(size) + '.py')
+            write_csv(csv_file, size)
+            write_yaml(yaml_file, csv_name)
+
+            elapsed, peak = bench_python(template, yaml_file, protocol, args.repeats)
+            row = [str(size),
+                   str(os.path.getsize(csv_file)),
+                   str(os.path.getsize(protocol)),
+                   '%.2f' % (elapsed * 1000),
+                   '%.1f' % (peak / 1024)]
+            if args.bash:
+                bash_time = bench_bash(template, yaml_file, protocol, workdir)
+                row.append('failed' if bash_time is None else '%.2f' % (bash_time * 1000))
+            print('\t'.join(row))
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())